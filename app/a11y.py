@@ -0,0 +1,122 @@
+from typing import Dict, List, NamedTuple, Optional
+import json
+import zlib
+
+# Roles that only group other nodes; without a name they are left out and their children lifted.
+STRUCTURAL_ROLES = {'generic', 'none', 'presentation', 'group', 'section', 'paragraph', 'LineBreak'}
+TEXT_ROLES = {'text', 'StaticText'}
+# Properties shown after the name, in this order. Other properties are dropped.
+SHOWN_PROPERTIES = ('value', 'description', 'checked', 'pressed', 'selected', 'expanded',
+                    'disabled', 'required', 'readonly', 'focused', 'level')
+
+
+class SnapshotNode(NamedTuple):
+    depth: int
+    parent: Optional[str]
+    line: str
+
+
+class CompactSnapshot(NamedTuple):
+    """ An accessibility snapshot as short indented lines, one node per line.
+
+    Attributes:
+        text (str): The indented lines.
+        nodes (dict): The nodes by id, in document order.
+    """
+    text: str
+    nodes: Dict[str, SnapshotNode]
+
+
+def _node_line(node: dict) -> str:
+    parts = [node.get('role', '')]
+    name = node.get('name')
+    if name:
+        parts.append(json.dumps(name, ensure_ascii=False))
+    for key in SHOWN_PROPERTIES:
+        value = node.get(key)
+        if value is None or value is False or value == '':
+            continue
+        parts.append(key if value is True else f'{key}={value}')
+    return ' '.join(parts)
+
+
+def _node_id(parent: Optional[str], line_key: str, occurrence: int) -> str:
+    key = f'{parent}/{line_key}/{occurrence}'.encode('utf-8')
+    return format(zlib.crc32(key), '08x')[:6]
+
+
+def encode_snapshot(snapshot: Optional[dict]) -> CompactSnapshot:
+    """
+    Encode a Playwright accessibility snapshot compactly.
+
+    Unnamed structural nodes and empty text nodes are left out, a text child
+    repeating its parent's name is dropped, and every kept node gets an id
+    derived from its ancestors, role, name and position among identical
+    siblings, so the same node has the same id in later snapshots of the page.
+
+    Args:
+        snapshot (dict, optional): The result of `page.accessibility.snapshot()`.
+    """
+    nodes: Dict[str, SnapshotNode] = dict()
+    lines: List[str] = []
+
+    def visit(node: dict, depth: int, parent: Optional[str], seen: Dict[str, int]):
+        role = node.get('role', '')
+        name = node.get('name') or ''
+        children = node.get('children') or []
+        if role in TEXT_ROLES and not name.strip():
+            return
+        if role in STRUCTURAL_ROLES and not name:
+            for child in children:
+                visit(child, depth, parent, seen)
+            return
+
+        line = _node_line(node)
+        # The root is keyed by its role only, so a new page title keeps the ids of the page.
+        line_key = f'{role}:{name}' if parent is not None else role
+        occurrence = seen.get(line_key, 0)
+        seen[line_key] = occurrence + 1
+        node_id = _node_id(parent, line_key, occurrence)
+        while node_id in nodes:
+            occurrence += 1
+            node_id = _node_id(parent, line_key, occurrence)
+        nodes[node_id] = SnapshotNode(depth, parent, line)
+        lines.append(f'{"  " * depth}[{node_id}] {line}')
+
+        if len(children) == 1 and children[0].get('role') in TEXT_ROLES \
+                and children[0].get('name') == name and not children[0].get('children'):
+            return
+        child_seen: Dict[str, int] = dict()
+        for child in children:
+            visit(child, depth + 1, node_id, child_seen)
+
+    if snapshot is not None:
+        visit(snapshot, 0, None, dict())
+    return CompactSnapshot('\n'.join(lines), nodes)
+
+
+def diff_snapshots(old: CompactSnapshot, new: CompactSnapshot) -> str:
+    """
+    Describe the nodes added, changed and removed between two snapshots of a page.
+    Falls back to the whole new snapshot when the diff would not be shorter.
+    """
+    added, changed, removed = [], [], []
+    for node_id, node in new.nodes.items():
+        old_node = old.nodes.get(node_id)
+        if old_node is None:
+            where = f' (in [{node.parent}])' if node.parent is not None else ''
+            added.append(f'+ [{node_id}] {node.line}{where}')
+        elif old_node.line != node.line:
+            changed.append(f'~ [{node_id}] {node.line}')
+    for node_id, node in old.nodes.items():
+        if node_id not in new.nodes:
+            removed.append(f'- [{node_id}] {node.line}')
+
+    if not (added or changed or removed):
+        return '[The webpage did not change since the last snapshot]'
+    header = (f'[Changes since the last snapshot of this webpage: {len(added)} added, '
+              f'{len(changed)} changed, {len(removed)} removed]')
+    diff = '\n'.join([header] + added + changed + removed)
+    if len(diff) >= len(new.text):
+        return new.text
+    return diff
@@ -0,0 +1,187 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import atexit
+import threading
+import time
+
+from botplayers.util import run_sync
+
+
+class _Session:
+    __slots__ = ('context', 'page', 'lock', 'in_use', 'last_used')
+
+    def __init__(self, context, page):
+        self.context = context
+        self.page = page
+        self.lock = asyncio.Lock()
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class BrowserPool:
+    """ One Chromium process shared by many explorers, with a browser context and page per key.
+
+    The same key always gets the same page, so an explorer keeps its history
+    and cookies. Operations on one page run one at a time; operations on
+    different pages run concurrently, at most `max_concurrency` at a time.
+
+    Eviction is lazy: when a key opens a new page, the pages unused for
+    `idle_timeout` seconds are closed, and then the least recently used page
+    if `max_pages` pages are still open. Idle pages stay open until then;
+    call `evict_idle` to close them sooner, or `release` when a key is done.
+
+    The pool is driven by async Playwright and belongs to the event loop that
+    first uses it, normally the botplayers event loop.
+
+    Args:
+        max_pages (int, optional): The maximum number of open pages. Defaults to 16.
+        max_concurrency (int, optional): The maximum number of pages used at the same time. Defaults to 8.
+        idle_timeout (float, optional): Seconds before an unused page may be closed. Defaults to 300.
+        launch_options (dict, optional): The arguments of `chromium.launch`, e.g. headless. Defaults to None.
+        context_options (dict, optional): The arguments of `browser.new_context`, e.g. viewport. Defaults to None.
+    """
+
+    def __init__(self, max_pages: int = 16, max_concurrency: int = 8,
+                 idle_timeout: float = 300.0,
+                 launch_options: Optional[Dict[str, Any]] = None,
+                 context_options: Optional[Dict[str, Any]] = None):
+        assert max_concurrency <= max_pages, 'max_concurrency cannot exceed max_pages.'
+        self.max_pages = max_pages
+        self.max_concurrency = max_concurrency
+        self.idle_timeout = idle_timeout
+        self.launch_options = dict(launch_options or {})
+        self.context_options = dict(context_options or {})
+
+        self.num_launches = 0
+        self.num_pages_opened = 0
+        self._playwright = None
+        self._browser = None
+        self._sessions: 'OrderedDict[Hashable, _Session]' = OrderedDict()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _get_browser(self):
+        if self._browser is None:
+            from playwright.async_api import async_playwright
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(**self.launch_options)
+            self.num_launches += 1
+        return self._browser
+
+    async def _close_session(self, key: Hashable):
+        session = self._sessions.pop(key)
+        await session.context.close()
+
+    async def _evict_idle(self):
+        now = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            if session.in_use == 0 and now - session.last_used > self.idle_timeout:
+                await self._close_session(key)
+
+    async def _evict(self):
+        await self._evict_idle()
+        if len(self._sessions) >= self.max_pages:
+            # The least recently used page that nobody is using.
+            for key, session in self._sessions.items():
+                if session.in_use == 0:
+                    await self._close_session(key)
+                    break
+
+    async def _session(self, key: Hashable,
+                       setup: Optional[Callable[[Any], Awaitable[None]]]) -> _Session:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+            else:
+                await self._evict()
+                browser = await self._get_browser()
+                context = await browser.new_context(**self.context_options)
+                if setup is not None:
+                    await setup(context)
+                session = self._sessions[key] = _Session(context, await context.new_page())
+                self.num_pages_opened += 1
+            session.in_use += 1
+            return session
+
+    @asynccontextmanager
+    async def page(self, key: Hashable, setup: Optional[Callable[[Any], Awaitable[None]]] = None):
+        """
+        Use the page of a key, opening it if needed.
+
+        Args:
+            key (hashable): Who the page belongs to, e.g. an explorer.
+            setup (callable, optional): Awaited with the browser context when it is created,
+                e.g. to install request routes. Defaults to None.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            session = await self._session(key, setup)
+            try:
+                async with session.lock:
+                    yield session.page
+            finally:
+                session.in_use -= 1
+                session.last_used = time.monotonic()
+
+    async def evict_idle(self):
+        """ Close the pages unused for `idle_timeout` seconds now. """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await self._evict_idle()
+
+    def has_page(self, key: Hashable) -> bool:
+        """ Check whether a key has an open page. """
+        return key in self._sessions
+
+    async def release(self, key: Hashable):
+        """ Close the page of a key, if it is open. """
+        if key in self._sessions:
+            await self._close_session(key)
+
+    @property
+    def num_pages(self) -> int:
+        return len(self._sessions)
+
+    async def aclose(self):
+        """ Close every page and the browser. """
+        for key in list(self._sessions):
+            await self._close_session(key)
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def close(self):
+        """ Synchronous counterpart of `aclose`. """
+        if self._browser is not None or self._playwright is not None:
+            run_sync(self.aclose())
+
+
+_shared_pool: Optional[BrowserPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool() -> BrowserPool:
+    """ Get the pool used by explorers created without one. It is closed at exit. """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = BrowserPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
+
+
+def set_shared_pool(pool: Optional[BrowserPool]):
+    """ Set the pool used by explorers created without one. Pass None to get a new default pool. """
+    global _shared_pool
+    with _shared_pool_lock:
+        _shared_pool = pool
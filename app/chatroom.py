@@ -1,5 +1,5 @@
-from typing import Dict
-from botplayers import agent_callable, InteractiveSpace, Agent
+from typing import Dict, Optional
+from botplayers import agent_callable, InteractiveSpace, Agent, MessageBus, World
 
 
 def read_prompt(prompt_file, **args):
@@ -10,6 +10,19 @@ def read_prompt(prompt_file, **args):
 
 class ChatRoom(InteractiveSpace):
     agents: Dict[str, Agent] = dict()
+    bus: MessageBus = None
+    topic: str = 'chatroom'
+
+    def __init__(self, bus: Optional[MessageBus] = None):
+        self.agents = dict()
+        self.bus = bus if bus is not None else MessageBus()
+
+    def join(self, agent: Agent):
+        """Let an agent join this room. Messages reach it through its inbox."""
+        self.agents[agent.name] = agent
+        self.bus.subscribe(agent.name, self.topic)
+        agent.inbox = self.bus.inbox(agent.name)
+        return self
 
     @agent_callable
     def get_person_names_in_this_room(self):
@@ -28,10 +41,8 @@ class ChatRoom(InteractiveSpace):
         Args:
             content: the content to say.
         """
-        for name, agent in self.agents.items():
-            if name != agent_name:
-                agent.receive_message(
-                    {'role': 'user', 'content': f'[{agent_name} says in public]: {content}'})
+        self.bus.publish(
+            self.topic, agent_name, f'[{agent_name} says in public]: {content}')
         return '[everyone might heard what you say]'
 
     @agent_callable
@@ -46,8 +57,8 @@ class ChatRoom(InteractiveSpace):
             return f'[{person_name} is not in this room]'
         if agent_name == person_name:
             return f'[{person_name} is yourself]'
-        self.agents[person_name].receive_message(
-            {'role': 'user', 'content': f'[{agent_name} says to you in private]: {content}'})
+        self.bus.send(
+            person_name, agent_name, f'[{agent_name} says to you in private]: {content}')
         return f'[{person_name} might heard what you say]'
 
     @agent_callable
@@ -58,6 +69,7 @@ class ChatRoom(InteractiveSpace):
             agent_name: the name of the agent to logout.
         """
         self.agents.pop(agent_name)
+        self.bus.unsubscribe(agent_name)
         return f'[{agent_name} has left the chat room]'
 
     def someone_say_to_everyone(self, content: str):
@@ -66,9 +78,8 @@ class ChatRoom(InteractiveSpace):
         Args:
             content: the content to say.
         """
-        content = f'[Someone says in public]: {content}'
-        for _, agent in self.agents.items():
-            agent.receive_message({'role': 'user', 'content': content})
+        self.bus.publish(
+            self.topic, None, f'[Someone says in public]: {content}')
 
 
 if __name__ == '__main__':
@@ -101,7 +112,8 @@ if __name__ == '__main__':
     ]
 
     for agent in agents:
-        room.agents[agent.name] = agent
+        room.join(agent)
+    world = World(agents)
 
     while True:
         user_message = input('>> ')
@@ -109,6 +121,4 @@ if __name__ == '__main__':
             break
         if user_message.strip() != '':
             room.someone_say_to_everyone(user_message)
-        agents = list(room.agents.values())
-        for agent in agents:
-            agent.think_and_act()
+        world.run_round_sync()
@@ -1,38 +1,32 @@
+from typing import Optional
 import os
-from botplayers import agent_callable, Agent, InteractiveSpace
+from botplayers import agent_callable, Agent, InteractiveSpace, ResultGovernor
 from botplayers.util import print_in_color
 
-
-def run_jupyter_code(script, globals=None, locals=None):
-    '''Execute a script and return the value of the last expression'''
-    import ast
-    stmts = list(ast.iter_child_nodes(ast.parse(script)))
-    if not stmts:
-        return None
-    # print(stmts[-1].__dict__)
-    if isinstance(stmts[-1], ast.Expr):
-        # the last one is an expression and we will try to return the results
-        # so we first execute the previous statements
-        if len(stmts) > 1:
-            exec(compile(ast.Module(
-                body=stmts[:-1], type_ignores=[]),
-                filename="<ast>", mode="exec"), globals, locals)
-        # then we eval the last one
-        return eval(compile(ast.Expression(body=stmts[-1].value),
-                            filename="<ast>", mode="eval"), globals, locals)
-    else:
-        # otherwise we just execute the entire code
-        return exec(script, globals, locals)
+from app.kernels import KernelPool, run_jupyter_code  # noqa: F401
 
 
 class Env(InteractiveSpace):
+    """ Lets an agent run Python code and see its files.
+
+    Code runs in a kernel process per agent, in the agent's own directory of
+    the workspace, so variables persist between calls and agents run code in
+    parallel.
+
+    Args:
+        kernels (KernelPool, optional): Where code runs. Defaults to a pool in `workspace`.
+    """
     workspace: str = '.workspace'
 
+    def __init__(self, kernels: Optional[KernelPool] = None):
+        self.kernels = kernels if kernels is not None else KernelPool(workspace=self.workspace)
+
     @agent_callable
-    def run_code(self, python_code: str):
+    async def run_code(self, python_code: str, agent_name: str):
         """Run python code.
         Yes! You can run any Python code here to accomplish anything you want!
          Return the value of the last expression.
+        Variables are kept between calls.
 
         Args:
             python_code: the Python code to be run.
@@ -41,39 +35,33 @@ class Env(InteractiveSpace):
             result: the result of running the Python code.
         """
         print_in_color(python_code, 'green')
-        prevdir = os.path.abspath(os.curdir)
-        workspace = os.path.abspath(self.workspace)
-        try:
-            os.chdir(workspace)
-            result = run_jupyter_code(python_code)
-        except Exception as e:
-            os.chdir(prevdir)
-            raise e
-        os.chdir(prevdir)
-        return {'result': result}
+        return await self.kernels.arun(agent_name, python_code)
 
     @agent_callable
-    def list_files(self):
+    def list_files(self, agent_name: str):
         """List all files in the current directory.
 
         Returns:
             files: the list of files.
         """
-        import os
-        return {'files': os.listdir(self.workspace)}
+        workspace = self.kernels.workspace_for(agent_name)
+        if not os.path.isdir(workspace):
+            return {'files': []}
+        return {'files': os.listdir(workspace)}
 
 
 if __name__ == '__main__':
     prompt = "You are CodeGPT. \n\n#Tools\n\n##Functions\n\nOnly call functions that you are provided with."
 
     env = Env()
-    os.makedirs(env.workspace, exist_ok=True)
+    env.kernels.warm_up()
 
     agent = Agent('CodeGPT', prompt=prompt,
                   engine='gpt-4',
                   interactive_objects=[env],
                   function_call_repeats=10,
-                  ignore_none_function_messages=False)
+                  ignore_none_function_messages=False,
+                  result_governor=ResultGovernor())
 
     while True:
         user_message = input('>> ')
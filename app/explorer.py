@@ -1,17 +1,85 @@
-import yaml
+from typing import FrozenSet, NamedTuple, Optional
+from array import array
+from collections import OrderedDict, deque
+import bisect
+import time
+
 import tiktoken
-from playwright.sync_api import sync_playwright
 
 from botplayers import Agent, InteractiveSpace, agent_callable
 from botplayers.util import print_in_color
 
+from app.a11y import CompactSnapshot, diff_snapshots, encode_snapshot
+from app.browser_pool import BrowserPool, get_shared_pool
+
 TOKEN_ENCODING = tiktoken.encoding_for_model('gpt-3.5-turbo')
+CACHED_SNAPSHOT_NOTE = ('[The snapshot from an earlier visit of this page, '
+                        'use refresh_snapshot() to see its current state]\n')
+
+
+class LoadPolicy(NamedTuple):
+    """ How an explorer loads webpages.
+
+    Attributes:
+        wait_until (str): When navigation is done: 'commit', 'domcontentloaded', 'load' or 'networkidle'.
+        timeout (float, optional): Seconds before navigation fails, None for Playwright's default.
+        blocked_resource_types (frozenset): The request resource types to abort, e.g. 'image' or 'font'.
+    """
+    wait_until: str = 'load'
+    timeout: Optional[float] = None
+    blocked_resource_types: FrozenSet[str] = frozenset()
+
+
+# The a11y snapshot does not use images, fonts or media, and the DOM is complete once it is parsed.
+FAST_LOAD = LoadPolicy(wait_until='domcontentloaded', timeout=15.0,
+                       blocked_resource_types=frozenset({'image', 'media', 'font'}))
+
+
+class NavigationTiming(NamedTuple):
+    """ The cost of one navigation of an explorer.
+
+    Attributes:
+        action (str): 'browse', 'back' or 'refresh'.
+        url (str): The URL navigated to, or the URL of the page after going back.
+        load_seconds (float): The seconds until navigation was done.
+        snapshot_seconds (float): The seconds spent taking and encoding the snapshot, 0 if it was cached.
+        blocked_requests (int): The number of requests aborted by the load policy during the navigation.
+        error (str, optional): Why navigation failed, None if it succeeded.
+    """
+    action: str
+    url: str
+    load_seconds: float
+    snapshot_seconds: float
+    blocked_requests: int
+    error: Optional[str] = None
 
 
 class Explorer(InteractiveSpace):
-    playwright = None
-    browser = None
-    page = None
+    """ Lets an agent browse webpages through their accessibility snapshots.
+
+    Explorers share one browser through a BrowserPool and each explorer
+    browses in its own page, so give every agent its own explorer to let
+    them browse in parallel.
+
+    Snapshots are shown in a compact indented format with stable node ids.
+    The snapshots of the last visited URLs are cached, so going back shows
+    the cached snapshot at once, labelled as such. With `diff_snapshots`,
+    refresh_snapshot shows only the nodes that changed since the snapshot
+    last shown, as long as the page did not navigate in between; navigating
+    always shows the full snapshot.
+
+    Args:
+        pool (BrowserPool, optional): Where the pages come from. Defaults to the shared pool.
+        diff_snapshots (bool, optional): Whether refresh_snapshot shows only the changed nodes. Defaults to False.
+        snapshot_cache_size (int, optional): The number of URLs whose snapshot is cached. Defaults to 32.
+        load_policy (LoadPolicy, optional): How webpages are loaded, e.g. FAST_LOAD. Defaults to waiting for
+            the load event without blocking requests.
+    """
+    pool: BrowserPool = None
+    diff_snapshots: bool = False
+    snapshot_cache_size: int = 32
+    load_policy: LoadPolicy = LoadPolicy()
+    blocked_requests: int = 0
 
     last_result = None
     last_result_starting_idx = 0
@@ -19,33 +87,145 @@ class Explorer(InteractiveSpace):
 
     max_visible_tokens = 300
 
-    def setup(self):
-        if self.playwright is None:
-            self.playwright = sync_playwright().start()
-        if self.browser is None:
-            self.browser = self.playwright.chromium.launch()
-        if self.page is None:
-            self.page = self.browser.new_page()
+    _tokens_source = None
+    _tokens = None
+    _token_offsets = None
+    # The URL of the snapshot last shown, None after a navigation.
+    _shown_url = None
+
+    def __init__(self, pool: Optional[BrowserPool] = None, diff_snapshots: bool = False,
+                 snapshot_cache_size: int = 32,
+                 load_policy: Optional[LoadPolicy] = None):
+        self.pool = pool if pool is not None else get_shared_pool()
+        self.diff_snapshots = diff_snapshots
+        self.snapshot_cache_size = snapshot_cache_size
+        if load_policy is not None:
+            self.load_policy = load_policy
+        self.navigation_timings = deque(maxlen=1000)
+        self._snapshots: 'OrderedDict[str, CompactSnapshot]' = OrderedDict()
+
+    async def _setup_context(self, context):
+        """ Abort the requests of the blocked resource types in a new browser context. """
+        blocked_resource_types = self.load_policy.blocked_resource_types
+        if not blocked_resource_types:
+            return
+
+        async def route(route):
+            if route.request.resource_type in blocked_resource_types:
+                self.blocked_requests += 1
+                await route.abort()
+            else:
+                await route.continue_()
+        await context.route('**/*', route)
+
+    def _page(self):
+        return self.pool.page(self, setup=self._setup_context)
+
+    def _navigation_kwargs(self) -> dict:
+        kwargs = {'wait_until': self.load_policy.wait_until}
+        if self.load_policy.timeout is not None:
+            kwargs['timeout'] = self.load_policy.timeout * 1000
+        return kwargs
+
+    def _record_navigation(self, action: str, url: str, start: float, loaded: float,
+                           blocked_requests: int, error: Optional[str] = None):
+        end = time.perf_counter()
+        self.navigation_timings.append(NavigationTiming(
+            action=action, url=url,
+            load_seconds=loaded - start,
+            snapshot_seconds=end - loaded,
+            blocked_requests=self.blocked_requests - blocked_requests,
+            error=error,
+        ))
+
+    @staticmethod
+    def _navigation_error(e: Exception, url: str) -> str:
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+        if isinstance(e, PlaywrightTimeoutError):
+            return f'Loading {url} timed out.'
+        return f'Loading {url} failed: {e}'.split('\n')[0]
+
+    async def close(self):
+        """ Close the page of the explorer. """
+        await self.pool.release(self)
+
+    def _last_result_tokens(self) -> array:
+        """ Get the tokens of the last result, encoded once per result. """
+        if self._tokens_source is not self.last_result:
+            self._tokens = array('I', TOKEN_ENCODING.encode(self.last_result))
+            self._token_offsets = None
+            self._tokens_source = self.last_result
+        return self._tokens
+
+    def _last_result_token_offsets(self) -> array:
+        """ Get the character offset of every token of the last result, computed on the first search. """
+        tokens = self._last_result_tokens()
+        if self._token_offsets is None:
+            _, offsets = TOKEN_ENCODING.decode_with_offsets(tokens.tolist())
+            self._token_offsets = array('I', offsets)
+        return self._token_offsets
+
+    def last_result_num_pages(self) -> int:
+        return max(1, -(-len(self._last_result_tokens()) // self.max_visible_tokens))
 
     def last_result_visible_part(self):
         text = self.last_result
-        tokens = TOKEN_ENCODING.encode(text)
+        tokens = self._last_result_tokens()
         if len(tokens) > self.max_visible_tokens:
-            text = TOKEN_ENCODING.decode(
-                tokens[self.last_result_starting_idx:self.last_result_starting_idx + self.max_visible_tokens])
-            if self.last_result_starting_idx > 0:
+            start = self.last_result_starting_idx
+            end = start + self.max_visible_tokens
+            text = TOKEN_ENCODING.decode(tokens[start:end].tolist())
+            if start > 0:
                 text = '... ' + text
-            if self.last_result_starting_idx + self.max_visible_tokens < len(tokens):
+            page = start // self.max_visible_tokens + 1
+            if end < len(tokens):
                 text = text + ' ...'
-                text = '[Showing {} to {} tokens from {} tokens in total, use show_more() to see more]\n{}'.format(
-                    self.last_result_starting_idx, self.last_result_starting_idx + self.max_visible_tokens, len(tokens), text)
+                text = ('[Showing {} to {} tokens from {} tokens in total (page {} of {}), '
+                        'use show_more() or show_page() to see more]\n{}').format(
+                    start, end, len(tokens), page, self.last_result_num_pages(), text)
             else:
-                text = '[This is the end of the text]\n{}'.format(text)
+                text = '[This is the end of the text (page {} of {})]\n{}'.format(
+                    page, self.last_result_num_pages(), text)
         print_in_color(text, 'orange')
         return text
 
+    def _cached_snapshot(self, url: str) -> Optional[CompactSnapshot]:
+        snapshot = self._snapshots.get(url)
+        if snapshot is not None:
+            self._snapshots.move_to_end(url)
+        return snapshot
+
+    def _cache_snapshot(self, url: str, snapshot: CompactSnapshot):
+        self._snapshots[url] = snapshot
+        self._snapshots.move_to_end(url)
+        while len(self._snapshots) > self.snapshot_cache_size:
+            self._snapshots.popitem(last=False)
+
+    async def _snapshot_text(self, page, diff: bool = False) -> str:
+        """
+        Take a snapshot of the page and get it, or with `diff` its diff from the snapshot last shown
+        if diffs are enabled and the page did not navigate since.
+        """
+        snapshot = encode_snapshot(await page.accessibility.snapshot())
+        previous = None
+        if diff and self.diff_snapshots and self._shown_url == page.url:
+            previous = self._cached_snapshot(page.url)
+        self._cache_snapshot(page.url, snapshot)
+        self._shown_url = page.url
+        if previous is not None:
+            return diff_snapshots(previous, snapshot)
+        return snapshot.text
+
+    def _show_snapshot(self, text: str):
+        self.last_result = text
+        self.last_result_starting_idx = 0
+        self.last_result_name = 'a11y_snapshot'
+
+        trimmed_text = self.last_result_visible_part()
+        return {'a11y_snapshot': trimmed_text}
+
     @agent_callable
-    def browse_webpage(self, url: str):
+    async def browse_webpage(self, url: str):
         """Browse a webpage.
 
         Args:
@@ -54,53 +234,114 @@ class Explorer(InteractiveSpace):
         Returns:
             a11y_snapshot: the accessibility (a11y) snapshot of the current webpage.
         """
-        self.setup()
+        from playwright.async_api import Error as PlaywrightError
 
-        self.page.goto(url)
-        a11y_snapshot = self.page.accessibility.snapshot()
+        async with self._page() as page:
+            start, blocked_requests = time.perf_counter(), self.blocked_requests
+            self._shown_url = None
+            try:
+                await page.goto(url, **self._navigation_kwargs())
+            except PlaywrightError as e:
+                error = self._navigation_error(e, url)
+                self._record_navigation('browse', url, start, time.perf_counter(), blocked_requests, error)
+                return {'error': error}
+            loaded = time.perf_counter()
+            text = await self._snapshot_text(page)
+            self._record_navigation('browse', page.url, start, loaded, blocked_requests)
+        return self._show_snapshot(text)
 
-        a11y_snapshot_txt = yaml.safe_dump(
-            a11y_snapshot, indent=2, allow_unicode=True)
+    @agent_callable
+    async def backward_webpage(self):
+        """Go back to the previous webpage.
 
-        self.last_result = a11y_snapshot_txt
-        self.last_result_starting_idx = 0
-        self.last_result_name = 'a11y_snapshot'
+        Returns:
+            a11y_snapshot: the accessibility (a11y) snapshot of the current webpage after going back, maybe cached.
+        """
+        from playwright.async_api import Error as PlaywrightError
 
-        trimmed_text = self.last_result_visible_part()
-        return {'a11y_snapshot': trimmed_text}
+        async with self._page() as page:
+            start, blocked_requests = time.perf_counter(), self.blocked_requests
+            kwargs = self._navigation_kwargs()
+            self._shown_url = None
+            try:
+                await page.go_back(**dict(kwargs, wait_until='commit'))
+                snapshot = self._cached_snapshot(page.url)
+                if snapshot is not None:
+                    loaded = time.perf_counter()
+                    self._record_navigation('back', page.url, start, loaded, blocked_requests)
+                    self._shown_url = page.url
+                    return self._show_snapshot(CACHED_SNAPSHOT_NOTE + snapshot.text)
+                if kwargs['wait_until'] != 'commit':
+                    await page.wait_for_load_state(kwargs['wait_until'], timeout=kwargs.get('timeout'))
+            except PlaywrightError as e:
+                error = self._navigation_error(e, page.url)
+                self._record_navigation('back', page.url, start, time.perf_counter(), blocked_requests, error)
+                return {'error': error}
+            loaded = time.perf_counter()
+            text = await self._snapshot_text(page)
+            self._record_navigation('back', page.url, start, loaded, blocked_requests)
+        return self._show_snapshot(text)
 
     @agent_callable
-    def backward_webpage(self):
-        """Go back to the previous webpage.
+    async def refresh_snapshot(self):
+        """Take the accessibility (a11y) snapshot of the current webpage again, e.g. after it changed.
 
         Returns:
-            a11y_snapshot: the accessibility (a11y) snapshot of the current webpage after going back.
+            a11y_snapshot: the snapshot, or only the nodes that changed when diffs are enabled.
         """
-        self.setup()
-
-        self.page.go_back()
-        a11y_snapshot = self.page.accessibility.snapshot()
+        async with self._page() as page:
+            start = time.perf_counter()
+            text = await self._snapshot_text(page, diff=True)
+            self._record_navigation('refresh', page.url, start, start, self.blocked_requests)
+        return self._show_snapshot(text)
 
-        a11y_snapshot_txt = yaml.safe_dump(
-            a11y_snapshot, indent=2, allow_unicode=True)
+    @agent_callable
+    def show_more(self):
+        """Show more of the last result."""
+        self.last_result_starting_idx += self.max_visible_tokens
+        trimmed_text = self.last_result_visible_part()
+        return {'a11y_snapshot': trimmed_text}
 
-        self.last_result = a11y_snapshot_txt
-        self.last_result_starting_idx = 0
-        self.last_result_name = 'a11y_snapshot'
+    @agent_callable
+    def show_page(self, page: int):
+        """Show a page of the last result.
 
+        Args:
+            page: the number of the page, starting from 1.
+        """
+        if self.last_result is None:
+            return {'error': 'There is no result to show.'}
+        num_pages = self.last_result_num_pages()
+        if not 1 <= page <= num_pages:
+            return {'error': f'There are {num_pages} pages.'}
+        self.last_result_starting_idx = (page - 1) * self.max_visible_tokens
         trimmed_text = self.last_result_visible_part()
         return {'a11y_snapshot': trimmed_text}
 
     @agent_callable
-    def show_more(self):
-        """Show more of the last result."""
-        self.last_result_starting_idx += self.max_visible_tokens
+    def find_in_result(self, text: str, occurrence: int = 1):
+        """Show the page of the last result that contains a text.
+
+        Args:
+            text: the text to find.
+            occurrence: which occurrence of the text to show, starting from 1.
+        """
+        if self.last_result is None:
+            return {'error': 'There is no result to show.'}
+        position = -1
+        for _ in range(max(occurrence, 1)):
+            position = self.last_result.find(text, position + 1)
+            if position < 0:
+                return {'error': f'"{text}" was not found ({occurrence} times) in the last result.'}
+        token_idx = bisect.bisect_right(self._last_result_token_offsets(), position) - 1
+        self.last_result_starting_idx = \
+            max(token_idx, 0) // self.max_visible_tokens * self.max_visible_tokens
         trimmed_text = self.last_result_visible_part()
         return {'a11y_snapshot': trimmed_text}
 
 
 if __name__ == '__main__':
-    explorer = Explorer()
+    explorer = Explorer(load_policy=FAST_LOAD)
     agent = Agent('Bot', 'You are a bot. You can browse webpages and interact with them.',
                   interactive_objects=[explorer],
                   function_call_repeats=10,
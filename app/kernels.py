@@ -0,0 +1,314 @@
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+from urllib.parse import quote
+import asyncio
+import atexit
+import importlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+
+
+def run_jupyter_code(script, globals=None, locals=None):
+    '''Execute a script and return the value of the last expression'''
+    import ast
+    stmts = list(ast.iter_child_nodes(ast.parse(script)))
+    if not stmts:
+        return None
+    # print(stmts[-1].__dict__)
+    if isinstance(stmts[-1], ast.Expr):
+        # the last one is an expression and we will try to return the results
+        # so we first execute the previous statements
+        if len(stmts) > 1:
+            exec(compile(ast.Module(
+                body=stmts[:-1], type_ignores=[]),
+                filename="<ast>", mode="exec"), globals, locals)
+        # then we eval the last one
+        return eval(compile(ast.Expression(body=stmts[-1].value),
+                            filename="<ast>", mode="eval"), globals, locals)
+    else:
+        # otherwise we just execute the entire code
+        return exec(script, globals, locals)
+
+
+def _kernel_main(conn, preload: Sequence[str], memory_limit: Optional[int]):
+    """ The loop of a kernel process: run code in persistent globals until the pipe closes. """
+    if memory_limit is not None:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    kernel_globals = {'__name__': '__kernel__'}
+    try:
+        for module_name in preload:
+            importlib.import_module(module_name)
+            top_level_name = module_name.split('.')[0]
+            kernel_globals[top_level_name] = sys.modules[top_level_name]
+    except BaseException as e:
+        error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        conn.send(('error', f'The kernel failed to import its preloaded modules: {error}'))
+        return
+    conn.send(('ready', None))
+
+    while True:
+        try:
+            kind, payload = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        try:
+            if kind == 'chdir':
+                os.makedirs(payload, exist_ok=True)
+                os.chdir(payload)
+                response = ('ok', None)
+            else:
+                response = ('ok', run_jupyter_code(payload, kernel_globals))
+        except BaseException as e:
+            if isinstance(e, (SystemExit, KeyboardInterrupt)):
+                response = ('error', f'{type(e).__name__} was raised.')
+            else:
+                response = ('error', ''.join(traceback.format_exception_only(type(e), e)).strip())
+        try:
+            conn.send(response)
+        except Exception:
+            # The result cannot be pickled, send its representation instead.
+            conn.send((response[0], repr(response[1])))
+
+
+class Kernel:
+    """ A worker process with persistent globals. """
+
+    def __init__(self, context, preload: Sequence[str], memory_limit: Optional[int],
+                 start_timeout: Optional[float] = None):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_kernel_main, args=(child_conn, tuple(preload), memory_limit),
+            name='botplayers-kernel', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.start_timeout = start_timeout
+        self.lock = threading.Lock()
+        self.ready = False
+        # Why the kernel failed to start, if it did.
+        self.error: Optional[str] = None
+        self.last_used = time.monotonic()
+
+    def _receive(self, timeout: Optional[float]) -> Tuple[str, object]:
+        if self.conn.closed:
+            return 'died', None
+        if not self.conn.poll(timeout):
+            self.kill()
+            return 'timeout', None
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self.kill()
+            return 'died', None
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """ Wait until the preloaded modules are imported. A kernel that fails to start keeps the cause in `error`. """
+        if not self.ready and self.error is None:
+            status, value = self._receive(timeout)
+            if status == 'ready':
+                self.ready = True
+            elif status == 'error':
+                self.error = value
+                self.kill()
+            elif status == 'timeout':
+                self.error = f'The kernel did not import its preloaded modules in {timeout} seconds.'
+        return self.ready
+
+    def request(self, kind: str, payload, timeout: Optional[float]) -> Tuple[str, object]:
+        """ Send a request and wait for its response, killing the kernel when it times out or dies. """
+        with self.lock:
+            self.last_used = time.monotonic()
+            # Preloading is not limited by the timeout of the code.
+            if not self.wait_ready(self.start_timeout):
+                return ('error', self.error) if self.error is not None else ('died', None)
+            try:
+                self.conn.send((kind, payload))
+            except (BrokenPipeError, OSError):
+                self.kill()
+                return 'died', None
+            response = self._receive(timeout)
+            self.last_used = time.monotonic()
+            return response
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class KernelPool:
+    """ Warm worker processes that run code, one kernel per session.
+
+    A session, e.g. an agent, keeps its kernel and so its variables between
+    calls, and runs its code in its own workspace directory. Kernels are
+    started ahead of time with the preloaded modules imported, so a new
+    session does not pay for the process start and the imports. Code of
+    different sessions runs in parallel; a kernel that exceeds the time or
+    memory limit is killed and replaced on the next call.
+
+    Args:
+        workspace (str, optional): The directory of the session workspaces. Defaults to '.workspace'.
+        max_kernels (int, optional): The maximum number of sessions with a kernel; the least recently used
+            idle session loses its kernel beyond. Defaults to 8.
+        warm_kernels (int, optional): The number of kernels kept started ahead of time. Defaults to 1.
+        preload (list, optional): The modules imported in every kernel, e.g. ['numpy', 'pandas']. Defaults to [].
+        timeout (float, optional): The wall-clock seconds a call may take. Defaults to 60.
+        memory_limit_mb (int, optional): The address space limit of a kernel, Unix only. Defaults to None.
+        start_method (str, optional): The multiprocessing start method. Defaults to 'spawn'.
+        start_timeout (float, optional): The seconds a kernel may take to start and import the preloaded modules.
+            Defaults to 300.
+    """
+
+    def __init__(self, workspace: str = '.workspace', max_kernels: int = 8, warm_kernels: int = 1,
+                 preload: Sequence[str] = (), timeout: Optional[float] = 60.0,
+                 memory_limit_mb: Optional[int] = None, start_method: str = 'spawn',
+                 start_timeout: Optional[float] = 300.0):
+        self.workspace = workspace
+        self.max_kernels = max_kernels
+        self.warm_kernels = warm_kernels
+        self.preload = list(preload)
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._context = multiprocessing.get_context(start_method)
+
+        self.num_started = 0
+        self._warm: List[Kernel] = []
+        self._kernels: 'OrderedDict[Hashable, Kernel]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._refilling = False
+        atexit.register(self.close)
+
+    def _start_kernel(self) -> Kernel:
+        memory_limit = self.memory_limit_mb * 1024 * 1024 if self.memory_limit_mb is not None else None
+        kernel = Kernel(self._context, self.preload, memory_limit, self.start_timeout)
+        with self._lock:
+            self.num_started += 1
+        return kernel
+
+    def _refill(self):
+        while True:
+            with self._lock:
+                if self._closed or len(self._warm) >= self.warm_kernels:
+                    self._refilling = False
+                    return
+            kernel = self._start_kernel()
+            ready = kernel.wait_ready(self.start_timeout)
+            with self._lock:
+                if self._closed or not ready:
+                    # A kernel that fails to start, e.g. on a bad preload, would fail again.
+                    self._refilling = False
+                    kernel.kill()
+                    return
+                self._warm.append(kernel)
+
+    def warm_up(self):
+        """ Start the warm kernels in the background. """
+        with self._lock:
+            if self._refilling or self._closed or len(self._warm) >= self.warm_kernels:
+                return self
+            self._refilling = True
+        threading.Thread(target=self._refill, name='botplayers-kernel-warmer', daemon=True).start()
+        return self
+
+    def workspace_for(self, key: Hashable) -> str:
+        """ Get the workspace directory of a session. """
+        return os.path.abspath(os.path.join(self.workspace, quote(str(key), safe='')))
+
+    def _kernel(self, key: Hashable) -> Tuple[Kernel, bool]:
+        """ Get the kernel of a session, and whether it was just assigned. """
+        evicted = []
+        with self._lock:
+            kernel = self._kernels.get(key)
+            if kernel is not None and kernel.alive:
+                self._kernels.move_to_end(key)
+                return kernel, False
+            self._kernels.pop(key, None)
+            while len(self._kernels) >= self.max_kernels:
+                idle = next((k for k, v in self._kernels.items() if not v.lock.locked()), None)
+                if idle is None:
+                    break
+                evicted.append(self._kernels.pop(idle))
+            kernel = None
+            while self._warm and kernel is None:
+                kernel = self._warm.pop(0)
+                if not kernel.alive:
+                    kernel = None
+        for old in evicted:
+            old.kill()
+        if kernel is None:
+            kernel = self._start_kernel()
+        self.warm_up()
+        with self._lock:
+            self._kernels[key] = kernel
+        return kernel, True
+
+    def run(self, key: Hashable, code: str) -> dict:
+        """
+        Run code in the kernel of a session.
+
+        Args:
+            key (hashable): The session, e.g. the name of an agent.
+            code (str): The Python code. The value of its last expression is the result.
+
+        Returns:
+            response: {'result': ...} or {'error': ...}.
+        """
+        kernel, assigned = self._kernel(key)
+        status, value = 'ok', None
+        if assigned:
+            status, value = kernel.request('chdir', self.workspace_for(key), self.timeout)
+            if status == 'error':
+                # The code must not run outside of the session's workspace; the kernel is replaced on the next call.
+                kernel.kill()
+        if status == 'ok':
+            status, value = kernel.request('run', code, self.timeout)
+        if status == 'ok':
+            return {'result': value}
+        if status == 'error':
+            return {'error': value}
+        with self._lock:
+            if self._kernels.get(key) is kernel:
+                del self._kernels[key]
+        if status == 'timeout':
+            return {'error': f'The code did not finish in {self.timeout} seconds. '
+                             'The kernel was restarted and its variables are lost.'}
+        return {'error': 'The kernel died, e.g. because it ran out of memory. '
+                         'It was restarted and its variables are lost.'}
+
+    async def arun(self, key: Hashable, code: str) -> dict:
+        """ Run code without blocking the event loop. """
+        return await asyncio.get_running_loop().run_in_executor(None, self.run, key, code)
+
+    def release(self, key: Hashable):
+        """ Stop the kernel of a session. Its variables are lost. """
+        with self._lock:
+            kernel = self._kernels.pop(key, None)
+        if kernel is not None:
+            kernel.kill()
+        return self
+
+    def kernels(self) -> Dict[Hashable, Kernel]:
+        """ Get the kernels of the sessions. """
+        with self._lock:
+            return dict(self._kernels)
+
+    def close(self):
+        """ Stop every kernel. """
+        with self._lock:
+            self._closed = True
+            kernels = list(self._kernels.values()) + self._warm
+            self._kernels.clear()
+            self._warm = []
+        for kernel in kernels:
+            kernel.kill()
@@ -1,8 +1,4 @@
-from botplayers import agent_callable, Agent, InteractiveSpace
-
-
-def to_markdown(list_data: list):
-    return '\n'.join([f'- {item}' for item in list_data])
+from botplayers import agent_callable, Agent, InteractiveSpace, ascreen, sufficiency_check
 
 
 class Database(InteractiveSpace):
@@ -17,38 +13,14 @@ class Database(InteractiveSpace):
     ]
 
     @agent_callable
-    def review_info(self, agent: Agent):
+    async def review_info(self, agent: Agent):
         """
         View the information from the database.
         You can call this function multiple times to find more useful information.
         """
-        useful_info = []
-        for idx, info in enumerate(self.info_list):
-            if idx < len(self.info_list) - 1:
-                info_show_to_agent = f"[info from database]: {info}\n" + \
-                    "Is this info useful? Answer yes or no."
-            else:
-                info_show_to_agent = f"[info from database]: {info}\n" + \
-                    "There are no more info in the dabase."
-
-            response = agent.derive_avatar(interactive_objects=[]).receive_message(
-                {'role': 'user', 'content': info_show_to_agent}
-            ).think_and_act().last_message()
-
-            if response['content'].lower().startswith('y'):
-                useful_info.append(info)
-
-                if idx < len(self.info_list) - 1:
-                    response = agent.derive_avatar(interactive_objects=[]).receive_message(
-                        {'role': 'user', 'content':
-                         'Current info:\n' + to_markdown(useful_info) + '\n' +
-                         'Do you have sufficient infomation to answer the user\'s question? Answer yes or no.'}
-                    ).think_and_act().last_message()
-                    
-                    if response['content'].lower().startswith('y'):
-                        break
-
-        return useful_info
+        result = await ascreen(
+            agent, self.info_list, batch_size=20, is_sufficient=sufficiency_check(agent))
+        return [self.info_list[idx] for idx in result.matches]
 
 
 info_database = Database()
@@ -0,0 +1,212 @@
+"""Benchmarks of the agent runtime hot paths.
+
+Every case drives agents with a deterministic MockBackend without latency,
+so the numbers measure framework overhead only.
+Browsing cases load pages from a local fixture server and are skipped when
+Playwright is not installed.
+"""
+from contextlib import contextmanager
+import asyncio
+import http.server
+import threading
+
+from botplayers import Agent, InteractiveSpace, MockBackend, agent_callable
+from botplayers.agent import _parse_interactive_objects
+from botplayers.util import run_sync
+
+from .harness import measure, skipped
+
+
+def make_space_class(num_functions: int):
+    """Build an InteractiveSpace subclass with many agent callable methods."""
+    namespace = {}
+    for idx in range(num_functions):
+        def lookup(self, agent_name: str, query: str, limit: int = 10):
+            """Look up something in the space.
+
+            Args:
+                query: what to look up.
+                limit: the maximum number of results.
+
+            Returns:
+                results: the results.
+            """
+            return {'results': [query] * limit}
+        lookup.__name__ = lookup.__qualname__ = f'lookup_{idx}'
+        namespace[lookup.__name__] = agent_callable(lookup)
+    return type('LargeSpace', (InteractiveSpace,), namespace)
+
+
+def make_long_memory(agent: Agent, num_messages: int):
+    for idx in range(num_messages):
+        role = 'user' if idx % 2 == 0 else 'assistant'
+        agent.memory.append(
+            {'role': role, 'content': f'message {idx}: the quick brown fox jumps over the lazy dog.'})
+
+
+def bench_parse_interactive_objects(scale: float):
+    num_functions = max(int(500 * scale), 1)
+    space_class = make_space_class(num_functions)
+    return measure(
+        'parse_interactive_objects', None, repeats=max(int(20 * scale), 3),
+        setup=lambda: lambda: _parse_interactive_objects([space_class()]),
+        num_functions=num_functions)
+
+
+def bench_think_and_act_long_memory(scale: float):
+    num_messages = max(int(2000 * scale), 10)
+
+    @agent_callable
+    def echo(text: str):
+        """Echo a text.
+
+        Args:
+            text: the text to echo.
+        """
+        return {'text': text}
+
+    backend = MockBackend(
+        [{'function_call': {'name': 'echo', 'arguments': {'text': 'hello'}}}, 'Done.'],
+        cycle=True, record_requests=False)
+    agent = Agent('Bot', 'You are a bot.', interactive_objects=[echo],
+                  function_call_repeats=2, ignore_none_function_messages=False,
+                  backend=backend)
+    make_long_memory(agent, num_messages)
+
+    def operation():
+        agent.receive_message({'role': 'user', 'content': 'Echo hello.'}, print_output=False)
+        agent.think_and_act()
+    return measure('think_and_act_long_memory', operation, repeats=max(int(50 * scale), 3),
+                   num_messages=num_messages, model_calls_per_op=2)
+
+
+def bench_full_memory_deep_avatars(scale: float):
+    depth = max(int(100 * scale), 2)
+    messages_per_level = 20
+    root = Agent('Bot', 'You are a bot.')
+    make_long_memory(root, messages_per_level)
+    leaf = root
+    for _ in range(depth):
+        leaf = leaf.derive_avatar()
+        make_long_memory(leaf, messages_per_level)
+
+    def operation():
+        leaf.memory.append({'role': 'user', 'content': 'one more message'})
+        leaf.full_memory()
+    return measure('full_memory_deep_avatars', operation, repeats=max(int(200 * scale), 3),
+                   depth=depth, messages_per_level=messages_per_level)
+
+
+def bench_derive_avatar_deep(scale: float):
+    depth = max(int(100 * scale), 2)
+    leaf = Agent('Bot', 'You are a bot.')
+    for _ in range(depth):
+        leaf = leaf.derive_avatar()
+        make_long_memory(leaf, 20)
+
+    def operation():
+        avatar = leaf.derive_avatar(interactive_objects=[])
+        avatar.receive_message({'role': 'user', 'content': 'Is this useful?'}, print_output=False)
+        avatar.full_memory()
+    return measure('derive_avatar_deep', operation, repeats=max(int(200 * scale), 3), depth=depth)
+
+
+def bench_chatroom_say_to_everyone(scale: float):
+    from app.chatroom import ChatRoom
+
+    num_agents = max(int(1000 * scale), 2)
+    room = ChatRoom()
+    for idx in range(num_agents):
+        room.join(Agent(f'Agent{idx}', 'You are in a chat room.', interactive_objects=[room]))
+
+    def operation():
+        room.say_to_everyone('Agent0', 'Hello everyone!')
+    return measure('chatroom_say_to_everyone', operation, repeats=max(int(20 * scale), 3),
+                   num_agents=num_agents)
+
+
+def bench_explorer_paging(scale: float):
+    try:
+        from app.explorer import Explorer
+    except ImportError as e:
+        return skipped('explorer_paging', f'app.explorer is not importable: {e}')
+
+    num_nodes = max(int(5000 * scale), 10)
+    snapshot = '\n'.join(
+        f'- role: link\n  name: Link number {idx} to somewhere interesting' for idx in range(num_nodes))
+    num_pages = 20
+
+    def setup():
+        explorer = Explorer()
+        explorer.last_result = snapshot
+        explorer.last_result_starting_idx = 0
+        explorer.last_result_name = 'a11y_snapshot'
+
+        def operation():
+            for _ in range(num_pages):
+                explorer.show_more()
+        return operation
+    return measure('explorer_paging', None, repeats=max(int(10 * scale), 3), setup=setup,
+                   snapshot_chars=len(snapshot), pages=num_pages)
+
+
+class _FixtureHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        links = ''.join(f'<li><a href="/page/{idx}">Link {idx}</a></li>' for idx in range(50))
+        body = f'<html><body><h1>{self.path}</h1><ul>{links}</ul></body></html>'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def fixture_server():
+    """Serve small HTML pages on a local port."""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _FixtureHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_explorer_concurrent_browse(scale: float):
+    try:
+        import playwright.async_api  # noqa: F401
+        from app.browser_pool import BrowserPool
+        from app.explorer import Explorer
+    except ImportError as e:
+        return skipped('explorer_concurrent_browse', f'playwright or app.explorer is not importable: {e}')
+
+    num_explorers = max(int(16 * scale), 2)
+    pool = BrowserPool(max_pages=num_explorers, max_concurrency=min(num_explorers, 8))
+    explorers = [Explorer(pool) for _ in range(num_explorers)]
+
+    async def browse_all(base_url):
+        await asyncio.gather(*(explorer.browse_webpage(f'{base_url}/page/{idx}')
+                               for idx, explorer in enumerate(explorers)))
+    try:
+        with fixture_server() as base_url:
+            return measure('explorer_concurrent_browse', lambda: run_sync(browse_all(base_url)),
+                           repeats=max(int(10 * scale), 3), num_explorers=num_explorers,
+                           max_concurrency=pool.max_concurrency)
+    finally:
+        pool.close()
+
+
+BENCHMARKS = {
+    'parse_interactive_objects': bench_parse_interactive_objects,
+    'think_and_act_long_memory': bench_think_and_act_long_memory,
+    'full_memory_deep_avatars': bench_full_memory_deep_avatars,
+    'derive_avatar_deep': bench_derive_avatar_deep,
+    'chatroom_say_to_everyone': bench_chatroom_say_to_everyone,
+    'explorer_paging': bench_explorer_paging,
+    'explorer_concurrent_browse': bench_explorer_concurrent_browse,
+}
@@ -0,0 +1,121 @@
+from typing import Callable, List, Optional
+import contextlib
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Get the peak resident set size of this process.
+
+    Returns:
+        peak_rss: The peak RSS in bytes, or None if it is not available on this platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Get a percentile of sorted values by linear interpolation.
+
+    Args:
+        sorted_values: The values, sorted ascending.
+        q: The percentile, between 0 and 100.
+    """
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+@contextlib.contextmanager
+def silenced():
+    """Discard stdout, the agents print every message they handle."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def measure(name: str, operation: Callable[[], None], repeats: int, warmup: int = 1,
+            setup: Optional[Callable[[], Callable[[], None]]] = None, **params) -> dict:
+    """Time an operation and summarize its latency.
+
+    Args:
+        name: The name of the benchmark.
+        operation: The operation to time. Ignored if `setup` is given.
+        repeats: The number of timed runs.
+        warmup: The number of untimed runs before the timed ones.
+        setup: Builds a fresh operation for every run, the build is not timed.
+        params: The parameters of the benchmark, recorded in the result.
+
+    Returns:
+        result: ops/sec, latency percentiles in seconds and peak RSS in bytes.
+    """
+    latencies = []
+    with silenced():
+        for idx in range(warmup + repeats):
+            if setup is not None:
+                operation = setup()
+            gc.collect()
+            start = time.perf_counter()
+            operation()
+            elapsed = time.perf_counter() - start
+            if idx >= warmup:
+                latencies.append(elapsed)
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'name': name,
+        'params': params,
+        'repeats': repeats,
+        'ops_per_sec': repeats / total if total > 0 else None,  # too fast for the clock, JSON has no infinity
+        'mean_s': total / repeats,
+        'p50_s': percentile(latencies, 50),
+        'p99_s': percentile(latencies, 99),
+        'min_s': latencies[0],
+        'max_s': latencies[-1],
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def skipped(name: str, reason: str) -> dict:
+    """Record a benchmark that could not run."""
+    return {'name': name, 'skipped': reason}
+
+
+def environment() -> dict:
+    """Describe where the benchmarks ran, so results can be compared across releases."""
+    import botplayers
+    return {
+        'botplayers_version': botplayers.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def write_results(path: str, results: List[dict]):
+    """Write results as JSON, one record per benchmark, sorted by name."""
+    report = {
+        'environment': environment(),
+        'results': sorted(results, key=lambda result: result['name']),
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,47 @@
+"""Run the benchmarks and write the results as JSON.
+
+Usage:
+    python -m benchmarks.run [--only NAME ...] [--scale 0.1] [--output PATH]
+"""
+import argparse
+
+import botplayers
+
+from .cases import BENCHMARKS
+from .harness import write_results
+
+
+def format_result(result: dict) -> str:
+    if 'skipped' in result:
+        return f'{result["name"]:<32} skipped: {result["skipped"]}'
+    peak_rss = result['peak_rss_bytes']
+    peak_rss = f'{peak_rss / 2 ** 20:.1f} MiB' if peak_rss is not None else 'n/a'
+    ops_per_sec = result['ops_per_sec']
+    ops_per_sec = f'{ops_per_sec:>10.1f}' if ops_per_sec is not None else f'{"n/a":>10}'
+    return (f'{result["name"]:<32} {ops_per_sec} ops/s'
+            f'  p50 {result["p50_s"] * 1e3:>9.3f} ms  p99 {result["p99_s"] * 1e3:>9.3f} ms'
+            f'  peak rss {peak_rss}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the botplayers runtime.')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS),
+                        help='the benchmarks to run, defaults to all')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='scale the problem sizes and repeats, e.g. 0.1 for a quick run')
+    parser.add_argument('--output', default=f'benchmarks/results/{botplayers.__version__}.json',
+                        help='where to write the JSON results')
+    args = parser.parse_args()
+
+    results = []
+    for name in args.only or BENCHMARKS:
+        result = BENCHMARKS[name](args.scale)
+        print(format_result(result))
+        results.append(result)
+
+    write_results(args.output, results)
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,21 @@
 __version__ = '0.0.2'
 
-from .agent import Agent, agent_callable, InteractiveSpace
+from .agent import Agent, agent_callable, InteractiveSpace, FunctionRegistry
+from .memory import MessageLog
+from .journal import JournalStore, AgentJournal
+from .retrieval import (RetrievalMemory, Embedder, OpenAIEmbedder, HashingEmbedder,
+                        VectorIndex, NumpyIndex, PythonIndex, PgVectorIndex)
+from .context import ContextPolicy, KeepAllPolicy, SlidingWindowPolicy, DropFunctionResultsPolicy
+from .cache import ResponseCache
+from .backends import CompletionBackend, OpenAIBackend, MockBackend, set_default_backend
+from .ratelimit import RateLimiter, RateLimitedBackend, request_priority
+from .singleflight import SingleFlightBackend
+from .metrics import Metrics, JsonlMetricsExporter, set_default_metrics
+from .streaming import StreamEvent, iter_chat_completion, aiter_chat_completion
+from .events import EventSink, NullSink, ConsoleSink, BufferedConsoleSink, JsonlSink, set_default_sink
+from .bus import MessageBus, Inbox
+from .world import World, RoundStats
+from .artifacts import ArtifactStore
+from .governor import ResultGovernor
+from .screening import ScreeningResult, screen, ascreen, sufficiency_check
 from . import util
@@ -1,11 +1,34 @@
-from typing import Any, List, Optional
+from typing import Any, Callable, List, Optional, Tuple, TYPE_CHECKING
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextvars import ContextVar
+import asyncio
+import functools
 import inspect
 import re
 import json
-import openai
-from functools import lru_cache
-
-from .util import print_in_color
+import threading
+import time
+import weakref
+
+from .artifacts import dumps
+from .backends import CompletionBackend
+from .bus import Inbox
+from .cache import ResponseCache
+from .context import (ContextPolicy, SlidingWindowPolicy, function_descriptions_tokens,
+                      get_message_token_counter, resolve_context_budget)
+from .journal import JournalStore
+from .memory import MessageLog
+from .metrics import Metrics, get_default_metrics
+from .ratelimit import request_priority
+from .retrieval import RetrievalMemory
+from .events import EventSink, get_default_sink
+from .streaming import StreamEvent, astream_chat_completion, stream_chat_completion, stream_event_handler  # noqa: F401
+from .util import print_in_color, run_sync
+from . import events
+from . import metrics as m
+
+if TYPE_CHECKING:
+    from .governor import ResultGovernor
 
 SELF_PARAM_NAME = 'self'
 AGENT_PARAM_NAME = 'agent'
@@ -18,22 +41,58 @@ def agent_callable(function):
     return function
 
 
+def _is_agent_callable(value) -> bool:
+    if isinstance(value, (staticmethod, classmethod)):
+        return _is_agent_callable(value.__func__)
+    return bool(getattr(value, '__agent_callable__', False))
+
+
+def _collect_agent_callable_names(cls) -> Tuple[str, ...]:
+    names = []
+    seen = set()
+    for klass in cls.__mro__:
+        for name, value in vars(klass).items():
+            if name.startswith('__') or name in seen:
+                continue
+            # The first class in the MRO defines the attribute, so an override
+            # without @agent_callable hides the callable of a base class.
+            seen.add(name)
+            if _is_agent_callable(value):
+                names.append(name)
+    return tuple(sorted(names))
+
+
 class InteractiveSpace:
+    """ A stateful space whose `agent_callable` methods agents can call.
+
+    The names of the callable methods are collected once per class when the
+    class is defined, so instances never scan their attributes.
+
+    Sync callables run concurrently in a thread pool by default. Set
+    `thread_bound` on a space whose state only works from the thread that
+    created it (e.g. sync Playwright): its sync callables then run one at a
+    time on a thread of their own. Calls made by avatars from inside such a
+    call run inline, since the space's thread is waiting for them, and a
+    call that times out leaves its thread behind to a new one.
+    """
+    _agent_callable_names: Tuple[str, ...] = ()
+    thread_bound: bool = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._agent_callable_names = _collect_agent_callable_names(cls)
+
     def get_callable_functions(self):
-        functions = []
-        for func in dir(self):
-            if func.startswith('__'):
-                continue
-            fun = getattr(self, func)
-            if not hasattr(fun, '__agent_callable__'):
-                continue
-            if fun.__agent_callable__:
-                functions.append(fun)
+        functions = [getattr(self, name) for name in self._agent_callable_names]
+        # Callables assigned to the instance itself.
+        for name, value in getattr(self, '__dict__', {}).items():
+            if not name.startswith('__') and callable(value) and _is_agent_callable(value) \
+                    and name not in self._agent_callable_names:
+                functions.append(value)
         return functions
 
 
-@lru_cache()
-def _parse_agent_callable_function(function):
+def _compile_agent_callable_function(function):
     # Get the parameters of the function
     signature = inspect.signature(function)
     parameters = signature.parameters
@@ -98,76 +157,202 @@ def _parse_agent_callable_function(function):
             'required': required_parameters,
         },
     }
-    func_info = {
+    compiled = {
         'sig': func_sig,
-        'function': function,
+        'is_coroutine': inspect.iscoroutinefunction(function),
         'has_agent_param': has_agent_param,
         'has_agent_name_param': has_agent_name_param,
     }
+    return compiled
+
+
+# Compiled schemas keyed by the underlying function, not the bound method:
+# every attribute access creates a new bound method, and keeping it would pin the instance.
+_compiled_functions = weakref.WeakKeyDictionary()
+_compiled_functions_lock = threading.Lock()
+
+
+def _parse_agent_callable_function(function):
+    underlying = getattr(function, '__func__', function)
+    with _compiled_functions_lock:
+        compiled = _compiled_functions.get(underlying)
+    if compiled is None:
+        compiled = _compile_agent_callable_function(function)
+        try:
+            with _compiled_functions_lock:
+                _compiled_functions[underlying] = compiled
+        except TypeError:
+            pass  # Not weak referenceable, compile it every time.
+    func_info = dict(compiled)
+    func_info['function'] = function
     return func_info
 
 
+# One worker thread per thread-bound interactive space, created on first use.
+_space_executors = weakref.WeakKeyDictionary()
+_space_executors_lock = threading.Lock()
+# The space threads that wait for the current call, so calls of nested avatars do not wait for them.
+_held_space_executors: ContextVar[frozenset] = ContextVar('botplayers_held_space_executors', default=frozenset())
+
+
+def _space_executor(function) -> Optional[ThreadPoolExecutor]:
+    """ Get the thread of the thread-bound space a sync agent callable belongs to, None if it has none. """
+    owner = getattr(function, '__self__', None)
+    if not getattr(owner, 'thread_bound', False):
+        return None
+    with _space_executors_lock:
+        executor = _space_executors.get(owner)
+        if executor is None:
+            executor = _space_executors[owner] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f'botplayers-{type(owner).__name__}')
+    return executor
+
+
+def _retire_space_executor(function, executor: ThreadPoolExecutor):
+    """ Give a space a new thread, e.g. when its thread is stuck in a call that timed out. """
+    owner = getattr(function, '__self__', None)
+    with _space_executors_lock:
+        if _space_executors.get(owner) is executor:
+            del _space_executors[owner]
+    executor.shutdown(wait=False)
+
+
+def _call_holding(executors: frozenset, function: Callable):
+    token = _held_space_executors.set(executors)
+    try:
+        return function()
+    finally:
+        _held_space_executors.reset(token)
+
+
+def _get_callable_functions(obj):
+    if isinstance(obj, InteractiveSpace):
+        return obj.get_callable_functions()
+    assert hasattr(
+        obj, '__agent_callable__'), f'Object {obj} is not agent callable.'
+    assert obj.__agent_callable__, f'Object {obj} is not agent callable.'
+    return [obj]
+
+
 def _parse_interactive_objects(interactive_objects: List[Any]):
     """ Install interactive objects. """
     function_info_table = {}
     for obj in interactive_objects:
-        if isinstance(obj, InteractiveSpace):
-            functions = obj.get_callable_functions()
-        else:
-            assert hasattr(
-                obj, '__agent_callable__'), f'Object {obj} is not agent callable.'
-            assert obj.__agent_callable__, f'Object {obj} is not agent callable.'
-            functions = [obj]
-        for func in functions:
+        for func in _get_callable_functions(obj):
             assert func.__name__ not in function_info_table, f'Function {func.__name__} already registered.'
             function_info_table[func.__name__] = _parse_agent_callable_function(
                 func)
     return function_info_table
 
 
-def stream_chat_completion(engine: str, messages: List[dict], print_output: bool = True, **kwargs):
-    resp = openai.ChatCompletion.create(
-        model=engine,
-        messages=messages,
-        stream=True,
-        **kwargs
-    )
-    role = ''
-    content = ''
-    function_call = dict()
-    for chunk in resp:
-        for c in chunk['choices']:
-            delta = c['delta']
-            if 'role' in delta:
-                role = delta['role']
-
-            if 'function_call' in delta:
-                for key, val in delta['function_call'].items():
-                    if key not in function_call:
-                        function_call[key] = val
-                    else:
-                        function_call[key] += val
+class FunctionRegistry:
+    """ The functions an agent can call, indexed by name.
+
+    Interactive objects are added and removed without re-parsing the others.
+    The function descriptions and the function calling arguments of requests
+    are built once and reused until the registry changes.
+
+    Args:
+        interactive_objects (list, optional): The interactive objects to install. Defaults to [].
+    """
+
+    def __init__(self, interactive_objects: List[Any] = []):
+        self.functions = dict()
+        self.version = 0
+        self._names_by_object = dict()
+        self._request_kwargs = dict()
+        self._num_tokens = dict()
+        for obj in interactive_objects:
+            self.add(obj)
+
+    def add(self, interactive_object):
+        """ Install an interactive object. """
+        assert id(interactive_object) not in self._names_by_object, \
+            f'Object {interactive_object} already registered.'
+        function_infos = [_parse_agent_callable_function(func)
+                          for func in _get_callable_functions(interactive_object)]
+        names = [function_info['sig']['name'] for function_info in function_infos]
+        for name in names:
+            assert name not in self.functions, f'Function {name} already registered.'
+        assert len(set(names)) == len(names), f'Object {interactive_object} has duplicated functions.'
+
+        for name, function_info in zip(names, function_infos):
+            self.functions[name] = function_info
+        self._names_by_object[id(interactive_object)] = (interactive_object, names)
+        self._changed()
+        return self
+
+    def remove(self, interactive_object):
+        """ Uninstall an interactive object. """
+        _, names = self._names_by_object.pop(id(interactive_object))
+        for name in names:
+            del self.functions[name]
+        self._changed()
+        return self
+
+    def copy(self):
+        """ Get a registry with the same functions, sharing the cached descriptions. """
+        registry = FunctionRegistry()
+        registry.functions = dict(self.functions)
+        registry._names_by_object = dict(self._names_by_object)
+        registry._request_kwargs = self._request_kwargs
+        registry._num_tokens = self._num_tokens
+        return registry
+
+    def _changed(self):
+        self.version += 1
+        self._request_kwargs = dict()
+        self._num_tokens = dict()
+
+    def descriptions(self) -> List[dict]:
+        """ Get the descriptions of all functions. Do not modify the returned list. """
+        return self.request_kwargs(False).get('functions', [])
+
+    def request_kwargs(self, parallel_function_calls: bool) -> dict:
+        """
+        Get the function calling arguments of a chat completion request.
+        Do not modify the returned dict.
+        """
+        if parallel_function_calls not in self._request_kwargs:
+            sigs = [function_info['sig'] for function_info in self.functions.values()]
+            if not sigs:
+                request_kwargs = dict()
+            elif parallel_function_calls:
+                request_kwargs = dict(
+                    tools=[{'type': 'function', 'function': sig} for sig in sigs],
+                    tool_choice="auto",
+                )
+            else:
+                request_kwargs = dict(functions=sigs, function_call="auto")
+            self._request_kwargs[parallel_function_calls] = request_kwargs
+        return self._request_kwargs[parallel_function_calls]
+
+    def num_tokens(self, engine: str) -> int:
+        """ Count the tokens the function descriptions take in a request. """
+        if engine not in self._num_tokens:
+            self._num_tokens[engine] = function_descriptions_tokens(
+                self.descriptions(), engine)
+        return self._num_tokens[engine]
+
+    def __contains__(self, name: str):
+        return name in self.functions
+
+    def __getitem__(self, name: str):
+        return self.functions[name]
 
-            if 'content' in delta:
-                if len(content) == 0 and delta['content'] == '\n\n' or delta['content'] is None:
-                    continue
-                content += delta['content']
-                if print_output:
-                    print_in_color(delta['content'], 'yellow', end='')
+    def __len__(self):
+        return len(self.functions)
 
-    if len(content) > 0 and print_output:
-        print()
 
-    message = dict()
-    message['role'] = role
-    message['content'] = content
-    if len(function_call) > 0:
-        message['function_call'] = function_call
-    return message
+def _function_message_content(function_response):
+    if function_response is None:
+        function_response = 'done'
+    return dumps(function_response)
 
 
 DEFAULT_FUNCTION_CALL_REPEATS = 10
 DEFAULT_IGNORE_NONE_FUNCTION_MESSAGES = True
+DEFAULT_REPLY_TOKEN_RESERVE = 1024
 
 
 class Agent:
@@ -180,15 +365,59 @@ class Agent:
         interactive_objects (list, optional): A list of interactive objects to install. Defaults to [].
         function_call_repeats (int, optional): The number of times to repeat function calls in agent.think_and_act().
         ignore_none_function_messages (bool, optional): Whether to ignore messages that does not involve function calling.
+        parallel_function_calls (bool, optional): Whether to let the model request several function calls per message (OpenAI tools API).
+            The calls run concurrently and their results are appended in the order they were requested.
+        function_executor (Executor, optional): The thread or process pool to run non-coroutine functions on.
+            Defaults to the default executor of the event loop, or the own thread of a `thread_bound` space.
+            Process pools require picklable functions and arguments.
+        function_call_timeout (float, optional): Seconds before a function call is abandoned and reported as an error.
+        context_policy (ContextPolicy, optional): Decides which messages are sent when the memory exceeds the token budget.
+            Defaults to a SlidingWindowPolicy that pins the system prompt.
+        max_context_tokens (int, optional): The context window size. Defaults to the known size of the engine.
+        reply_token_reserve (int, optional): The number of tokens kept free for the reply. Defaults to 1024.
+        engine_args (dict, optional): Extra arguments of chat completion requests. Defaults to dict(temperature=1.0).
+        response_cache (ResponseCache, optional): A cache of responses to identical requests. Defaults to None.
+        backend (CompletionBackend, optional): Where chat completions come from. Defaults to the default backend (OpenAI).
+        function_registry (FunctionRegistry, optional): The installed functions. Defaults to a registry of interactive_objects.
+        event_sink (EventSink, optional): Where the agent reports streamed text, function calls and received messages.
+            Defaults to the default sink, which prints to the terminal.
+        inbox (Inbox, optional): A message bus inbox. Its unread messages are received as one user message
+            when the agent thinks. Defaults to None.
+        priority (int, optional): Agents with a higher priority are scheduled first. Defaults to 0.
+        memory_store (JournalStore, optional): Persists the agent's memory under its name. An agent whose
+            journal already holds messages resumes from them and the prompt is not added again. Defaults to None.
+        retrieval_memory (RetrievalMemory, optional): Indexes the agent's messages. When set, only the recent messages
+            are sent, plus the earlier ones most relevant to the latest message. Defaults to None.
+        result_governor (ResultGovernor, optional): Replaces large function results with a preview and an artifact
+            handle, and installs its `read_artifact` function. Defaults to None.
+        metrics (Metrics, optional): Where the agent records its turn, completion and function call metrics,
+            labelled with its name. Defaults to the default metrics, None (disabled) unless set.
     """
     name: str = ''
-    memory: List[dict] = []
+    memory: MessageLog
     engine: str = 'gpt-3.5-turbo-16k'
     engine_args: dict = dict(temperature=1.0)
     interactive_objects: list = []
-    callable_functions: dict = dict()
+    function_registry: FunctionRegistry
     function_call_repeats: int = 1
     ignore_none_function_messages: bool = True
+    parallel_function_calls: bool = False
+    function_executor: Optional[Executor] = None
+    function_call_timeout: Optional[float] = None
+    context_policy: Optional[ContextPolicy] = None
+    max_context_tokens: Optional[int] = None
+    reply_token_reserve: int = DEFAULT_REPLY_TOKEN_RESERVE
+    response_cache: Optional[ResponseCache] = None
+    backend: Optional[CompletionBackend] = None
+    event_sink: Optional[EventSink] = None
+    inbox: Optional[Inbox] = None
+    retrieval_memory: Optional[RetrievalMemory] = None
+    result_governor: Optional['ResultGovernor'] = None
+    metrics: Optional[Metrics] = None
+    priority: int = 0
+    last_prompt_tokens: int = 0
+    total_prompt_tokens: int = 0
+    has_unread_messages: bool = False
 
     derived_from: Optional['Agent'] = None
 
@@ -197,21 +426,62 @@ class Agent:
                  interactive_objects: list = [],
                  function_call_repeats: int = DEFAULT_FUNCTION_CALL_REPEATS,
                  ignore_none_function_messages: bool = DEFAULT_IGNORE_NONE_FUNCTION_MESSAGES,
+                 parallel_function_calls: bool = False,
+                 function_executor: Optional[Executor] = None,
+                 function_call_timeout: Optional[float] = None,
+                 context_policy: Optional[ContextPolicy] = None,
+                 max_context_tokens: Optional[int] = None,
+                 reply_token_reserve: int = DEFAULT_REPLY_TOKEN_RESERVE,
+                 engine_args: Optional[dict] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 backend: Optional[CompletionBackend] = None,
+                 function_registry: Optional[FunctionRegistry] = None,
+                 event_sink: Optional[EventSink] = None,
+                 inbox: Optional[Inbox] = None,
+                 priority: int = 0,
+                 memory_store: Optional[JournalStore] = None,
+                 retrieval_memory: Optional[RetrievalMemory] = None,
+                 result_governor: Optional['ResultGovernor'] = None,
+                 metrics: Optional[Metrics] = None,
                  derived_from: Optional['Agent'] = None):
         self.name = name
         self.engine = engine
-
-        if prompt is not None:
-            self.memory = [
-                {"role": "system",  "content": prompt},
-            ]
-
-        self.interactive_objects = interactive_objects
-        self.callable_functions = _parse_interactive_objects(
-            interactive_objects)
+        if engine_args is not None:
+            self.engine_args = dict(engine_args)
+
+        self.memory = MessageLog(
+            parent=derived_from.memory if derived_from is not None else None,
+            journal=memory_store.journal(name) if memory_store is not None else None)
+        if prompt is not None and len(self.memory) == 0:
+            self.memory.append({"role": "system",  "content": prompt})
+
+        self.interactive_objects = list(interactive_objects)
+        self.result_governor = result_governor
+        self.metrics = metrics
+        if result_governor is not None and \
+                not any(obj is result_governor for obj in self.interactive_objects):
+            self.interactive_objects.append(result_governor)
+        if function_registry is None:
+            function_registry = FunctionRegistry(self.interactive_objects)
+        self.function_registry = function_registry
 
         self.function_call_repeats = function_call_repeats
         self.ignore_none_function_messages = ignore_none_function_messages
+        self.parallel_function_calls = parallel_function_calls
+        self.function_executor = function_executor
+        self.function_call_timeout = function_call_timeout
+        if context_policy is None:
+            context_policy = SlidingWindowPolicy()
+        self.context_policy = context_policy
+        self.max_context_tokens = max_context_tokens
+        self.reply_token_reserve = reply_token_reserve
+        self.response_cache = response_cache
+        self.backend = backend
+        self.event_sink = event_sink
+        self.inbox = inbox
+        self.retrieval_memory = retrieval_memory
+        self._retrieval_indexed = 0
+        self.priority = priority
         self.derived_from = derived_from
 
     def derive_avatar(self, interactive_objects: Optional[list] = None,
@@ -221,14 +491,17 @@ class Agent:
         Derive an avatar from the agent. 
         The avatar will inherit the agent's memory.
         But the history of the avatar will not be recorded in the agent's memory.
+        The avatar's priority is one below the agent's, so rate limited requests of agents go first.
 
         Args:
             interactive_objects (list, optional): A list of interactive objects to install. Defaults to None.
             function_call_repeats (int, optional): The number of times to repeat function calls in agent.think_and_act(). Defaults to None.
             ignore_none_function_messages (bool, optional): Whether to ignore messages that does not involve function calling. Defaults to None.
         """
+        function_registry = None
         if interactive_objects is None:
             interactive_objects = self.interactive_objects
+            function_registry = self.function_registry.copy()
         if function_call_repeats is None:
             function_call_repeats = self.function_call_repeats
         if ignore_none_function_messages is None:
@@ -239,6 +512,20 @@ class Agent:
             interactive_objects=interactive_objects,
             function_call_repeats=function_call_repeats,
             ignore_none_function_messages=ignore_none_function_messages,
+            parallel_function_calls=self.parallel_function_calls,
+            function_executor=self.function_executor,
+            function_call_timeout=self.function_call_timeout,
+            context_policy=self.context_policy.fresh(),
+            max_context_tokens=self.max_context_tokens,
+            reply_token_reserve=self.reply_token_reserve,
+            engine_args=self.engine_args,
+            response_cache=self.response_cache,
+            backend=self.backend,
+            function_registry=function_registry,
+            event_sink=self.event_sink,
+            result_governor=self.result_governor,
+            metrics=self.metrics,
+            priority=self.priority - 1,
             derived_from=self,
         )
 
@@ -249,10 +536,11 @@ class Agent:
                 f'    [{idx}] {message["role"]}: {message["content"]}', 'green')
 
     def full_memory(self):
-        if self.derived_from is None:
-            return self.memory
-        else:
-            return self.derived_from.full_memory() + self.memory
+        """
+        Get the memory inherited from the agent's ancestors followed by the agent's own memory.
+        The returned list is cached and shared, do not modify it.
+        """
+        return self.memory.full()
 
     def print_full_memory(self):
         """ Print the agent's memory. """
@@ -260,59 +548,192 @@ class Agent:
             print_in_color(
                 f'    [{idx}] {message["role"]}: {message["content"]}', 'green')
 
+    @property
+    def callable_functions(self) -> dict:
+        """ The installed functions, indexed by name. """
+        return self.function_registry.functions
+
     def add_interactive_object(self, interactive_object):
         """ Add an interactive object to the agent. """
+        self.function_registry.add(interactive_object)
         self.interactive_objects.append(interactive_object)
-        self.callable_functions = _parse_interactive_objects(
-            self.interactive_objects)
+        return self
+
+    def remove_interactive_object(self, interactive_object):
+        """ Remove an interactive object from the agent. """
+        self.function_registry.remove(interactive_object)
+        self.interactive_objects = [
+            obj for obj in self.interactive_objects if obj is not interactive_object]
         return self
 
     def _callable_function_descriptions(self):
         """
         Get the descriptions of all GPT callable functions.
         """
-        ds = []
-        for _, function in self.callable_functions.items():
-            ds.append(function['sig'])
-        return ds
+        return self.function_registry.descriptions()
+
+    def _completion_kwargs(self):
+        """
+        Get the function calling arguments of a chat completion request.
+        """
+        return self.function_registry.request_kwargs(self.parallel_function_calls)
+
+    def _context_messages(self):
+        """
+        Get the messages to send, trimmed by the context policy to fit into the token budget.
+        """
+        function_tokens = self.function_registry.num_tokens(self.engine)
+        count_tokens = get_message_token_counter(self.engine)
+        budget = resolve_context_budget(
+            self.engine, self.max_context_tokens,
+            self.engine_args.get('max_tokens', self.reply_token_reserve),
+            function_tokens)
+        if self.retrieval_memory is not None:
+            # Leave room for the retrieved messages, which are added after the selection.
+            budget = min(budget - self.retrieval_memory.max_tokens, self.retrieval_memory.recent_tokens)
+        messages, num_tokens = self.context_policy.select(
+            self.full_memory(), self.memory.full_token_counts(count_tokens), budget, count_tokens)
+        self.last_prompt_tokens = num_tokens + function_tokens
+        self.total_prompt_tokens += self.last_prompt_tokens
+        return messages
+
+    async def _aretrieve(self, messages: List[dict]) -> List[dict]:
+        """
+        Index the new messages in the retrieval memory and add the earlier messages relevant to the latest one.
+        """
+        memory = self.full_memory()
+        self.retrieval_memory.add_messages(memory[self._retrieval_indexed:])
+        self._retrieval_indexed = len(memory)
+
+        query = next((message['content'] for message in reversed(memory)
+                      if isinstance(message.get('content'), str) and message['content'].strip()), None)
+        if query is None:
+            return messages
+        results = await self.retrieval_memory.asearch(
+            query, exclude={message.get('content') for message in messages})
+        count_tokens = get_message_token_counter(self.engine)
+        retrieved = self.retrieval_memory.context_message(results, count_tokens)
+        if retrieved is None:
+            return messages
+
+        num_tokens = count_tokens(retrieved)
+        self.last_prompt_tokens += num_tokens
+        self.total_prompt_tokens += num_tokens
+        # Keep the pinned system prompt first.
+        position = 1 if messages and messages[0]['role'] == 'system' else 0
+        return messages[:position] + [retrieved] + messages[position:]
+
+    def _function_message_content(self, function_response) -> str:
+        """
+        Get the content of the message of a function result.
+        """
+        if self.result_governor is not None:
+            return self.result_governor.content(function_response)
+        return _function_message_content(function_response)
+
+    def _sink(self) -> EventSink:
+        return self.event_sink if self.event_sink is not None else get_default_sink()
+
+    def _metrics(self) -> Optional[Metrics]:
+        return self.metrics if self.metrics is not None else get_default_metrics()
 
     def _call_function(self, function_call: dict):
         """
         Call a GPT function.
         """
+        return run_sync(self._acall_function(function_call))
+
+    async def _acall_function(self, function_call: dict):
+        """
+        Call a GPT function from the event loop.
+        Coroutine functions are awaited, plain functions are run in an executor.
+        """
+        metrics = self._metrics()
+        if metrics is None:
+            return await self._ainvoke_function(function_call)
+        start = time.perf_counter()
+        function_response = await self._ainvoke_function(function_call)
+        labels = dict(agent=self.name, function=function_call["name"])
+        metrics.observe(m.FUNCTION_SECONDS, time.perf_counter() - start, **labels)
+        metrics.inc(m.FUNCTION_CALLS, **labels)
+        if isinstance(function_response, dict) and 'error' in function_response:
+            metrics.inc(m.FUNCTION_ERRORS, **labels)
+        return function_response
+
+    async def _ainvoke_function(self, function_call: dict):
         function_name = function_call["name"]
 
-        if function_name not in self.callable_functions:
+        if function_name not in self.function_registry:
             return {'error': f'"{function_name}" is not a callable function.'}
 
+        sink = self._sink()
         try:
-            print_in_color(
-                f'    {self.name} is calling function {function_name} ...', 'blue')
-            function_info = self.callable_functions[function_name]
+            function_info = self.function_registry[function_name]
             function_to_call = function_info['function']
             has_agent_param = function_info['has_agent_param']
             has_agent_name_param = function_info['has_agent_name_param']
 
             function_args = function_call["arguments"]
-            if function_args is None:
+            if not function_args:
                 function_args = dict()
             else:
                 function_args: dict = json.loads(function_args)
 
-            print_in_color(f'        with arguments {function_args}', 'blue')
+            if sink.enabled:
+                sink.emit(events.FUNCTION_CALL, agent=self.name,
+                          function=function_name, arguments=dict(function_args))
             if has_agent_param:
                 function_args[AGENT_PARAM_NAME] = self
             if has_agent_name_param:
                 function_args[AGENT_NAME_PARAM_NAME] = self.name
 
-            function_response = function_to_call(**function_args)
+            space_executor = None
+            if function_info['is_coroutine']:
+                call = asyncio.ensure_future(
+                    function_to_call(**function_args))
+            else:
+                loop = asyncio.get_running_loop()
+                call_function = functools.partial(function_to_call, **function_args)
+                if self.function_executor is not None:
+                    call = loop.run_in_executor(self.function_executor, call_function)
+                else:
+                    space_executor = _space_executor(function_to_call)
+                    held = _held_space_executors.get()
+                    if space_executor is None:
+                        call = loop.run_in_executor(None, call_function)
+                    elif space_executor in held:
+                        # An avatar calls the space from inside a call that holds its thread.
+                        call = loop.create_future()
+                        call.set_result(call_function())
+                    else:
+                        call = loop.run_in_executor(space_executor, functools.partial(
+                            _call_holding, held | {space_executor}, call_function))
+            try:
+                done, _ = await asyncio.wait(
+                    {call}, timeout=self.function_call_timeout)
+            except asyncio.CancelledError:
+                call.cancel()
+                raise
+            if not done:
+                call.cancel()
+                if space_executor is not None:
+                    _retire_space_executor(function_to_call, space_executor)
+                raise TimeoutError(
+                    f'"{function_name}" timed out after {self.function_call_timeout} seconds.')
+            if call.cancelled():
+                raise RuntimeError(f'"{function_name}" was cancelled.')
+            function_response = call.result()
             if function_response is None:
                 return None
 
-            print_in_color(f'        response: {function_response}', 'blue')
+            if sink.enabled:
+                sink.emit(events.FUNCTION_RESPONSE, agent=self.name,
+                          function=function_name, response=function_response)
             return function_response
         except Exception as e:
-            print_in_color(f'        error: {e}', 'red')
+            if sink.enabled:
+                sink.emit(events.FUNCTION_ERROR, agent=self.name,
+                          function=function_name, error=str(e))
             return {'error': str(e)}
 
     def receive_message(self, message: dict, print_output: bool = True):
@@ -324,52 +745,118 @@ class Agent:
             print_output (bool, optional): Whether to print out the message. Defaults to True.
         """
         if print_output:
-            print_in_color(
-                f'{self.name} received a message: {message["content"]}', 'green')
+            sink = self._sink()
+            if sink.enabled:
+                sink.emit(events.MESSAGE_RECEIVED, agent=self.name,
+                          content=message["content"])
         self.memory.append(message)
+        self.has_unread_messages = True
+        return self
+
+    def has_pending_input(self) -> bool:
+        """
+        Check whether the agent received messages or has unread messages in its inbox since it last thought.
+        """
+        return self.has_unread_messages or (
+            self.inbox is not None and self.inbox.has_pending())
+
+    def read_inbox(self):
+        """
+        Receive the unread messages of the agent's inbox, coalesced into a single user message.
+        """
+        if self.inbox is None:
+            return self
+        contents = self.inbox.drain()
+        if contents:
+            self.receive_message({'role': 'user', 'content': '\n'.join(contents)})
         return self
 
-    def think_and_act(self):
+    def think_and_act(self, on_event: Optional[Callable[[StreamEvent], None]] = None):
         """
         Think and act.
+
+        Args:
+            on_event (callable, optional): Called with every StreamEvent of the model's replies as it arrives.
+                It is called from the botplayers event loop thread. Defaults to None.
         """
-        for _ in range(self.function_call_repeats):
-            print_in_color(f'{self.name} >> ', 'yellow')
-            callable_functions = self._callable_function_descriptions()
-            if callable_functions:
-                new_message = stream_chat_completion(
-                    engine=self.engine,
-                    messages=self.full_memory(),
-                    print_output=not self.ignore_none_function_messages,
-                    functions=callable_functions,
-                    function_call="auto",
-                    **self.engine_args
-                )
-            else:
-                new_message = stream_chat_completion(
-                    engine=self.engine,
-                    messages=self.full_memory(),
-                    print_output=not self.ignore_none_function_messages,
-                    **self.engine_args
-                )
+        return run_sync(self.athink_and_act(on_event=on_event))
 
-            if new_message.get("function_call"):
-                self.memory.append(new_message)
-                function_response = self._call_function(
-                    new_message["function_call"])
-                if function_response is None:
-                    function_response = 'done'
-                self.memory.append(
-                    {
-                        "role": "function",
-                        "name": new_message["function_call"]["name"],
-                        "content": json.dumps(function_response, default=str),
-                    }
-                )
-            else:
-                if not self.ignore_none_function_messages:
+    async def athink_and_act(self, on_event: Optional[Callable[[StreamEvent], None]] = None):
+        """
+        Think and act without blocking the event loop.
+        Many agents can await this concurrently in one event loop.
+
+        Args:
+            on_event (callable, optional): Called with every StreamEvent of the model's replies as it arrives. Defaults to None.
+        """
+        metrics = self._metrics()
+        if metrics is not None:
+            start = time.perf_counter()
+            metrics = metrics.bind(agent=self.name)
+        error = None
+        try:
+            self.read_inbox()
+            self.has_unread_messages = False
+            sink = self._sink()
+            handle_event = stream_event_handler(
+                None if self.ignore_none_function_messages else sink, on_event, agent=self.name)
+            for _ in range(self.function_call_repeats):
+                if sink.enabled:
+                    sink.emit(events.TURN_START, agent=self.name)
+                messages = self._context_messages()
+                if self.retrieval_memory is not None:
+                    messages = await self._aretrieve(messages)
+                if metrics is not None:
+                    metrics.observe(m.PROMPT_TOKENS, self.last_prompt_tokens)
+                with request_priority(self.priority):
+                    new_message = await astream_chat_completion(
+                        engine=self.engine,
+                        messages=messages,
+                        print_output=False,
+                        cache=self.response_cache,
+                        backend=self.backend,
+                        on_event=handle_event,
+                        metrics=metrics,
+                        **self._completion_kwargs(),
+                        **self.engine_args
+                    )
+
+                if new_message.get("tool_calls"):
+                    self.memory.append(new_message)
+                    tool_calls = new_message["tool_calls"]
+                    function_responses = await asyncio.gather(*(
+                        self._acall_function(tool_call["function"]) for tool_call in tool_calls))
+                    for tool_call, function_response in zip(tool_calls, function_responses):
+                        self.memory.append(
+                            {
+                                "role": "tool",
+                                "tool_call_id": tool_call["id"],
+                                "content": self._function_message_content(function_response),
+                            }
+                        )
+                elif new_message.get("function_call"):
                     self.memory.append(new_message)
-                break
+                    function_response = await self._acall_function(
+                        new_message["function_call"])
+                    self.memory.append(
+                        {
+                            "role": "function",
+                            "name": new_message["function_call"]["name"],
+                            "content": self._function_message_content(function_response),
+                        }
+                    )
+                else:
+                    if not self.ignore_none_function_messages:
+                        self.memory.append(new_message)
+                    break
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if metrics is not None:
+                # Failed turns are observed too, labelled with the exception type.
+                metrics.observe(m.TURN_SECONDS, time.perf_counter() - start, error=error)
+                metrics.set(m.MEMORY_MESSAGES, len(self.memory))
         return self
 
     def last_message(self):
@@ -0,0 +1,91 @@
+from typing import Optional
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import threading
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+ARTIFACT_PREFIX = 'artifact:'
+
+
+def dumps(obj) -> str:
+    """
+    Serialize a function result to JSON, with orjson when it is installed.
+    Values that are not JSON serializable are written as strings.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except TypeError:
+            pass  # e.g. integers over 64 bits, the json module handles them.
+    return json.dumps(obj, default=str)
+
+
+class ArtifactStore:
+    """ A content-addressed store of large texts, bounded in size.
+
+    A text is stored under the hash of its content, so storing the same text
+    twice costs nothing. The least recently used texts are evicted from
+    memory beyond `max_bytes`; with a directory they stay readable from disk.
+
+    Args:
+        max_bytes (int, optional): The maximum total size of the texts kept in memory. Defaults to 64 MiB.
+        directory (str, optional): Where texts are also written, to outlive eviction and the process. Defaults to None.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, directory: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.num_bytes = 0
+        self._texts: 'OrderedDict[str, str]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f'{digest}.txt')
+
+    def put(self, text: str) -> str:
+        """ Store a text and get its handle. """
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        with self._lock:
+            if digest in self._texts:
+                self._texts.move_to_end(digest)
+                return ARTIFACT_PREFIX + digest
+            self._texts[digest] = text
+            self.num_bytes += len(data)
+            while self.num_bytes > self.max_bytes and len(self._texts) > 1:
+                _, evicted = self._texts.popitem(last=False)
+                self.num_bytes -= len(evicted.encode('utf-8'))
+        if self.directory is not None and not os.path.exists(self._path(digest)):
+            with open(self._path(digest), 'w', encoding='utf-8') as f:
+                f.write(text)
+        return ARTIFACT_PREFIX + digest
+
+    def get(self, handle: str) -> Optional[str]:
+        """ Get the text of a handle, or None if it is unknown or was evicted. """
+        digest = handle[len(ARTIFACT_PREFIX):] if handle.startswith(ARTIFACT_PREFIX) else handle
+        if not re.fullmatch(r'[0-9a-f]{16}', digest):
+            return None
+        with self._lock:
+            text = self._texts.get(digest)
+            if text is not None:
+                self._texts.move_to_end(digest)
+                return text
+        if self.directory is not None and os.path.exists(self._path(digest)):
+            with open(self._path(digest), encoding='utf-8') as f:
+                return f.read()
+        return None
+
+    def __contains__(self, handle: str):
+        return self.get(handle) is not None
+
+    def __len__(self):
+        return len(self._texts)
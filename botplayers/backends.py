@@ -0,0 +1,253 @@
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Union
+import asyncio
+import atexit
+import itertools
+import json
+import threading
+import time
+import weakref
+
+
+class CompletionBackend:
+    """ A source of streamed chat completions.
+
+    Backends yield chunks in the format of OpenAI's streamed ChatCompletion,
+    i.e. dicts like {'choices': [{'delta': {...}, 'finish_reason': ...}]}.
+    """
+
+    def stream(self, engine: str, messages: List[dict], **kwargs) -> Iterator[dict]:
+        """
+        Stream a chat completion.
+
+        Args:
+            engine (str): The GPT engine to use.
+            messages (list): The messages of the request.
+            kwargs: The other arguments of the request, e.g. functions and engine args.
+        """
+        raise NotImplementedError
+
+    def astream(self, engine: str, messages: List[dict], **kwargs) -> AsyncIterator[dict]:
+        """ Async counterpart of `stream`. """
+        raise NotImplementedError
+
+
+class OpenAIBackend(CompletionBackend):
+    """ Stream chat completions from the OpenAI API (or any server compatible with it).
+
+    Async requests share one HTTP session per event loop, so they reuse
+    connections instead of opening a session per request. Sync requests
+    reuse the per-thread session of the `openai` module. The sessions are
+    closed by `close`, which also runs at exit.
+
+    Args:
+        api_key (str, optional): The API key. Defaults to the `openai` module settings.
+        api_base (str, optional): The API base url, e.g. of a local inference server. Defaults to the `openai` module settings.
+        max_connections (int, optional): The maximum number of open connections of an async session. Defaults to 64.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, api_base: Optional[str] = None,
+                 max_connections: int = 64):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.max_connections = max_connections
+        self._sessions = weakref.WeakKeyDictionary()
+        atexit.register(self.close)
+
+    def _request_kwargs(self, engine: str, messages: List[dict], kwargs: dict):
+        request = dict(model=engine, messages=messages, stream=True, **kwargs)
+        if self.api_key is not None:
+            request['api_key'] = self.api_key
+        if self.api_base is not None:
+            request['api_base'] = self.api_base
+        return request
+
+    def stream(self, engine, messages, **kwargs):
+        import openai
+        return openai.ChatCompletion.create(**self._request_kwargs(engine, messages, kwargs))
+
+    def _aiosession(self):
+        """ Get the HTTP session of the running event loop. """
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            import aiohttp
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections))
+            self._sessions[loop] = session
+        return session
+
+    async def astream(self, engine, messages, **kwargs):
+        import openai
+        aiosession = getattr(openai, 'aiosession', None)
+        token = aiosession.set(self._aiosession()) if aiosession is not None else None
+        try:
+            resp = await openai.ChatCompletion.acreate(**self._request_kwargs(engine, messages, kwargs))
+        finally:
+            if token is not None:
+                aiosession.reset(token)
+        async for chunk in resp:
+            yield chunk
+
+    async def aclose(self):
+        """ Close the HTTP session of the running event loop. """
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def close(self, timeout: float = 5.0):
+        """
+        Close the HTTP sessions of every event loop, on their loops.
+        The sessions of loops that are already closed are only forgotten.
+
+        Args:
+            timeout (float, optional): The seconds to wait for the session of a loop running in another thread. Defaults to 5.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        for loop, session in list(self._sessions.items()):
+            self._sessions.pop(loop, None)
+            if session.closed or loop.is_closed():
+                continue
+            if loop is running_loop:
+                loop.create_task(session.close())
+            elif loop.is_running():
+                future = asyncio.run_coroutine_threadsafe(session.close(), loop)
+                try:
+                    future.result(timeout)
+                except Exception:
+                    future.cancel()  # Closing is best effort, e.g. at exit.
+            else:
+                loop.run_until_complete(session.close())
+
+
+MockResponse = Union[str, dict, Callable[[str, List[dict], dict], Union[str, dict]]]
+
+
+class MockBackend(CompletionBackend):
+    """ A scripted, in-process backend for tests, benchmarks and offline runs.
+
+    Each request consumes the next scripted response. A response is either
+    the reply text, a message dict with 'content', 'function_call' or
+    'tool_calls' (arguments may be dicts), or a callable
+    `(engine, messages, kwargs) -> str | dict` for replies that depend on the request.
+
+    Args:
+        responses (list, optional): The scripted responses. Defaults to None.
+        default_response (str | dict | callable, optional): The response once the script is exhausted. Defaults to 'OK'.
+        cycle (bool, optional): Whether to repeat the script instead of falling back to the default response. Defaults to False.
+        latency (float, optional): Seconds before the first chunk. Defaults to 0.
+        tokens_per_second (float, optional): The rate of the following chunks. Defaults to None, i.e. no delay.
+        chars_per_token (int, optional): The number of characters per streamed chunk. Defaults to 4.
+        record_requests (bool, optional): Whether to keep every request in `requests`. Defaults to True.
+    """
+
+    def __init__(self, responses: Optional[List[MockResponse]] = None,
+                 default_response: MockResponse = 'OK',
+                 cycle: bool = False,
+                 latency: float = 0.0,
+                 tokens_per_second: Optional[float] = None,
+                 chars_per_token: int = 4,
+                 record_requests: bool = True):
+        self.responses = list(responses) if responses is not None else []
+        self.default_response = default_response
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.chars_per_token = chars_per_token
+        self.record_requests = record_requests
+
+        self.num_requests = 0
+        self.requests = []
+        self._script = itertools.cycle(
+            self.responses) if cycle and self.responses else iter(self.responses)
+        self._lock = threading.Lock()
+
+    def _next_message(self, engine: str, messages: List[dict], kwargs: dict) -> dict:
+        with self._lock:
+            self.num_requests += 1
+            if self.record_requests:
+                self.requests.append(
+                    {'engine': engine, 'messages': list(messages), 'kwargs': kwargs})
+            response = next(self._script, self.default_response)
+        if callable(response):
+            response = response(engine, messages, kwargs)
+        if isinstance(response, str):
+            response = {'content': response}
+        return response
+
+    def _chunks(self, message: dict) -> List[dict]:
+        def chunk(delta: dict, finish_reason: Optional[str] = None):
+            return {'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+
+        def arguments_of(call: dict) -> str:
+            arguments = call.get('arguments', '')
+            if not isinstance(arguments, str):
+                arguments = json.dumps(arguments)
+            return arguments
+
+        def pieces(text: str):
+            step = max(self.chars_per_token, 1)
+            return [text[i:i + step] for i in range(0, len(text), step)]
+
+        chunks = [chunk({'role': 'assistant'})]
+        content = message.get('content') or ''
+        for piece in pieces(content):
+            chunks.append(chunk({'content': piece}))
+
+        finish_reason = 'stop'
+        function_call = message.get('function_call')
+        if function_call is not None:
+            chunks.append(chunk({'function_call': {
+                'name': function_call['name'], 'arguments': ''}}))
+            for piece in pieces(arguments_of(function_call)):
+                chunks.append(chunk({'function_call': {'arguments': piece}}))
+            finish_reason = 'function_call'
+
+        for idx, tool_call in enumerate(message.get('tool_calls') or []):
+            function = tool_call.get('function', tool_call)
+            chunks.append(chunk({'tool_calls': [{
+                'index': idx, 'id': tool_call.get('id', f'call_{idx}'), 'type': 'function',
+                'function': {'name': function['name'], 'arguments': ''}}]}))
+            for piece in pieces(arguments_of(function)):
+                chunks.append(chunk({'tool_calls': [{
+                    'index': idx, 'function': {'arguments': piece}}]}))
+            finish_reason = 'tool_calls'
+
+        chunks.append(chunk({}, finish_reason))
+        return chunks
+
+    def stream(self, engine, messages, **kwargs):
+        chunks = self._chunks(self._next_message(engine, messages, kwargs))
+        if self.latency > 0:
+            time.sleep(self.latency)
+        for idx, chunk in enumerate(chunks):
+            if idx > 0 and self.tokens_per_second:
+                time.sleep(1.0 / self.tokens_per_second)
+            yield chunk
+
+    async def astream(self, engine, messages, **kwargs):
+        chunks = self._chunks(self._next_message(engine, messages, kwargs))
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        for idx, chunk in enumerate(chunks):
+            if idx > 0 and self.tokens_per_second:
+                await asyncio.sleep(1.0 / self.tokens_per_second)
+            yield chunk
+
+
+_default_backend: Optional[CompletionBackend] = None
+
+
+def get_default_backend() -> CompletionBackend:
+    """ Get the backend used when none is given, an OpenAIBackend unless changed. """
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = OpenAIBackend()
+    return _default_backend
+
+
+def set_default_backend(backend: Optional[CompletionBackend]):
+    """ Set the backend used when none is given. Pass None to restore the OpenAIBackend. """
+    global _default_backend
+    _default_backend = backend
@@ -0,0 +1,178 @@
+from typing import Dict, List, Optional, Set
+from collections import deque
+import threading
+
+
+class _Topic:
+    __slots__ = ('entries', 'base', 'subscribers', 'num_sent')
+
+    def __init__(self):
+        # Entries are (seq, sender, content); entries[0] is the message number `base` of the topic.
+        self.entries = []
+        self.base = 0
+        self.subscribers: Set[str] = set()
+        # The number of messages each sender published, trimmed ones included.
+        self.num_sent: Dict[str, int] = dict()
+
+    @property
+    def total(self) -> int:
+        return self.base + len(self.entries)
+
+
+class MessageBus:
+    """ Topic (room) and direct channels with bounded per-agent inboxes.
+
+    Publishing to a topic appends the message to the topic once, whatever
+    the number of subscribers; each subscriber only keeps a read cursor.
+    Agents that fall more than `max_inbox` messages behind on a channel lose
+    the oldest ones.
+
+    Args:
+        max_inbox (int, optional): The maximum number of unread messages kept per channel and agent. Defaults to 100.
+    """
+
+    def __init__(self, max_inbox: int = 100):
+        self.max_inbox = max_inbox
+        self._topics: Dict[str, _Topic] = dict()
+        # Per agent and topic: [the number of the next unread message, the number of own messages before it].
+        self._cursors: Dict[str, Dict[str, List[int]]] = dict()
+        self._direct: Dict[str, deque] = dict()
+        self._dropped: Dict[str, int] = dict()
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, agent_name: str, topic: str):
+        """ Subscribe an agent to a topic. It receives the messages published from now on. """
+        with self._lock:
+            t = self._topics.setdefault(topic, _Topic())
+            t.subscribers.add(agent_name)
+            self._cursors.setdefault(agent_name, dict())[topic] = [t.total, t.num_sent.get(agent_name, 0)]
+        return self
+
+    def unsubscribe(self, agent_name: str, topic: Optional[str] = None):
+        """ Unsubscribe an agent from a topic, or from all topics and its direct channel. """
+        with self._lock:
+            cursors = self._cursors.get(agent_name, dict())
+            topics = list(cursors) if topic is None else [topic]
+            for name in topics:
+                cursors.pop(name, None)
+                if name in self._topics:
+                    self._topics[name].subscribers.discard(agent_name)
+            if topic is None:
+                self._cursors.pop(agent_name, None)
+                self._direct.pop(agent_name, None)
+                self._dropped.pop(agent_name, None)
+        return self
+
+    def publish(self, topic: str, sender: Optional[str], content: str):
+        """
+        Publish a message to every subscriber of a topic but the sender, in O(1).
+
+        Args:
+            topic (str): The topic.
+            sender (str, optional): The name of the sending agent, None if it is not an agent.
+            content (str): The message.
+        """
+        with self._lock:
+            t = self._topics.setdefault(topic, _Topic())
+            sender_cursor = self._cursors.get(sender, dict()).get(topic)
+            if sender_cursor is not None and sender_cursor[0] == t.total:
+                # Keep a caught-up sender caught up, it does not read its own messages.
+                sender_cursor[0] += 1
+                sender_cursor[1] += 1
+            if sender is not None:
+                t.num_sent[sender] = t.num_sent.get(sender, 0) + 1
+            self._seq += 1
+            t.entries.append((self._seq, sender, content))
+            if len(t.entries) > 2 * self.max_inbox:
+                removed = len(t.entries) - self.max_inbox
+                del t.entries[:removed]
+                t.base += removed
+        return self
+
+    def send(self, recipient: str, sender: Optional[str], content: str):
+        """
+        Send a message to a single agent.
+
+        Args:
+            recipient (str): The name of the receiving agent.
+            sender (str, optional): The name of the sending agent, None if it is not an agent.
+            content (str): The message.
+        """
+        with self._lock:
+            inbox = self._direct.get(recipient)
+            if inbox is None:
+                inbox = self._direct[recipient] = deque()
+            if len(inbox) >= self.max_inbox:
+                inbox.popleft()
+                self._dropped[recipient] = self._dropped.get(recipient, 0) + 1
+            self._seq += 1
+            inbox.append((self._seq, sender, content))
+        return self
+
+    @staticmethod
+    def _num_unread_own(t: _Topic, agent_name: str, cursor: List[int]) -> int:
+        return t.num_sent.get(agent_name, 0) - cursor[1]
+
+    def has_pending(self, agent_name: str) -> bool:
+        """ Check whether an agent has unread messages from others. """
+        with self._lock:
+            if self._direct.get(agent_name):
+                return True
+            for topic, cursor in self._cursors.get(agent_name, dict()).items():
+                t = self._topics[topic]
+                if t.total - cursor[0] > self._num_unread_own(t, agent_name, cursor):
+                    return True
+            return False
+
+    def drain(self, agent_name: str) -> List[str]:
+        """ Get the unread messages of an agent in the order they were posted, and mark them read. """
+        with self._lock:
+            entries = []
+            dropped = self._dropped.pop(agent_name, 0)
+            inbox = self._direct.get(agent_name)
+            if inbox:
+                entries.extend(inbox)
+                inbox.clear()
+
+            cursors = self._cursors.get(agent_name, dict())
+            for topic, cursor in cursors.items():
+                t = self._topics[topic]
+                start = max(cursor[0], t.total - self.max_inbox)
+                kept = t.entries[start - t.base:]
+                num_own_kept = sum(1 for entry in kept if entry[1] == agent_name)
+                # The agent's own messages are skipped, not dropped.
+                dropped += start - cursor[0] - (self._num_unread_own(t, agent_name, cursor) - num_own_kept)
+                entries.extend(entry for entry in kept if entry[1] != agent_name)
+                cursors[topic] = [t.total, t.num_sent.get(agent_name, 0)]
+
+        entries.sort(key=lambda entry: entry[0])
+        contents = [content for _, _, content in entries]
+        if dropped > 0:
+            contents.insert(0, f'[{dropped} earlier messages were dropped]')
+        return contents
+
+    def inbox(self, agent_name: str) -> 'Inbox':
+        """ Get the inbox of an agent, to be passed to `Agent`. """
+        return Inbox(self, agent_name)
+
+
+class Inbox:
+    """ The unread messages of one agent on a message bus.
+
+    Args:
+        bus (MessageBus): The message bus.
+        agent_name (str): The name of the agent.
+    """
+
+    def __init__(self, bus: MessageBus, agent_name: str):
+        self.bus = bus
+        self.agent_name = agent_name
+
+    def has_pending(self) -> bool:
+        """ Check whether there are unread messages. """
+        return self.bus.has_pending(self.agent_name)
+
+    def drain(self) -> List[str]:
+        """ Get the unread messages and mark them read. """
+        return self.bus.drain(self.agent_name)
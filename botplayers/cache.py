@@ -0,0 +1,139 @@
+from typing import List, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def request_key(engine: str, messages: List[dict], **kwargs) -> str:
+    """
+    Get a stable hash of a chat completion request.
+
+    Args:
+        engine (str): The GPT engine.
+        messages (list): The messages of the request.
+        kwargs: The other arguments of the request, e.g. functions and engine args.
+
+    Returns:
+        key (str): The hex digest of the canonical JSON of the request.
+    """
+    payload = {'engine': engine, 'messages': messages, 'kwargs': kwargs}
+    canonical = json.dumps(payload, sort_keys=True,
+                           separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """ A cache of chat completion responses with an in-memory LRU tier and an optional SQLite tier.
+
+    Sampled requests (temperature > 0, OpenAI defaults to 1) are not cached unless `force` is set.
+
+    Args:
+        max_entries (int, optional): The maximum number of responses kept in memory. Defaults to 1024.
+        path (str, optional): The SQLite file of the on-disk tier. Defaults to None, i.e. memory only.
+        ttl (float, optional): Seconds after which a cached response expires. Defaults to None, i.e. never.
+        force (bool, optional): Whether to also cache sampled requests. Defaults to False.
+    """
+
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None,
+                 ttl: Optional[float] = None, force: bool = False):
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl = ttl
+        self.force = force
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key TEXT PRIMARY KEY, message TEXT NOT NULL, created REAL NOT NULL)')
+            self._db.commit()
+
+    def is_cacheable(self, **kwargs) -> bool:
+        """ Check whether a request with the given engine args may be served from the cache. """
+        if self.force or kwargs.get('temperature', 1.0) == 0:
+            return True
+        with self._lock:
+            self.bypasses += 1
+        return False
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[dict]:
+        """ Get a cached response, or None on a miss. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                message_json, created = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(message_json)
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT message, created FROM responses WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    message_json, created = row
+                    if not self._expired(created):
+                        self._remember(key, message_json, created)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return json.loads(message_json)
+                    self._db.execute(
+                        'DELETE FROM responses WHERE key = ?', (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, message: dict):
+        """ Cache a response. """
+        message_json = json.dumps(message, ensure_ascii=False)
+        created = time.time()
+        with self._lock:
+            self._remember(key, message_json, created)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO responses (key, message, created) VALUES (?, ?, ?)',
+                    (key, message_json, created))
+                self._db.commit()
+
+    def _remember(self, key: str, message_json: str, created: float):
+        self._entries[key] = (message_json, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """ Remove all cached responses from both tiers. """
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM responses')
+                self._db.commit()
+
+    def stats(self) -> dict:
+        """ Get the hit and miss statistics. """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'entries': len(self._entries),
+            }
@@ -0,0 +1,251 @@
+from typing import Callable, List, Optional, Tuple
+from functools import lru_cache
+import copy
+import json
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover
+    tiktoken = None
+
+
+# Every message is wrapped as <|start|>{role/name}\n{content}<|end|>\n.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+# Every reply is primed with <|start|>assistant<|message|>.
+REPLY_PRIMING_TOKENS = 3
+
+CONTEXT_WINDOW_SIZES = {
+    'gpt-3.5-turbo-16k': 16384,
+    'gpt-3.5-turbo': 4096,
+    'gpt-4-32k': 32768,
+    'gpt-4': 8192,
+}
+DEFAULT_CONTEXT_WINDOW_SIZE = 4096
+
+
+def context_window_size(engine: str) -> int:
+    """ Get the context window size of an engine, matching versioned names by prefix. """
+    for prefix, size in CONTEXT_WINDOW_SIZES.items():
+        if engine.startswith(prefix):
+            return size
+    return DEFAULT_CONTEXT_WINDOW_SIZE
+
+
+@lru_cache()
+def _get_encoding(engine: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(engine)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+def count_text_tokens(text: str, engine: str) -> int:
+    """ Count the tokens of a text. Falls back to an estimate when tiktoken is not installed. """
+    encoding = _get_encoding(engine)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message: dict, engine: str) -> int:
+    """ Count the tokens a message takes in a chat completion request. """
+    num_tokens = TOKENS_PER_MESSAGE
+    for key, value in message.items():
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        num_tokens += count_text_tokens(value, engine)
+        if key == 'name':
+            num_tokens += TOKENS_PER_NAME
+    return num_tokens
+
+
+@lru_cache()
+def get_message_token_counter(engine: str) -> Callable[[dict], int]:
+    """
+    Get the message token counter of an engine.
+    The same function object is returned for the same engine, so it can be used as a cache key.
+    """
+    def count_tokens(message: dict) -> int:
+        return count_message_tokens(message, engine)
+    return count_tokens
+
+
+class ContextPolicy:
+    """ Decides which messages of an agent's memory are sent to the model. """
+
+    def select(self, messages: List[dict], token_counts: List[int], budget: int,
+               count_tokens: Callable[[dict], int]) -> Tuple[List[dict], int]:
+        """
+        Select the messages to send.
+
+        Args:
+            messages (list): The full memory of the agent.
+            token_counts (list): The token count of each message.
+            budget (int): The maximum number of tokens the selected messages may take.
+            count_tokens (callable): Counts the tokens of a message the policy creates.
+
+        Returns:
+            messages (list): The selected messages.
+            num_tokens (int): The number of tokens the selected messages take.
+        """
+        raise NotImplementedError
+
+    def fresh(self) -> 'ContextPolicy':
+        """ Get a policy with the same configuration and no state, e.g. for a derived avatar. """
+        return copy.copy(self)
+
+
+class KeepAllPolicy(ContextPolicy):
+    """ Send the whole memory. """
+
+    def select(self, messages, token_counts, budget, count_tokens):
+        return messages, sum(token_counts)
+
+
+class SlidingWindowPolicy(ContextPolicy):
+    """ Send the system prompt and the newest messages that fit into the budget.
+
+    Function results are never sent without the message that requested them.
+    The newest message is always sent, with its function call if it is a
+    function result, even if it alone exceeds the budget.
+
+    The window is updated incrementally: each call only looks at the messages
+    appended since the previous call, unless the memory was rebuilt.
+
+    Args:
+        pin_system_prompt (bool, optional): Whether to always send the leading system message. Defaults to True.
+    """
+
+    def __init__(self, pin_system_prompt: bool = True):
+        self.pin_system_prompt = pin_system_prompt
+        self.reset()
+
+    def reset(self):
+        self._messages = None
+        self._seen = 0
+        self._budget = None
+        self._num_pinned = 0
+        self._start = 0
+        self._total = 0
+
+    def fresh(self):
+        policy = copy.copy(self)
+        policy.reset()
+        return policy
+
+    def _is_valid_for(self, messages, budget):
+        return (self._messages is messages and self._seen <= len(messages)
+                and self._budget is not None and budget <= self._budget)
+
+    def _on_new_message(self, idx: int, message: dict, num_tokens: int):
+        self._total += num_tokens
+
+    def _evict_oldest(self, token_counts: List[int]):
+        self._total -= token_counts[self._start]
+        self._start += 1
+
+    def _shrink(self, messages, token_counts, budget, count_tokens):
+        # The newest message, with the call it answers if it is a function result, is always kept.
+        last = len(messages) - 1
+        while last > self._start and messages[last]['role'] in {'function', 'tool'}:
+            last -= 1
+        while self._total > budget and self._start < last:
+            self._evict_oldest(token_counts)
+        # Function results must follow the message that requested them.
+        while self._start < last and messages[self._start]['role'] in {'function', 'tool'}:
+            self._evict_oldest(token_counts)
+
+    def _window(self, messages):
+        return messages[self._start:]
+
+    def select(self, messages, token_counts, budget, count_tokens):
+        if not self._is_valid_for(messages, budget):
+            self.reset()
+            self._messages = messages
+            if (self.pin_system_prompt and len(messages) > 0
+                    and messages[0]['role'] == 'system'):
+                self._num_pinned = 1
+                self._total = token_counts[0]
+            self._start = self._seen = self._num_pinned
+        self._budget = budget
+
+        for idx in range(self._seen, len(messages)):
+            self._on_new_message(idx, messages[idx], token_counts[idx])
+        self._seen = len(messages)
+
+        self._shrink(messages, token_counts, budget, count_tokens)
+        return messages[:self._num_pinned] + self._window(messages), self._total
+
+
+class DropFunctionResultsPolicy(SlidingWindowPolicy):
+    """ Replace the oldest function results with a placeholder first, then slide the window.
+
+    Args:
+        pin_system_prompt (bool, optional): Whether to always send the leading system message. Defaults to True.
+        keep_recent (int, optional): The number of newest function results that are never replaced. Defaults to 1.
+        placeholder (str, optional): The content that replaces a dropped function result.
+    """
+
+    def __init__(self, pin_system_prompt: bool = True, keep_recent: int = 1,
+                 placeholder: str = '"[result omitted to save context]"'):
+        self.keep_recent = keep_recent
+        self.placeholder = placeholder
+        super().__init__(pin_system_prompt=pin_system_prompt)
+
+    def reset(self):
+        super().reset()
+        self._function_results = []
+        self._next_to_drop = 0
+        self._dropped = dict()
+
+    def _on_new_message(self, idx, message, num_tokens):
+        super()._on_new_message(idx, message, num_tokens)
+        if message['role'] in {'function', 'tool'}:
+            self._function_results.append(idx)
+
+    def _evict_oldest(self, token_counts):
+        if self._start in self._dropped:
+            _, num_tokens = self._dropped.pop(self._start)
+            self._total -= num_tokens
+            self._start += 1
+        else:
+            super()._evict_oldest(token_counts)
+
+    def _shrink(self, messages, token_counts, budget, count_tokens):
+        droppable = len(self._function_results) - self.keep_recent
+        while self._total > budget and self._next_to_drop < droppable:
+            idx = self._function_results[self._next_to_drop]
+            self._next_to_drop += 1
+            if idx < self._start:
+                continue
+            placeholder = dict(messages[idx], content=self.placeholder)
+            num_tokens = count_tokens(placeholder)
+            self._dropped[idx] = (placeholder, num_tokens)
+            self._total -= token_counts[idx] - num_tokens
+        super()._shrink(messages, token_counts, budget, count_tokens)
+
+    def _window(self, messages):
+        window = messages[self._start:]
+        for idx, (placeholder, _) in self._dropped.items():
+            window[idx - self._start] = placeholder
+        return window
+
+
+def function_descriptions_tokens(function_descriptions: List[dict], engine: str) -> int:
+    """ Count the tokens the function descriptions of a request take. """
+    if not function_descriptions:
+        return 0
+    return count_text_tokens(json.dumps(function_descriptions), engine)
+
+
+def resolve_context_budget(engine: str, max_context_tokens: Optional[int],
+                           reply_token_reserve: int, function_tokens: int) -> int:
+    """ Get the number of tokens left for messages in a request. """
+    if max_context_tokens is None:
+        max_context_tokens = context_window_size(engine)
+    return max_context_tokens - reply_token_reserve - REPLY_PRIMING_TOKENS - function_tokens
@@ -0,0 +1,209 @@
+from typing import Optional, TextIO
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+
+from .util import colorize_text_in_terminal
+
+TURN_START = 'turn_start'
+TEXT = 'text'
+TEXT_END = 'text_end'
+FUNCTION_CALL = 'function_call'
+FUNCTION_RESPONSE = 'function_response'
+FUNCTION_ERROR = 'function_error'
+MESSAGE_RECEIVED = 'message_received'
+
+
+def format_console_event(event: str, fields: dict) -> Optional[str]:
+    """Format an event the way agents print it to the terminal.
+
+    Args:
+        event: The kind of the event.
+        fields: The fields of the event.
+
+    Returns:
+        text: The colorized text to write, or None if the event is not printed.
+    """
+    if event == TURN_START:
+        return colorize_text_in_terminal(f'{fields["agent"]} >> ', 'yellow') + '\n'
+    elif event == TEXT:
+        return colorize_text_in_terminal(fields['text'], 'yellow')
+    elif event == TEXT_END:
+        return '\n'
+    elif event == FUNCTION_CALL:
+        return colorize_text_in_terminal(
+            f'    {fields["agent"]} is calling function {fields["function"]} ...', 'blue') + '\n' + \
+            colorize_text_in_terminal(
+                f'        with arguments {fields["arguments"]}', 'blue') + '\n'
+    elif event == FUNCTION_RESPONSE:
+        return colorize_text_in_terminal(f'        response: {fields["response"]}', 'blue') + '\n'
+    elif event == FUNCTION_ERROR:
+        return colorize_text_in_terminal(f'        error: {fields["error"]}', 'red') + '\n'
+    elif event == MESSAGE_RECEIVED:
+        return colorize_text_in_terminal(
+            f'{fields["agent"]} received a message: {fields["content"]}', 'green') + '\n'
+    return None
+
+
+class EventSink:
+    """ Receives the structured events of agents, e.g. streamed text and function calls.
+
+    Producers check `enabled` before building an event, so a disabled sink
+    costs no formatting at all.
+    """
+    enabled: bool = True
+
+    def emit(self, event: str, **fields):
+        """
+        Receive an event.
+
+        Args:
+            event (str): The kind of the event, e.g. TEXT or FUNCTION_CALL.
+            fields: The fields of the event, e.g. agent, text, function, arguments, response.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """ Wait until every received event is written. """
+
+    def close(self):
+        """ Flush and release the sink. """
+        self.flush()
+
+
+class NullSink(EventSink):
+    """ Discard every event. """
+    enabled = False
+
+    def emit(self, event, **fields):
+        pass
+
+
+class ConsoleSink(EventSink):
+    """ Print events to the terminal synchronously, in color.
+
+    Args:
+        stream (TextIO, optional): Where to write. Defaults to sys.stdout at the time of writing.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream
+
+    def emit(self, event, **fields):
+        text = format_console_event(event, fields)
+        if text is not None:
+            (self.stream or sys.stdout).write(text)
+
+
+class _BackgroundSink(EventSink):
+    """ Queue events and write them on a background thread. """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def emit(self, event, **fields):
+        self._queue.put((time.time(), event, fields))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+                if self._queue.empty():
+                    self._flush_output()
+            except Exception as e:  # pragma: no cover
+                sys.stderr.write(f'{type(self).__name__} failed to write an event: {e}\n')
+            finally:
+                self._queue.task_done()
+
+    def _write(self, timestamp: float, event: str, fields: dict):
+        raise NotImplementedError
+
+    def _flush_output(self):
+        pass
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._flush_output()
+
+
+class BufferedConsoleSink(_BackgroundSink):
+    """ Print events to the terminal from a background thread.
+
+    Emitting only enqueues the event; formatting and terminal I/O happen off
+    the agent loop and are flushed in batches.
+
+    Args:
+        stream (TextIO, optional): Where to write. Defaults to sys.stdout.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream if stream is not None else sys.stdout
+        super().__init__()
+
+    def _write(self, timestamp, event, fields):
+        text = format_console_event(event, fields)
+        if text is not None:
+            self.stream.write(text)
+
+    def _flush_output(self):
+        self.stream.flush()
+
+
+class JsonlSink(_BackgroundSink):
+    """ Append events as JSON lines to a file, from a background thread.
+
+    Each line holds the timestamp, the kind of the event and its fields.
+    Fields that are not JSON serializable are written as strings.
+
+    Args:
+        path (str): The file to append to.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        super().__init__()
+
+    def _write(self, timestamp, event, fields):
+        record = {'time': timestamp, 'event': event}
+        record.update(fields)
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def _flush_output(self):
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+_default_sink: EventSink = ConsoleSink()
+
+
+def get_default_sink() -> EventSink:
+    """ Get the sink used when none is given, a ConsoleSink unless changed. """
+    return _default_sink
+
+
+def set_default_sink(sink: Optional[EventSink]):
+    """ Set the sink used when none is given. Pass None to restore the ConsoleSink. """
+    global _default_sink
+    _default_sink = sink if sink is not None else ConsoleSink()
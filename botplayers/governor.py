@@ -0,0 +1,128 @@
+from typing import Optional
+from array import array
+from collections import OrderedDict
+import threading
+
+from .agent import InteractiveSpace, agent_callable
+from .artifacts import ArtifactStore, dumps
+from .context import _get_encoding, count_text_tokens
+
+# The characters per token assumed to page artifacts when tiktoken is not installed.
+CHARS_PER_TOKEN = 4
+
+
+class _ArtifactPage(dict):
+    """ A page of an artifact, which is never spilled again. """
+
+
+class ResultGovernor(InteractiveSpace):
+    """ Keeps large function results out of agent memories.
+
+    A result whose JSON exceeds `max_tokens` is stored in an artifact store,
+    and the agent gets a preview and a handle instead. The agent pages
+    through the full result with the `read_artifact` function, which the
+    governor installs. Previews and pages are cut on token boundaries, and
+    the pages returned by `read_artifact` are kept in memory as they are.
+
+    Args:
+        store (ArtifactStore, optional): Where large results go. Defaults to a new in-memory store.
+        max_tokens (int, optional): The maximum number of tokens of a result kept in memory. Defaults to 1000.
+        page_tokens (int, optional): The number of tokens of a preview or page. Defaults to 500.
+        engine (str, optional): The engine whose tokenizer counts tokens. Defaults to 'gpt-3.5-turbo'.
+        token_cache_size (int, optional): The number of artifacts whose tokens are kept, so paging
+            through an artifact encodes it once. Defaults to 8.
+    """
+
+    def __init__(self, store: Optional[ArtifactStore] = None, max_tokens: int = 1000,
+                 page_tokens: int = 500, engine: str = 'gpt-3.5-turbo', token_cache_size: int = 8):
+        assert page_tokens <= max_tokens, 'page_tokens cannot exceed max_tokens.'
+        self.store = store if store is not None else ArtifactStore()
+        self.max_tokens = max_tokens
+        self.page_tokens = page_tokens
+        self.engine = engine
+        self.token_cache_size = token_cache_size
+        self.num_spilled = 0
+        self._tokens: 'OrderedDict[str, array]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _encode(self, text: str) -> Optional[array]:
+        encoding = _get_encoding(self.engine)
+        if encoding is None:
+            return None
+        return array('I', encoding.encode(text, disallowed_special=()))
+
+    def _cache_tokens(self, handle: str, tokens: array):
+        with self._lock:
+            self._tokens[handle] = tokens
+            self._tokens.move_to_end(handle)
+            while len(self._tokens) > self.token_cache_size:
+                self._tokens.popitem(last=False)
+
+    def _artifact_tokens(self, handle: str, text: str) -> Optional[array]:
+        """ Get the tokens of an artifact, encoded once while it is cached, None without tiktoken. """
+        with self._lock:
+            tokens = self._tokens.get(handle)
+            if tokens is not None:
+                self._tokens.move_to_end(handle)
+                return tokens
+        tokens = self._encode(text)
+        if tokens is not None:
+            self._cache_tokens(handle, tokens)
+        return tokens
+
+    def _num_pages(self, text: str, tokens: Optional[array]) -> int:
+        if tokens is None:
+            return max(1, -(-len(text) // (self.page_tokens * CHARS_PER_TOKEN)))
+        return max(1, -(-len(tokens) // self.page_tokens))
+
+    def _page(self, text: str, tokens: Optional[array], page: int) -> str:
+        """ Get the text of a page, numbered from 1. """
+        if tokens is None:
+            page_chars = self.page_tokens * CHARS_PER_TOKEN
+            start = (page - 1) * page_chars
+            return text[start:start + page_chars]
+        start = (page - 1) * self.page_tokens
+        return _get_encoding(self.engine).decode(tokens[start:start + self.page_tokens].tolist())
+
+    def content(self, function_response) -> str:
+        """ Get the message content of a function result, spilling it to the store if it is too large. """
+        if function_response is None:
+            function_response = 'done'
+        text = dumps(function_response)
+        # A token is at least one character, so short texts need no counting.
+        if len(text) <= self.max_tokens or isinstance(function_response, _ArtifactPage):
+            return text
+        tokens = self._encode(text)
+        num_tokens = len(tokens) if tokens is not None else count_text_tokens(text, self.engine)
+        if num_tokens <= self.max_tokens:
+            return text
+
+        handle = self.store.put(text)
+        if tokens is not None:
+            self._cache_tokens(handle, tokens)
+        self.num_spilled += 1
+        return dumps({
+            'preview': self._page(text, tokens, 1),
+            'artifact': handle,
+            'tokens': num_tokens,
+            'pages': self._num_pages(text, tokens),
+            'note': 'The result is too large to show. Call read_artifact with the artifact and a page to read it.',
+        })
+
+    @agent_callable
+    def read_artifact(self, artifact: str, page: int = 1):
+        """Read a page of a large function result.
+
+        Args:
+            artifact: the artifact handle of the result.
+            page: the number of the page, starting from 1.
+        """
+        text = self.store.get(artifact)
+        if text is None:
+            return {'error': f'Unknown or expired artifact {artifact}.'}
+        tokens = self._artifact_tokens(artifact, text)
+        num_pages = self._num_pages(text, tokens)
+        if not 1 <= page <= num_pages:
+            return {'error': f'The artifact has {num_pages} pages.'}
+        return _ArtifactPage(artifact=artifact, page=page, pages=num_pages,
+                             content=self._page(text, tokens, page))
@@ -0,0 +1,247 @@
+from typing import Dict, Iterator, List, Optional
+from array import array
+from urllib.parse import quote, unquote
+import json
+import mmap
+import os
+import threading
+
+JOURNAL_SUFFIX = '.journal.jsonl'
+SNAPSHOT_SUFFIX = '.snapshot.jsonl'
+INDEX_SUFFIX = '.index'
+
+_OFFSET_TYPECODE = 'Q'
+_OFFSET_SIZE = array(_OFFSET_TYPECODE).itemsize
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class AgentJournal:
+    """ The persistent messages of one agent.
+
+    New messages are appended to a JSONL journal, one `{"n": ..., "message": ...}`
+    line each. Every `snapshot_every` messages the journal is folded into a
+    compact JSONL snapshot and truncated. A binary index holds the end offset
+    of every snapshot line, so the number of messages is known without reading
+    the snapshot, and single messages are parsed from a memory map on demand.
+
+    Appending to the index is what commits a compaction: a crash at any point
+    leaves either the journal or the snapshot holding every message, and
+    journal lines already in the snapshot are skipped on load.
+
+    Args:
+        path (str): The path prefix of the agent's files.
+        snapshot_every (int, optional): The number of journal messages that triggers a compaction. Defaults to 1000.
+        fsync (bool, optional): Whether to fsync every append, for durability against power loss. Defaults to False.
+    """
+
+    def __init__(self, path: str, snapshot_every: int = 1000, fsync: bool = False):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.snapshot_path = path + SNAPSHOT_SUFFIX
+        self.index_path = path + INDEX_SUFFIX
+
+        self._offsets: Optional[array] = None
+        self._journal: Optional[List[dict]] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._lock = threading.RLock()
+
+    def _load_offsets(self) -> array:
+        if self._offsets is None:
+            offsets = array(_OFFSET_TYPECODE)
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'rb') as f:
+                    data = f.read()
+                # A torn write leaves a partial offset at the end, it was never committed.
+                offsets.frombytes(data[:len(data) - len(data) % _OFFSET_SIZE])
+            self._offsets = offsets
+        return self._offsets
+
+    def _load_journal(self) -> List[dict]:
+        if self._journal is None:
+            snapshot_length = len(self._load_offsets())
+            messages = []
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'rb+') as f:
+                    position = 0
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # A torn write at the end of the journal, drop it before appending again.
+                            f.truncate(position)
+                            break
+                        position += len(line)
+                        if record['n'] >= snapshot_length:
+                            messages.append(record['message'])
+            self._journal = messages
+        return self._journal
+
+    def _snapshot_map(self) -> Optional[mmap.mmap]:
+        if self._mmap is None and len(self._load_offsets()) > 0:
+            with open(self.snapshot_path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _close_map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def snapshot_length(self) -> int:
+        """ Get the number of messages in the snapshot, reading only the index. """
+        with self._lock:
+            return len(self._load_offsets())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load_offsets()) + len(self._load_journal())
+
+    def __getitem__(self, idx: int) -> dict:
+        """ Get a single message, parsing only that message. """
+        with self._lock:
+            length = len(self)
+            if idx < 0:
+                idx += length
+            if not 0 <= idx < length:
+                raise IndexError('journal index out of range')
+            offsets = self._load_offsets()
+            if idx >= len(offsets):
+                return self._load_journal()[idx - len(offsets)]
+            start = offsets[idx - 1] if idx > 0 else 0
+            return json.loads(self._snapshot_map()[start:offsets[idx]])
+
+    def load(self, start: int = 0) -> List[dict]:
+        """
+        Get the messages from `start` on.
+
+        Args:
+            start (int, optional): The index of the first message. Defaults to 0.
+        """
+        with self._lock:
+            offsets = self._load_offsets()
+            messages = []
+            if start < len(offsets):
+                snapshot = self._snapshot_map()
+                position = offsets[start - 1] if start > 0 else 0
+                for end in offsets[start:]:
+                    messages.append(json.loads(snapshot[position:end]))
+                    position = end
+            messages.extend(self._load_journal()[max(0, start - len(offsets)):])
+            return messages
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.load())
+
+    def append(self, message: dict):
+        """ Append a message to the journal, and compact it if it is long enough. """
+        with self._lock:
+            journal = self._load_journal()
+            n = len(self._load_offsets()) + len(journal)
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(_dumps({'n': n, 'message': message}) + '\n')
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            journal.append(message)
+            if self.snapshot_every is not None and len(journal) >= self.snapshot_every:
+                self.compact()
+        return self
+
+    def compact(self):
+        """ Fold the journal into the snapshot and truncate it. """
+        with self._lock:
+            journal = self._load_journal()
+            if not journal:
+                return self
+            offsets = self._load_offsets()
+            end = offsets[-1] if len(offsets) > 0 else 0
+            self._close_map()
+
+            new_offsets = array(_OFFSET_TYPECODE)
+            with open(self.snapshot_path, 'ab') as f:
+                # Drop what a crashed compaction wrote after the last committed message.
+                f.truncate(end)
+                f.seek(end)
+                for message in journal:
+                    end += f.write((_dumps(message) + '\n').encode('utf-8'))
+                    new_offsets.append(end)
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.index_path, 'ab') as f:
+                f.truncate(len(offsets) * _OFFSET_SIZE)
+                f.write(new_offsets.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            offsets.extend(new_offsets)
+
+            with open(self.journal_path, 'w', encoding='utf-8'):
+                pass
+            journal.clear()
+        return self
+
+    def close(self):
+        """ Release the memory map. The journal stays readable. """
+        with self._lock:
+            self._close_map()
+
+
+class JournalStore:
+    """ A directory of agent journals, to persist and resume agent memories.
+
+    Opening a store reads nothing; an agent's journal is read the first time
+    its memory is used, so a world of many agents resumes quickly.
+
+    Args:
+        directory (str): The directory of the journals. It is created if needed.
+        snapshot_every (int, optional): The number of journal messages that triggers a compaction. Defaults to 1000.
+        fsync (bool, optional): Whether to fsync every append. Defaults to False.
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = 1000, fsync: bool = False):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._journals: Dict[str, AgentJournal] = dict()
+        self._lock = threading.Lock()
+
+    def journal(self, agent_name: str) -> AgentJournal:
+        """ Get the journal of an agent. """
+        with self._lock:
+            journal = self._journals.get(agent_name)
+            if journal is None:
+                journal = self._journals[agent_name] = AgentJournal(
+                    os.path.join(self.directory, quote(agent_name, safe='')),
+                    snapshot_every=self.snapshot_every, fsync=self.fsync)
+            return journal
+
+    def agent_names(self) -> List[str]:
+        """ Get the names of the agents that have a journal. """
+        names = set()
+        for filename in os.listdir(self.directory):
+            for suffix in (JOURNAL_SUFFIX, SNAPSHOT_SUFFIX):
+                if filename.endswith(suffix):
+                    names.add(unquote(filename[:-len(suffix)]))
+        return sorted(names)
+
+    def __contains__(self, agent_name: str):
+        return len(self.journal(agent_name)) > 0
+
+    def compact(self):
+        """ Compact the journals that were used. """
+        with self._lock:
+            journals = list(self._journals.values())
+        for journal in journals:
+            journal.compact()
+        return self
+
+    def close(self):
+        with self._lock:
+            journals = list(self._journals.values())
+        for journal in journals:
+            journal.close()
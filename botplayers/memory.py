@@ -0,0 +1,129 @@
+from typing import Callable, List, Optional
+
+from .journal import AgentJournal
+
+
+class MessageLog:
+    """ An append-only message log that shares its parent log as a prefix.
+
+    Deriving a log from a parent is O(1): the parent's messages are not copied.
+    The flattened view returned by `full()` is cached, extended in place when
+    this log is appended to, and only rebuilt when the parent log changes.
+
+    With a journal, every appended message is also written to the journal, and
+    the messages already in it are only loaded when they are first needed.
+
+    Args:
+        messages (list, optional): The initial messages of this log. Defaults to None.
+        parent (MessageLog, optional): The log whose messages precede this log. Defaults to None.
+        journal (AgentJournal, optional): Where the messages of this log are persisted. Defaults to None.
+    """
+
+    def __init__(self, messages: Optional[List[dict]] = None,
+                 parent: Optional['MessageLog'] = None,
+                 journal: Optional[AgentJournal] = None):
+        self.parent = parent
+        self.journal = journal
+        self._messages = None if journal is not None else []
+        if messages is not None:
+            self.extend(messages)
+
+        self._flat = None
+        self._flat_parent = None
+        self._flat_parent_len = 0
+
+        self._token_counter = None
+        self._token_counts = []
+        self._flat_token_counts = None
+        self._flat_token_counts_parent = None
+        self._flat_token_counts_parent_len = 0
+
+    @property
+    def messages(self) -> List[dict]:
+        """ The messages of this log, without the parent's. """
+        if self._messages is None:
+            self._messages = self.journal.load()
+        return self._messages
+
+    def append(self, message: dict):
+        """ Append a message to the log. """
+        if self.journal is not None:
+            self.journal.append(message)
+        if self._messages is not None:
+            self._messages.append(message)
+        return self
+
+    def extend(self, messages: List[dict]):
+        """ Append several messages to the log. """
+        for message in messages:
+            self.append(message)
+        return self
+
+    def full(self) -> List[dict]:
+        """
+        Get the parent's messages followed by the messages of this log.
+        The returned list is cached and shared, do not modify it.
+        """
+        if self.parent is None:
+            return self.messages
+
+        parent_flat = self.parent.full()
+        if (self._flat is None or self._flat_parent is not parent_flat
+                or self._flat_parent_len != len(parent_flat)):
+            self._flat = parent_flat + self.messages
+            self._flat_parent = parent_flat
+            self._flat_parent_len = len(parent_flat)
+        elif len(self._flat) < self._flat_parent_len + len(self.messages):
+            self._flat.extend(
+                self.messages[len(self._flat) - self._flat_parent_len:])
+        return self._flat
+
+    def token_counts(self, count_tokens: Callable[[dict], int]) -> List[int]:
+        """
+        Get the token count of each message of this log.
+        Each message is counted once, counts are recomputed only for a different counter.
+        """
+        if self._token_counter is not count_tokens:
+            self._token_counter = count_tokens
+            self._token_counts = []
+            self._flat_token_counts = None
+        for message in self.messages[len(self._token_counts):]:
+            self._token_counts.append(count_tokens(message))
+        return self._token_counts
+
+    def full_token_counts(self, count_tokens: Callable[[dict], int]) -> List[int]:
+        """
+        Get the token count of each message of `full()`.
+        The returned list is cached and shared, do not modify it.
+        """
+        own_counts = self.token_counts(count_tokens)
+        if self.parent is None:
+            return own_counts
+
+        parent_counts = self.parent.full_token_counts(count_tokens)
+        if (self._flat_token_counts is None or self._flat_token_counts_parent is not parent_counts
+                or self._flat_token_counts_parent_len != len(parent_counts)):
+            self._flat_token_counts = parent_counts + own_counts
+            self._flat_token_counts_parent = parent_counts
+            self._flat_token_counts_parent_len = len(parent_counts)
+        elif len(self._flat_token_counts) < len(parent_counts) + len(own_counts):
+            self._flat_token_counts.extend(
+                own_counts[len(self._flat_token_counts) - len(parent_counts):])
+        return self._flat_token_counts
+
+    def full_length(self) -> int:
+        """ Get the number of messages in `full()` without flattening. """
+        if self.parent is None:
+            return len(self)
+        return self.parent.full_length() + len(self)
+
+    def __len__(self):
+        if self._messages is None:
+            return len(self.journal)
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __getitem__(self, idx):
+        return self.messages[idx]
@@ -0,0 +1,293 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+from bisect import bisect_left
+import atexit
+import json
+import math
+import sys
+import threading
+import time
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 131072)
+
+# The metrics recorded by botplayers.
+COMPLETIONS = 'completions_total'
+COMPLETION_ERRORS = 'completion_errors_total'
+COMPLETION_CACHE_HITS = 'completion_cache_hits_total'
+COMPLETION_TTFT = 'completion_ttft_seconds'
+COMPLETION_SECONDS = 'completion_seconds'
+COMPLETION_TOKENS = 'completion_tokens'
+PROMPT_TOKENS = 'prompt_tokens'
+TURN_SECONDS = 'turn_seconds'
+FUNCTION_CALLS = 'function_calls_total'
+FUNCTION_ERRORS = 'function_errors_total'
+FUNCTION_SECONDS = 'function_seconds'
+MEMORY_MESSAGES = 'memory_messages'
+
+# name: (type, help, buckets)
+DEFINITIONS: Dict[str, Tuple[str, str, Optional[Sequence[float]]]] = {
+    COMPLETIONS: (COUNTER, 'Chat completions requested.', None),
+    COMPLETION_ERRORS: (COUNTER, 'Chat completions that raised an error.', None),
+    COMPLETION_CACHE_HITS: (COUNTER, 'Chat completions served from the response cache.', None),
+    COMPLETION_TTFT: (HISTOGRAM, 'Seconds from the request to the first streamed chunk.', LATENCY_BUCKETS),
+    COMPLETION_SECONDS: (HISTOGRAM, 'Seconds from the request to the end of the stream.', LATENCY_BUCKETS),
+    COMPLETION_TOKENS: (HISTOGRAM, 'Tokens of the completions.', TOKEN_BUCKETS),
+    PROMPT_TOKENS: (HISTOGRAM, 'Tokens of the prompts sent by agents.', TOKEN_BUCKETS),
+    TURN_SECONDS: (HISTOGRAM, 'Seconds of think_and_act, function calls included, failed turns labelled with their error.',
+                   LATENCY_BUCKETS),
+    FUNCTION_CALLS: (COUNTER, 'Function calls.', None),
+    FUNCTION_ERRORS: (COUNTER, 'Function calls that returned an error.', None),
+    FUNCTION_SECONDS: (HISTOGRAM, 'Seconds of function calls.', LATENCY_BUCKETS),
+    MEMORY_MESSAGES: (GAUGE, 'Messages in the memory of an agent.', None),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """ Counts observations in buckets, by upper bound, and keeps their count, sum and maximum. """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """ Estimate a quantile, interpolating linearly inside its bucket. """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[idx - 1] if idx > 0 else 0.0
+                upper = self.buckets[idx] if idx < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self) -> dict:
+        return {'count': self.count, 'sum': self.sum, 'mean': self.mean,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+                'max': self.max if self.count else 0.0}
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra is not None else [])
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metrics:
+    """ In-process counters, gauges and histograms, labelled e.g. by agent.
+
+    Agents and `stream_chat_completion` record into a Metrics object when
+    they are given one, or when a default one is set with
+    `set_default_metrics`. Otherwise they record nothing, at the cost of a
+    None check.
+
+    Args:
+        prefix (str, optional): The prefix of the metric names in the Prometheus export. Defaults to 'botplayers_'.
+    """
+
+    def __init__(self, prefix: str = 'botplayers_'):
+        self.prefix = prefix
+        self._series: Dict[str, Dict[LabelKey, object]] = dict()
+        # The type of each metric, by the method that recorded it first.
+        self._kinds: Dict[str, str] = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _definition(name: str) -> Tuple[Optional[str], str, Optional[Sequence[float]]]:
+        return DEFINITIONS.get(name, (None, '', LATENCY_BUCKETS))
+
+    def _series_of(self, name: str, kind: str) -> Dict[LabelKey, object]:
+        series = self._series.get(name)
+        if series is None:
+            series = self._series[name] = dict()
+            self._kinds[name] = kind
+        return series
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """ Add to a counter. """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series_of(name, COUNTER)
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        """ Set a gauge. """
+        key = _label_key(labels)
+        with self._lock:
+            self._series_of(name, GAUGE)[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """ Record an observation of a histogram. """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series_of(name, HISTOGRAM)
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self._definition(name)[2] or LATENCY_BUCKETS)
+            histogram.observe(value)
+
+    def bind(self, **labels) -> 'BoundMetrics':
+        """ Get a view that adds labels to everything it records. """
+        return BoundMetrics(self, labels)
+
+    def get(self, name: str, **labels):
+        """ Get the value of a counter or gauge, or the Histogram of a histogram, None if never recorded. """
+        with self._lock:
+            return self._series.get(name, dict()).get(_label_key(labels))
+
+    def series(self, name: str) -> List[Tuple[dict, object]]:
+        """ Get the labels and values of every series of a metric. """
+        with self._lock:
+            return [(dict(key), value) for key, value in self._series.get(name, dict()).items()]
+
+    def reset(self):
+        """ Forget everything recorded. """
+        with self._lock:
+            self._series.clear()
+            self._kinds.clear()
+
+    def snapshot(self) -> dict:
+        """ Get every metric as JSON-serializable data, histograms summarized. """
+        snapshot = dict()
+        with self._lock:
+            for name, series in self._series.items():
+                snapshot[name] = [
+                    dict(labels=dict(key), **(value.summary() if isinstance(value, Histogram)
+                                              else {'value': value}))
+                    for key, value in series.items()]
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """ Export every metric in the Prometheus text exposition format. """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._series.items()):
+                kind = self._kinds[name]
+                _, help_text, _ = self._definition(name)
+                full_name = self.prefix + name
+                if help_text:
+                    lines.append(f'# HELP {full_name} {help_text}')
+                lines.append(f'# TYPE {full_name} {kind}')
+                for key, value in series.items():
+                    if not isinstance(value, Histogram):
+                        lines.append(f'{full_name}{_format_labels(key)} {_format_value(value)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + (math.inf,), value.counts):
+                        cumulative += count
+                        le = ('le', _format_value(bound))
+                        lines.append(f'{full_name}_bucket{_format_labels(key, le)} {cumulative}')
+                    lines.append(f'{full_name}_sum{_format_labels(key)} {_format_value(value.sum)}')
+                    lines.append(f'{full_name}_count{_format_labels(key)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class BoundMetrics:
+    """ A view of Metrics that adds labels to everything it records. """
+
+    def __init__(self, metrics: Metrics, labels: dict):
+        self.metrics = metrics
+        self.labels = labels
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        self.metrics.inc(name, amount, **self.labels, **labels)
+
+    def set(self, name: str, value: float, **labels):
+        self.metrics.set(name, value, **self.labels, **labels)
+
+    def observe(self, name: str, value: float, **labels):
+        self.metrics.observe(name, value, **self.labels, **labels)
+
+    def bind(self, **labels) -> 'BoundMetrics':
+        return BoundMetrics(self.metrics, {**self.labels, **labels})
+
+
+class JsonlMetricsExporter:
+    """ Append a snapshot of metrics as a JSON line to a file periodically, from a background thread.
+
+    Args:
+        metrics (Metrics): The metrics to export.
+        path (str): The file to append to.
+        interval (float, optional): Seconds between snapshots. Defaults to 60.
+    """
+
+    def __init__(self, metrics: Metrics, path: str, interval: float = 60.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self):
+        """ Append a snapshot now. """
+        record = {'time': time.time(), 'metrics': self.metrics.snapshot()}
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:  # pragma: no cover
+                sys.stderr.write(f'{type(self).__name__} failed to write metrics: {e}\n')
+
+    def close(self):
+        """ Stop exporting, after a last snapshot. """
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+_default_metrics: Optional[Metrics] = None
+
+
+def get_default_metrics() -> Optional[Metrics]:
+    """ Get the metrics recorded into when none are given, None (disabled) unless changed. """
+    return _default_metrics
+
+
+def set_default_metrics(metrics: Optional[Metrics]):
+    """ Set the metrics recorded into when none are given. Pass None to disable metrics. """
+    global _default_metrics
+    _default_metrics = metrics
@@ -0,0 +1,337 @@
+from typing import Callable, List, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+
+from .backends import CompletionBackend, get_default_backend
+
+# The priority of the model requests made in the current context, see `request_priority`.
+_request_priority: ContextVar[int] = ContextVar('botplayers_request_priority', default=0)
+
+RETRYABLE_STATUSES = {408, 409, 429}
+# Errors of the openai module and of the standard library that are worth retrying.
+RETRYABLE_ERROR_NAMES = {'RateLimitError', 'ServiceUnavailableError', 'APIConnectionError',
+                         'APITimeoutError', 'Timeout', 'TryAgain', 'InternalServerError'}
+
+
+@contextmanager
+def request_priority(priority: int):
+    """ Give the model requests made inside the block a priority; higher priorities are sent first. """
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """ Check whether a failed request is worth retrying: rate limits, server errors and connection errors. """
+    for attr in ('http_status', 'status_code', 'status'):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status in RETRYABLE_STATUSES or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(error, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after') or headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class _Bucket:
+    """ A token bucket refilled continuously at `per_minute` units a minute. """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ('tokens', 'wake')
+
+    def __init__(self, tokens: int, wake: Callable[[], None]):
+        self.tokens = tokens
+        self.wake = wake
+
+
+class RateLimiter:
+    """ Admits model requests within request and token rates and a concurrency limit.
+
+    Waiting requests are admitted in order of priority, then of arrival.
+    The limiter is thread safe, and sync and async callers can share it.
+
+    Args:
+        requests_per_minute (float, optional): The request rate. Defaults to None, i.e. no limit.
+        tokens_per_minute (float, optional): The token rate, prompt and maximum reply. Defaults to None, i.e. no limit.
+        max_concurrency (int, optional): The maximum number of requests in flight. Defaults to None, i.e. no limit.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 max_concurrency: Optional[int] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+
+        self.num_admitted = 0
+        self.total_wait_time = 0.0
+        self.num_active = 0
+        self._paused_until = 0.0
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def num_waiting(self) -> int:
+        return len(self._waiters)
+
+    def _wake_head(self):
+        if self._waiters:
+            self._waiters[0][2].wake()
+
+    def _enqueue(self, tokens: int, priority: int, wake: Callable[[], None]) -> _Waiter:
+        waiter = _Waiter(tokens, wake)
+        with self._lock:
+            heapq.heappush(self._waiters, (-priority, next(self._seq), waiter))
+            if self._waiters[0][2] is waiter:
+                waiter.wake()
+        return waiter
+
+    def _cancel(self, waiter: _Waiter):
+        with self._lock:
+            for idx, entry in enumerate(self._waiters):
+                if entry[2] is waiter:
+                    self._waiters.pop(idx)
+                    heapq.heapify(self._waiters)
+                    break
+            self._wake_head()
+
+    def _try_admit(self, waiter: _Waiter) -> Optional[float]:
+        """ Admit a waiter if it can go now. Otherwise get how long to wait, None until woken up. """
+        with self._lock:
+            if self._waiters[0][2] is not waiter:
+                return None
+            if self.max_concurrency is not None and self.num_active >= self.max_concurrency:
+                return None
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self._requests is not None:
+                wait = max(wait, self._requests.wait_time(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.wait_time(waiter.tokens, now))
+            if wait > 0:
+                return wait
+            heapq.heappop(self._waiters)
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None:
+                self._tokens.take(waiter.tokens)
+            self.num_active += 1
+            self.num_admitted += 1
+            self._wake_head()
+            return 0.0
+
+    def acquire(self, tokens: int = 0, priority: Optional[int] = None):
+        """
+        Wait until a request may be sent. Call `release` once it is done.
+
+        Args:
+            tokens (int, optional): The estimated tokens of the request. Defaults to 0.
+            priority (int, optional): Defaults to the priority of the current context, see `request_priority`.
+        """
+        if priority is None:
+            priority = _request_priority.get()
+        start = time.monotonic()
+        event = threading.Event()
+        waiter = self._enqueue(tokens, priority, event.set)
+        try:
+            while True:
+                wait = self._try_admit(waiter)
+                if wait == 0:
+                    break
+                event.wait(wait)
+                event.clear()
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        self.total_wait_time += time.monotonic() - start
+
+    async def aacquire(self, tokens: int = 0, priority: Optional[int] = None):
+        """ Async counterpart of `acquire`. """
+        if priority is None:
+            priority = _request_priority.get()
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # The loop is closed.
+
+        waiter = self._enqueue(tokens, priority, wake)
+        try:
+            while True:
+                wait = self._try_admit(waiter)
+                if wait == 0:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        self.total_wait_time += time.monotonic() - start
+
+    def release(self):
+        """ Mark an admitted request as done. """
+        with self._lock:
+            self.num_active -= 1
+            self._wake_head()
+
+    def pause(self, seconds: float):
+        """ Admit no request for some seconds, e.g. after the server answered 429. """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RateLimitedBackend(CompletionBackend):
+    """ Sends the requests of another backend through a rate limiter, retrying failed requests.
+
+    A request reserves its estimated prompt tokens plus its maximum reply
+    tokens from the token rate. Rate limits, server errors and connection
+    errors are retried with jittered exponential backoff, as long as no
+    chunk was streamed yet; a rate limit error also pauses every other
+    request for the backoff. Share one backend between agents to share
+    their limits.
+
+    Args:
+        backend (CompletionBackend, optional): The backend that sends the requests. Defaults to the default backend.
+        limiter (RateLimiter, optional): Defaults to a new limiter with the following limits.
+        requests_per_minute (float, optional): Defaults to None, i.e. no limit.
+        tokens_per_minute (float, optional): Defaults to None, i.e. no limit.
+        max_concurrency (int, optional): Defaults to 16.
+        max_retries (int, optional): The retries of a request before its error is raised. Defaults to 6.
+        initial_delay (float, optional): The longest delay of the first retry, in seconds. Defaults to 1.
+        max_delay (float, optional): The longest delay of a retry, in seconds. Defaults to 60.
+        default_max_tokens (int, optional): The reply tokens reserved when a request has no max_tokens. Defaults to 1024.
+        retryable (callable, optional): Decides whether an error is retried. Defaults to `is_retryable`.
+    """
+
+    def __init__(self, backend: Optional[CompletionBackend] = None,
+                 limiter: Optional[RateLimiter] = None,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 max_concurrency: Optional[int] = 16,
+                 max_retries: int = 6,
+                 initial_delay: float = 1.0,
+                 max_delay: float = 60.0,
+                 default_max_tokens: int = 1024,
+                 retryable: Callable[[BaseException], bool] = is_retryable):
+        self.backend = backend
+        self.limiter = limiter if limiter is not None else RateLimiter(
+            requests_per_minute, tokens_per_minute, max_concurrency)
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.default_max_tokens = default_max_tokens
+        self.retryable = retryable
+
+        self.num_requests = 0
+        self.num_retries = 0
+        self.num_failures = 0
+
+    def _backend(self) -> CompletionBackend:
+        return self.backend if self.backend is not None else get_default_backend()
+
+    def estimate_tokens(self, messages: List[dict], kwargs: dict) -> int:
+        """ Estimate the tokens a request counts against the token rate, about 4 characters a token. """
+        num_chars = len(json.dumps(messages, default=str))
+        for key in ('functions', 'tools'):
+            if kwargs.get(key):
+                num_chars += len(json.dumps(kwargs[key], default=str))
+        return num_chars // 4 + (kwargs.get('max_tokens') or self.default_max_tokens)
+
+    def _retry_delay(self, attempt: int, error: BaseException) -> Optional[float]:
+        """ Get the delay before retrying a failed request, or None to raise the error. """
+        if attempt >= self.max_retries or not self.retryable(error):
+            self.num_failures += 1
+            return None
+        self.num_retries += 1
+        delay = random.uniform(0, min(self.max_delay, self.initial_delay * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        if type(error).__name__ == 'RateLimitError' or getattr(error, 'http_status', None) == 429:
+            self.limiter.pause(delay)
+        return delay
+
+    def stream(self, engine, messages, **kwargs):
+        tokens = self.estimate_tokens(messages, kwargs)
+        for attempt in itertools.count():
+            self.limiter.acquire(tokens)
+            self.num_requests += 1
+            streamed = False
+            try:
+                for chunk in self._backend().stream(engine, messages, **kwargs):
+                    streamed = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if streamed else self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.limiter.release()
+            time.sleep(delay)
+
+    async def astream(self, engine, messages, **kwargs):
+        tokens = self.estimate_tokens(messages, kwargs)
+        for attempt in itertools.count():
+            await self.limiter.aacquire(tokens)
+            self.num_requests += 1
+            streamed = False
+            try:
+                async for chunk in self._backend().astream(engine, messages, **kwargs):
+                    streamed = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if streamed else self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.limiter.release()
+            await asyncio.sleep(delay)
@@ -0,0 +1,403 @@
+from typing import Callable, Iterable, List, Optional, Sequence, Set, Tuple
+import heapq
+import math
+import re
+import threading
+import zlib
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+DEFAULT_EMBEDDING_ENGINE = 'text-embedding-ada-002'
+RETRIEVED_MESSAGES_HEADER = 'Relevant memories from earlier in the conversation:'
+INDEXED_ROLES = {'user', 'assistant', 'function', 'tool'}
+
+
+class Embedder:
+    """ Turns texts into embedding vectors, many texts per call. """
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            vectors (list): One vector per text, in the same order.
+        """
+        raise NotImplementedError
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """ Async counterpart of `embed`. Defaults to calling `embed`. """
+        return self.embed(texts)
+
+
+class OpenAIEmbedder(Embedder):
+    """ Embed texts with the OpenAI embeddings API.
+
+    Args:
+        engine (str, optional): The embedding model. Defaults to 'text-embedding-ada-002'.
+        api_key (str, optional): The API key. Defaults to the `openai` module settings.
+        api_base (str, optional): The API base url. Defaults to the `openai` module settings.
+    """
+
+    def __init__(self, engine: str = DEFAULT_EMBEDDING_ENGINE,
+                 api_key: Optional[str] = None, api_base: Optional[str] = None):
+        self.engine = engine
+        self.api_key = api_key
+        self.api_base = api_base
+
+    def _request_kwargs(self, texts: List[str]):
+        request = dict(model=self.engine, input=texts)
+        if self.api_key is not None:
+            request['api_key'] = self.api_key
+        if self.api_base is not None:
+            request['api_base'] = self.api_base
+        return request
+
+    @staticmethod
+    def _vectors(resp) -> List[List[float]]:
+        return [item['embedding'] for item in sorted(resp['data'], key=lambda item: item['index'])]
+
+    def embed(self, texts):
+        import openai
+        return self._vectors(openai.Embedding.create(**self._request_kwargs(texts)))
+
+    async def aembed(self, texts):
+        import openai
+        return self._vectors(await openai.Embedding.acreate(**self._request_kwargs(texts)))
+
+
+class HashingEmbedder(Embedder):
+    """ An in-process bag-of-words embedder, for tests, benchmarks and offline runs.
+
+    Words are hashed into a fixed number of dimensions, so texts sharing words
+    are similar. It needs no model and no network.
+
+    Args:
+        dimensions (int, optional): The size of the vectors. Defaults to 256.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        self.num_requests = 0
+
+    def embed(self, texts):
+        self.num_requests += 1
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dimensions
+            for word in re.findall(r'\w+', text.lower()):
+                vector[zlib.crc32(word.encode('utf-8')) % self.dimensions] += 1.0
+            vectors.append(vector)
+        return vectors
+
+
+class VectorIndex:
+    """ Cosine similarity search over vectors numbered in the order they were added. """
+
+    def add(self, vectors: Sequence[Sequence[float]]):
+        """ Add vectors. They get the ids len(self), len(self) + 1, ... """
+        raise NotImplementedError
+
+    def search(self, vector: Sequence[float], k: int) -> List[Tuple[float, int]]:
+        """ Get the (similarity, id) of the k most similar vectors, most similar first. """
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+def _normalized(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+class PythonIndex(VectorIndex):
+    """ A brute force index in pure Python, used when NumPy is not installed. """
+
+    def __init__(self):
+        self._vectors = []
+
+    def add(self, vectors):
+        self._vectors.extend(_normalized(vector) for vector in vectors)
+        return self
+
+    def search(self, vector, k):
+        query = _normalized(vector)
+        scores = ((sum(a * b for a, b in zip(query, v)), idx) for idx, v in enumerate(self._vectors))
+        return heapq.nlargest(k, scores)
+
+    def __len__(self):
+        return len(self._vectors)
+
+
+class NumpyIndex(VectorIndex):
+    """ A brute force index of normalized float32 rows, searched with one matrix product.
+
+    The matrix grows geometrically, so adding vectors is amortized O(1).
+    """
+
+    def __init__(self):
+        assert numpy is not None, 'NumpyIndex requires numpy.'
+        self._matrix = None
+        self._size = 0
+
+    def add(self, vectors):
+        if len(vectors) == 0:
+            return self
+        rows = numpy.asarray(vectors, dtype=numpy.float32)
+        norms = numpy.linalg.norm(rows, axis=1, keepdims=True)
+        rows /= numpy.where(norms == 0, 1, norms)
+        if self._matrix is None:
+            self._matrix = numpy.empty((max(len(rows), 64), rows.shape[1]), dtype=numpy.float32)
+        elif self._size + len(rows) > len(self._matrix):
+            capacity = max(2 * len(self._matrix), self._size + len(rows))
+            matrix = numpy.empty((capacity, rows.shape[1]), dtype=numpy.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+        self._matrix[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+        return self
+
+    def search(self, vector, k):
+        if self._size == 0 or k <= 0:
+            return []
+        query = numpy.asarray(vector, dtype=numpy.float32)
+        norm = numpy.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = self._matrix[:self._size] @ query
+        if k < self._size:
+            top = numpy.argpartition(-scores, k - 1)[:k]
+        else:
+            top = numpy.arange(self._size)
+        top = top[numpy.argsort(-scores[top])]
+        return [(float(scores[idx]), int(idx)) for idx in top]
+
+    def __len__(self):
+        return self._size
+
+
+class PgVectorIndex(VectorIndex):
+    """ An index in a PostgreSQL table with the pgvector extension.
+
+    Vectors are sent as pgvector literals, so neither NumPy nor the pgvector
+    Python package is needed. The table belongs to a single memory and is
+    emptied when the index is created, unless `reset` is False.
+
+    Args:
+        connection: A psycopg2 connection.
+        dimensions (int): The size of the vectors.
+        table (str, optional): The table name. Defaults to 'botplayers_memory'.
+        reset (bool, optional): Whether to empty the table. Defaults to True.
+    """
+
+    def __init__(self, connection, dimensions: int, table: str = 'botplayers_memory',
+                 reset: bool = True):
+        assert re.fullmatch(r'\w+', table), f'Invalid table name {table}.'
+        self.connection = connection
+        self.dimensions = dimensions
+        self.table = table
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS vector')
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                           f'(id integer PRIMARY KEY, embedding vector({dimensions}))')
+            if reset:
+                cursor.execute(f'TRUNCATE {table}')
+            cursor.execute(f'SELECT count(*) FROM {table}')
+            self._size = cursor.fetchone()[0]
+        connection.commit()
+
+    @staticmethod
+    def _literal(vector: Sequence[float]) -> str:
+        return '[' + ','.join(repr(float(x)) for x in vector) + ']'
+
+    def add(self, vectors):
+        rows = [(self._size + idx, self._literal(vector)) for idx, vector in enumerate(vectors)]
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (id, embedding) VALUES (%s, %s::vector)', rows)
+        self.connection.commit()
+        self._size += len(rows)
+        return self
+
+    def search(self, vector, k):
+        literal = self._literal(vector)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT 1 - (embedding <=> %s::vector), id FROM {self.table} '
+                f'ORDER BY embedding <=> %s::vector LIMIT %s', (literal, literal, k))
+            return [(float(score), int(idx)) for score, idx in cursor.fetchall()]
+
+    def __len__(self):
+        return self._size
+
+
+def default_index() -> VectorIndex:
+    """ Get a NumpyIndex, or a PythonIndex when NumPy is not installed. """
+    return NumpyIndex() if numpy is not None else PythonIndex()
+
+
+class RetrievalMemory:
+    """ An embedding index of texts, to retrieve the ones relevant to a query.
+
+    Added texts are embedded lazily: the pending texts and the query are
+    embedded together in batched calls on the next search, so a turn costs
+    one embedding round trip however many messages it added.
+
+    An agent with a retrieval memory sends its recent messages, up to
+    `recent_tokens`, plus a system message with the earlier messages most
+    similar to the latest one, up to `max_tokens`. The prompt size stays
+    flat as the memory grows.
+
+    Args:
+        embedder (Embedder, optional): Embeds the texts. Defaults to an OpenAIEmbedder.
+        index (VectorIndex, optional): Stores the vectors. Defaults to a NumpyIndex, or a PythonIndex without NumPy.
+        top_k (int, optional): The maximum number of texts retrieved. Defaults to 5.
+        min_score (float, optional): The minimum cosine similarity of a retrieved text. Defaults to None.
+        max_tokens (int, optional): The maximum number of tokens of the retrieved texts. Defaults to 1024.
+        recent_tokens (int, optional): The token budget of the recent messages an agent sends. Defaults to 2048.
+        batch_size (int, optional): The maximum number of texts per embedding call. Defaults to 128.
+    """
+
+    def __init__(self, embedder: Optional[Embedder] = None,
+                 index: Optional[VectorIndex] = None,
+                 top_k: int = 5,
+                 min_score: Optional[float] = None,
+                 max_tokens: int = 1024,
+                 recent_tokens: int = 2048,
+                 batch_size: int = 128):
+        self.embedder = embedder if embedder is not None else OpenAIEmbedder()
+        self.index = index if index is not None else default_index()
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_tokens = max_tokens
+        self.recent_tokens = recent_tokens
+        self.batch_size = batch_size
+
+        self.texts: List[str] = []
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+
+    def add(self, text: str):
+        """ Add a text. It is embedded on the next search or flush. """
+        with self._lock:
+            self._pending.append(text)
+        return self
+
+    def add_messages(self, messages: Iterable[dict]):
+        """ Add the content of the user, assistant and function messages. """
+        for message in messages:
+            content = message.get('content')
+            if message.get('role') in INDEXED_ROLES and isinstance(content, str) and content.strip():
+                self.add(content)
+        return self
+
+    def __len__(self):
+        return len(self.texts) + len(self._pending)
+
+    def _take_pending(self) -> List[str]:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    def _index(self, texts: List[str], vectors: List[List[float]]):
+        with self._lock:
+            self.index.add(vectors)
+            self.texts.extend(texts)
+
+    def flush(self):
+        """ Embed and index the pending texts. """
+        pending = self._take_pending()
+        vectors = []
+        for batch in self._batches(pending):
+            vectors.extend(self.embedder.embed(batch))
+        self._index(pending, vectors)
+        return self
+
+    async def aflush(self):
+        """ Async counterpart of `flush`. """
+        pending = self._take_pending()
+        vectors = []
+        for batch in self._batches(pending):
+            vectors.extend(await self.embedder.aembed(batch))
+        self._index(pending, vectors)
+        return self
+
+    def _results(self, query_vector: List[float], k: Optional[int],
+                 exclude: Optional[Set[str]]) -> List[Tuple[float, str]]:
+        k = self.top_k if k is None else k
+        exclude = exclude or set()
+        with self._lock:
+            # Over-fetch by the number of excluded texts, which are usually the recent messages.
+            hits = self.index.search(query_vector, k + len(exclude)) if len(self.index) > 0 else []
+            results = []
+            for score, idx in hits:
+                if self.min_score is not None and score < self.min_score:
+                    break
+                text = self.texts[idx]
+                if text in exclude:
+                    continue
+                results.append((score, text))
+                if len(results) == k:
+                    break
+        return results
+
+    def search(self, query: str, k: Optional[int] = None,
+               exclude: Optional[Set[str]] = None) -> List[Tuple[float, str]]:
+        """
+        Get the texts most similar to a query.
+
+        Args:
+            query (str): The query.
+            k (int, optional): The maximum number of texts. Defaults to `top_k`.
+            exclude (set, optional): Texts not to return, e.g. the ones already in the context. Defaults to None.
+
+        Returns:
+            results (list): (similarity, text) pairs, most similar first.
+        """
+        pending = self._take_pending()
+        vectors = []
+        for batch in self._batches(pending + [query]):
+            vectors.extend(self.embedder.embed(batch))
+        self._index(pending, vectors[:-1])
+        return self._results(vectors[-1], k, exclude)
+
+    async def asearch(self, query: str, k: Optional[int] = None,
+                      exclude: Optional[Set[str]] = None) -> List[Tuple[float, str]]:
+        """ Async counterpart of `search`. """
+        pending = self._take_pending()
+        vectors = []
+        for batch in self._batches(pending + [query]):
+            vectors.extend(await self.embedder.aembed(batch))
+        self._index(pending, vectors[:-1])
+        return self._results(vectors[-1], k, exclude)
+
+    def context_message(self, results: List[Tuple[float, str]],
+                        count_tokens: Callable[[dict], int]) -> Optional[dict]:
+        """
+        Get a system message with the retrieved texts that fit into `max_tokens`, or None if there are none.
+
+        Args:
+            results (list): The results of `search`.
+            count_tokens (callable): Counts the tokens of a message.
+        """
+        lines = []
+        for _, text in results:
+            candidate = lines + [f'- {text}']
+            message = {'role': 'system', 'content': '\n'.join([RETRIEVED_MESSAGES_HEADER] + candidate)}
+            if count_tokens(message) > self.max_tokens:
+                break
+            lines = candidate
+        if not lines:
+            return None
+        return {'role': 'system', 'content': '\n'.join([RETRIEVED_MESSAGES_HEADER] + lines)}
@@ -0,0 +1,153 @@
+from typing import Awaitable, Callable, List, NamedTuple, Optional, Sequence
+import asyncio
+import re
+
+from .agent import Agent
+from .events import NullSink
+from .util import run_sync
+
+DEFAULT_SCREENING_QUESTION = 'Which of the following items are useful to answer the user\'s question?'
+SCREENING_INSTRUCTION = ('Answer only with the numbers of the useful items separated by commas, '
+                         'or "none" if no item is useful.')
+SUFFICIENCY_QUESTION = 'Do you have sufficient information to answer the user\'s question? Answer yes or no.'
+PENDING_RESULT = 'The result is not available yet.'
+
+SufficiencyCheck = Callable[[List[str]], Awaitable[bool]]
+
+
+class ScreeningResult(NamedTuple):
+    """ The outcome of screening candidates.
+
+    Attributes:
+        matches (list): The indices of the relevant candidates, in increasing order.
+        batches (int): The number of batches that were screened.
+        round_trips (int): The number of model calls, screening and sufficiency checks included.
+        stopped_early (bool): Whether screening stopped before every batch was screened.
+    """
+    matches: List[int]
+    batches: int
+    round_trips: int
+    stopped_early: bool
+
+
+def _screening_prompt(question: str, batch: Sequence[str]) -> str:
+    items = '\n'.join(f'[{idx + 1}] {candidate}' for idx, candidate in enumerate(batch))
+    return f'{question}\n{items}\n{SCREENING_INSTRUCTION}'
+
+
+def _parse_selection(content: Optional[str], batch_length: int) -> List[int]:
+    """ Get the 0-based indices of the items a screening reply selects. """
+    numbers = {int(number) for number in re.findall(r'\d+', content or '')}
+    return sorted(number - 1 for number in numbers if 1 <= number <= batch_length)
+
+
+def _pending_results(messages: List[dict]) -> List[dict]:
+    """ Get placeholder results for the function calls of the last message, if it is still waiting for them. """
+    if not messages:
+        return []
+    last = messages[-1]
+    if last.get('tool_calls'):
+        return [{'role': 'tool', 'tool_call_id': tool_call['id'], 'content': PENDING_RESULT}
+                for tool_call in last['tool_calls']]
+    if last.get('function_call'):
+        return [{'role': 'function', 'name': last['function_call']['name'], 'content': PENDING_RESULT}]
+    return []
+
+
+async def _ask(agent: Agent, content: str) -> str:
+    avatar = agent.derive_avatar(
+        interactive_objects=[], function_call_repeats=1, ignore_none_function_messages=False)
+    # Screening usually runs inside a function call of the agent, whose request must be answered
+    # before another message is sent.
+    avatar.memory.extend(_pending_results(agent.full_memory()))
+    # Concurrent avatars would interleave their streamed text.
+    avatar.event_sink = NullSink()
+    avatar.receive_message({'role': 'user', 'content': content}, print_output=False)
+    await avatar.athink_and_act()
+    return avatar.last_message().get('content') or ''
+
+
+def sufficiency_check(agent: Agent, question: str = SUFFICIENCY_QUESTION) -> SufficiencyCheck:
+    """
+    Get a check that asks an avatar of the agent whether the matches found so far are enough.
+
+    Args:
+        agent (Agent): The agent whose memory holds the task.
+        question (str, optional): The yes or no question. Defaults to asking about the user's question.
+    """
+    async def is_sufficient(matches: List[str]) -> bool:
+        info = '\n'.join(f'- {match}' for match in matches)
+        reply = await _ask(agent, f'Current info:\n{info}\n{question}')
+        return reply.strip().lower().startswith('y')
+    return is_sufficient
+
+
+async def ascreen(agent: Agent, candidates: Sequence[str],
+                  question: str = DEFAULT_SCREENING_QUESTION,
+                  batch_size: int = 20,
+                  max_concurrency: int = 4,
+                  max_matches: Optional[int] = None,
+                  is_sufficient: Optional[SufficiencyCheck] = None) -> ScreeningResult:
+    """
+    Find the relevant candidates with one model call per batch of candidates.
+
+    Each batch is shown to a new avatar of the agent, which answers with the
+    numbers of the relevant items. Batches are screened concurrently. Once
+    `max_matches` candidates matched, or `is_sufficient` accepts the matches,
+    the batches that have not started are skipped.
+
+    Args:
+        agent (Agent): The agent whose memory holds the task. Its memory is not modified.
+        candidates (list): The candidate texts.
+        question (str, optional): The question asked about each batch. Defaults to asking which items are useful.
+        batch_size (int, optional): The number of candidates per model call. Defaults to 20.
+        max_concurrency (int, optional): The maximum number of batches screened at the same time. Defaults to 4.
+        max_matches (int, optional): Stop once this many candidates matched. Defaults to None.
+        is_sufficient (callable, optional): An async check of the matched texts, called after every batch
+            with new matches, e.g. `sufficiency_check(agent)`. Defaults to None.
+    """
+    batches = [range(start, min(start + batch_size, len(candidates)))
+               for start in range(0, len(candidates), batch_size)]
+    semaphore = asyncio.Semaphore(max_concurrency)
+    matches: List[int] = []
+    counters = {'batches': 0, 'round_trips': 0}
+    done = asyncio.Event()
+    check_lock = asyncio.Lock()
+
+    async def screen_batch(batch: range):
+        async with semaphore:
+            if done.is_set():
+                return
+            counters['batches'] += 1
+            counters['round_trips'] += 1
+            reply = await _ask(agent, _screening_prompt(
+                question, [candidates[idx] for idx in batch]))
+            selected = [batch[idx] for idx in _parse_selection(reply, len(batch))]
+            if not selected or done.is_set():
+                return
+            matches.extend(selected)
+            if max_matches is not None and len(matches) >= max_matches:
+                done.set()
+            elif is_sufficient is not None:
+                async with check_lock:
+                    if done.is_set():
+                        return
+                    counters['round_trips'] += 1
+                    if await is_sufficient([candidates[idx] for idx in sorted(matches)]):
+                        done.set()
+
+    await asyncio.gather(*(screen_batch(batch) for batch in batches))
+    matches.sort()
+    if max_matches is not None:
+        matches = matches[:max_matches]
+    return ScreeningResult(
+        matches=matches,
+        batches=counters['batches'],
+        round_trips=counters['round_trips'],
+        stopped_early=counters['batches'] < len(batches),
+    )
+
+
+def screen(agent: Agent, candidates: Sequence[str], **kwargs) -> ScreeningResult:
+    """ Synchronous counterpart of `ascreen`. """
+    return run_sync(ascreen(agent, candidates, **kwargs))
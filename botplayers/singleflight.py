@@ -0,0 +1,224 @@
+from typing import Callable, Dict, List, Optional
+import asyncio
+import threading
+
+from .backends import CompletionBackend, get_default_backend
+from .cache import request_key
+
+
+class AbandonedRequestError(RuntimeError):
+    """ The caller that sent a shared request stopped reading it after other callers got some of its chunks. """
+
+
+class _Flight:
+    """ The chunks of an in-flight request, shared by the callers waiting for it. """
+
+    def __init__(self):
+        self.chunks: List[dict] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._wakes: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, wake: Callable[[], None]):
+        with self._lock:
+            self._wakes.append(wake)
+
+    def unsubscribe(self, wake: Callable[[], None]):
+        with self._lock:
+            self._wakes.remove(wake)
+
+    def _notify(self):
+        for wake in self._wakes:
+            wake()
+
+    def add(self, chunk: dict):
+        with self._lock:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self._lock:
+            self.done = True
+            self.error = error
+            self._notify()
+
+    def poll(self, start: int):
+        """ Get the chunks from `start`, and whether the flight is over. """
+        with self._lock:
+            return self.chunks[start:], self.done, self.error
+
+
+class SingleFlightBackend(CompletionBackend):
+    """ Coalesces identical requests in flight into one request to another backend.
+
+    The first caller of a request sends it; callers of an identical request
+    while it is in flight get its chunks as they arrive, or its error,
+    instead of sending their own. Sync and async callers, from any thread
+    or event loop, share the same flights.
+
+    If the sending caller stops reading the request before its end, e.g.
+    because it was cancelled, the waiting callers that got no chunk yet send
+    the request themselves. The ones that already got chunks raise an
+    AbandonedRequestError instead: a new request may not reproduce the chunks
+    they got, so they cannot take over; retry them as a whole.
+
+    Only deterministic requests (temperature 0) are coalesced, since sampled
+    requests are expected to differ, unless `force` is set. Wrap a rate
+    limited backend with this one, so coalesced calls do not count against
+    the limits.
+
+    Args:
+        backend (CompletionBackend, optional): The backend that sends the requests. Defaults to the default backend.
+        force (bool, optional): Whether to also coalesce sampled requests. Defaults to False.
+    """
+
+    def __init__(self, backend: Optional[CompletionBackend] = None, force: bool = False):
+        self.backend = backend
+        self.force = force
+
+        self.num_sent = 0
+        self.num_coalesced = 0
+        self.num_bypassed = 0
+        self._flights: Dict[str, _Flight] = dict()
+        self._lock = threading.Lock()
+
+    def _backend(self) -> CompletionBackend:
+        return self.backend if self.backend is not None else get_default_backend()
+
+    @property
+    def num_in_flight(self) -> int:
+        return len(self._flights)
+
+    def _join(self, engine: str, messages: List[dict], kwargs: dict):
+        """ Get the key and the flight of a request, None if it is not coalesced, and whether the caller sends it. """
+        if not self.force and kwargs.get('temperature', 1.0) != 0:
+            with self._lock:
+                self.num_bypassed += 1
+                self.num_sent += 1
+            return None, None, True
+        key = request_key(engine, messages, **kwargs)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.num_coalesced += 1
+                return key, flight, False
+            flight = self._flights[key] = _Flight()
+            self.num_sent += 1
+            return key, flight, True
+
+    def _land(self, key: str, flight: _Flight, error: Optional[BaseException] = None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def stream(self, engine, messages, **kwargs):
+        key, flight, leader = self._join(engine, messages, kwargs)
+        if flight is None:
+            yield from self._backend().stream(engine, messages, **kwargs)
+            return
+        if not leader:
+            num_replayed = 0
+            try:
+                for chunk in self._follow(flight):
+                    num_replayed += 1
+                    yield chunk
+                return
+            except AbandonedRequestError:
+                if num_replayed > 0:
+                    raise
+            # Nothing was replayed yet, so send the request after all.
+            yield from self._backend().stream(engine, messages, **kwargs)
+            return
+
+        try:
+            for chunk in self._backend().stream(engine, messages, **kwargs):
+                flight.add(chunk)
+                yield chunk
+        except Exception as e:
+            self._land(key, flight, e)
+            raise
+        except BaseException:
+            self._land(key, flight, AbandonedRequestError())
+            raise
+        self._land(key, flight)
+
+    def _follow(self, flight: _Flight):
+        event = threading.Event()
+        flight.subscribe(event.set)
+        try:
+            num_read = 0
+            while True:
+                event.clear()
+                chunks, done, error = flight.poll(num_read)
+                num_read += len(chunks)
+                yield from chunks
+                if done and not chunks:
+                    if error is not None:
+                        raise error
+                    return
+                if not chunks:
+                    event.wait()
+        finally:
+            flight.unsubscribe(event.set)
+
+    async def astream(self, engine, messages, **kwargs):
+        key, flight, leader = self._join(engine, messages, kwargs)
+        if flight is None:
+            async for chunk in self._backend().astream(engine, messages, **kwargs):
+                yield chunk
+            return
+        if not leader:
+            num_replayed = 0
+            try:
+                async for chunk in self._afollow(flight):
+                    num_replayed += 1
+                    yield chunk
+                return
+            except AbandonedRequestError:
+                if num_replayed > 0:
+                    raise
+            async for chunk in self._backend().astream(engine, messages, **kwargs):
+                yield chunk
+            return
+
+        try:
+            async for chunk in self._backend().astream(engine, messages, **kwargs):
+                flight.add(chunk)
+                yield chunk
+        except Exception as e:
+            self._land(key, flight, e)
+            raise
+        except BaseException:
+            self._land(key, flight, AbandonedRequestError())
+            raise
+        self._land(key, flight)
+
+    async def _afollow(self, flight: _Flight):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # The loop is closed.
+
+        flight.subscribe(wake)
+        try:
+            num_read = 0
+            while True:
+                event.clear()
+                chunks, done, error = flight.poll(num_read)
+                num_read += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if done and not chunks:
+                    if error is not None:
+                        raise error
+                    return
+                if not chunks:
+                    await event.wait()
+        finally:
+            flight.unsubscribe(wake)
@@ -0,0 +1,360 @@
+from typing import AsyncIterator, Callable, Iterator, List, NamedTuple, Optional, Union
+import time
+
+from .backends import CompletionBackend, get_default_backend
+from .cache import ResponseCache, request_key
+from .context import count_text_tokens
+from .metrics import BoundMetrics, Metrics, get_default_metrics
+from . import events
+from . import metrics as m
+
+ROLE = 'role'
+TEXT = 'text'
+FUNCTION_NAME = 'function_name'
+FUNCTION_ARGUMENTS = 'function_arguments'
+FINISH = 'finish'
+
+
+class StreamEvent(NamedTuple):
+    """ A typed delta of a streamed chat completion.
+
+    Attributes:
+        type (str): One of ROLE, TEXT, FUNCTION_NAME, FUNCTION_ARGUMENTS and FINISH.
+        text (str): The role, text token, function name or argument fragment.
+        index (int, optional): The index of the tool call a FUNCTION_* event belongs to, None for a legacy function call.
+        call_id (str, optional): The id of the tool call, when the delta carries it.
+        message (dict, optional): The complete message, set on the FINISH event.
+        finish_reason (str, optional): Why the model stopped, set on the FINISH event.
+    """
+    type: str
+    text: str = ''
+    index: Optional[int] = None
+    call_id: Optional[str] = None
+    message: Optional[dict] = None
+    finish_reason: Optional[str] = None
+
+
+class _ToolCallBuffer:
+    __slots__ = ('id', 'name', 'arguments')
+
+    def __init__(self):
+        self.id = ''
+        self.name = []
+        self.arguments = []
+
+
+class MessageAccumulator:
+    """ Turns streamed chunks into typed events and the complete message.
+
+    Fragments are collected in lists and joined once, instead of repeated
+    string concatenation.
+    """
+
+    def __init__(self):
+        self.role = ''
+        self.finish_reason = None
+        self._content = []
+        self._function_name = None
+        self._function_arguments = None
+        self._tool_calls = dict()
+
+    def feed(self, chunk: dict) -> List[StreamEvent]:
+        """ Consume a chunk and get the events it contains. """
+        events = []
+        for c in chunk['choices']:
+            delta = c['delta']
+            if c.get('finish_reason'):
+                self.finish_reason = c['finish_reason']
+
+            if 'role' in delta:
+                self.role = delta['role']
+                events.append(StreamEvent(ROLE, delta['role']))
+
+            if delta.get('function_call'):
+                if self._function_name is None:
+                    self._function_name, self._function_arguments = [], []
+                function_call = delta['function_call']
+                if function_call.get('name'):
+                    self._function_name.append(function_call['name'])
+                    events.append(StreamEvent(FUNCTION_NAME, function_call['name']))
+                if function_call.get('arguments'):
+                    self._function_arguments.append(function_call['arguments'])
+                    events.append(StreamEvent(FUNCTION_ARGUMENTS, function_call['arguments']))
+
+            for tool_call_delta in delta.get('tool_calls') or []:
+                idx = tool_call_delta['index']
+                tool_call = self._tool_calls.get(idx)
+                if tool_call is None:
+                    tool_call = self._tool_calls[idx] = _ToolCallBuffer()
+                call_id = tool_call_delta.get('id')
+                if call_id:
+                    tool_call.id = call_id
+                function = tool_call_delta.get('function') or {}
+                if function.get('name'):
+                    tool_call.name.append(function['name'])
+                    events.append(StreamEvent(
+                        FUNCTION_NAME, function['name'], idx, call_id))
+                if function.get('arguments'):
+                    tool_call.arguments.append(function['arguments'])
+                    events.append(StreamEvent(
+                        FUNCTION_ARGUMENTS, function['arguments'], idx, call_id))
+
+            if 'content' in delta:
+                content = delta['content']
+                if content is None or len(self._content) == 0 and content == '\n\n':
+                    continue
+                self._content.append(content)
+                events.append(StreamEvent(TEXT, content))
+        return events
+
+    def message(self) -> dict:
+        """ Get the complete message. """
+        message = dict()
+        message['role'] = self.role
+        message['content'] = ''.join(self._content)
+        if self._function_name is not None:
+            message['function_call'] = {
+                'name': ''.join(self._function_name),
+                'arguments': ''.join(self._function_arguments),
+            }
+        if self._tool_calls:
+            message['tool_calls'] = [{
+                'id': tool_call.id,
+                'type': 'function',
+                'function': {
+                    'name': ''.join(tool_call.name),
+                    'arguments': ''.join(tool_call.arguments),
+                },
+            } for _, tool_call in sorted(self._tool_calls.items())]
+        return message
+
+    def finish(self) -> StreamEvent:
+        """ Get the FINISH event with the complete message. """
+        return StreamEvent(FINISH, message=self.message(), finish_reason=self.finish_reason)
+
+
+def _replay_events(message: dict) -> List[StreamEvent]:
+    events = [StreamEvent(ROLE, message['role'])]
+    if message['content']:
+        events.append(StreamEvent(TEXT, message['content']))
+    if 'function_call' in message:
+        events.append(StreamEvent(FUNCTION_NAME, message['function_call']['name']))
+        events.append(StreamEvent(FUNCTION_ARGUMENTS, message['function_call']['arguments']))
+    for idx, tool_call in enumerate(message.get('tool_calls') or []):
+        events.append(StreamEvent(
+            FUNCTION_NAME, tool_call['function']['name'], idx, tool_call['id']))
+        events.append(StreamEvent(
+            FUNCTION_ARGUMENTS, tool_call['function']['arguments'], idx, tool_call['id']))
+    if message.get('tool_calls'):
+        finish_reason = 'tool_calls'
+    elif 'function_call' in message:
+        finish_reason = 'function_call'
+    else:
+        finish_reason = 'stop'
+    events.append(StreamEvent(FINISH, message=message, finish_reason=finish_reason))
+    return events
+
+
+def _lookup_cache(cache: Optional[ResponseCache], engine: str, messages: List[dict], kwargs: dict):
+    if cache is None or not cache.is_cacheable(**kwargs):
+        return None, None
+    key = request_key(engine, messages, **kwargs)
+    return key, cache.get(key)
+
+
+class _CompletionMeter:
+    """ Records the latency and size of a streamed completion. """
+
+    def __init__(self, metrics: Union[Metrics, BoundMetrics], engine: str):
+        self.metrics = metrics
+        self.engine = engine
+        self.start = time.perf_counter()
+        self.first_chunk = None
+        metrics.inc(m.COMPLETIONS)
+
+    def chunk(self):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter()
+            self.metrics.observe(m.COMPLETION_TTFT, self.first_chunk - self.start)
+
+    def finish(self, message: dict):
+        self.metrics.observe(m.COMPLETION_SECONDS, time.perf_counter() - self.start)
+        text = message['content']
+        if 'function_call' in message:
+            text += message['function_call']['name'] + message['function_call']['arguments']
+        for tool_call in message.get('tool_calls') or []:
+            text += tool_call['function']['name'] + tool_call['function']['arguments']
+        self.metrics.observe(m.COMPLETION_TOKENS, count_text_tokens(text, self.engine))
+
+    def error(self):
+        self.metrics.inc(m.COMPLETION_ERRORS)
+
+
+def iter_chat_completion(engine: str, messages: List[dict],
+                         cache: Optional[ResponseCache] = None,
+                         backend: Optional[CompletionBackend] = None,
+                         metrics: Union[Metrics, BoundMetrics, None] = None,
+                         **kwargs) -> Iterator[StreamEvent]:
+    """
+    Stream a chat completion as typed events, as soon as the deltas arrive.
+    The last event is a FINISH event carrying the complete message.
+
+    Args:
+        engine (str): The GPT engine to use.
+        messages (list): The messages of the request.
+        cache (ResponseCache, optional): A cache of responses to identical requests. Defaults to None.
+        backend (CompletionBackend, optional): Where the completion comes from. Defaults to the default backend.
+        metrics (Metrics, optional): Where the latency and size of the completion are recorded. Defaults to the default metrics.
+        kwargs: The other arguments of the request, e.g. functions and engine args.
+    """
+    if metrics is None:
+        metrics = get_default_metrics()
+    key, message = _lookup_cache(cache, engine, messages, kwargs)
+    if message is not None:
+        if metrics is not None:
+            metrics.inc(m.COMPLETION_CACHE_HITS)
+        yield from _replay_events(message)
+        return
+
+    if backend is None:
+        backend = get_default_backend()
+    meter = _CompletionMeter(metrics, engine) if metrics is not None else None
+    accumulator = MessageAccumulator()
+    try:
+        for chunk in backend.stream(engine, messages, **kwargs):
+            if meter is not None:
+                meter.chunk()
+            yield from accumulator.feed(chunk)
+    except Exception:
+        if meter is not None:
+            meter.error()
+        raise
+    finish = accumulator.finish()
+    if meter is not None:
+        meter.finish(finish.message)
+
+    if key is not None:
+        cache.put(key, finish.message)
+    yield finish
+
+
+async def aiter_chat_completion(engine: str, messages: List[dict],
+                                cache: Optional[ResponseCache] = None,
+                                backend: Optional[CompletionBackend] = None,
+                                metrics: Union[Metrics, BoundMetrics, None] = None,
+                                **kwargs) -> AsyncIterator[StreamEvent]:
+    """ Async counterpart of `iter_chat_completion`. """
+    if metrics is None:
+        metrics = get_default_metrics()
+    key, message = _lookup_cache(cache, engine, messages, kwargs)
+    if message is not None:
+        if metrics is not None:
+            metrics.inc(m.COMPLETION_CACHE_HITS)
+        for event in _replay_events(message):
+            yield event
+        return
+
+    if backend is None:
+        backend = get_default_backend()
+    meter = _CompletionMeter(metrics, engine) if metrics is not None else None
+    accumulator = MessageAccumulator()
+    try:
+        async for chunk in backend.astream(engine, messages, **kwargs):
+            if meter is not None:
+                meter.chunk()
+            for event in accumulator.feed(chunk):
+                yield event
+    except Exception:
+        if meter is not None:
+            meter.error()
+        raise
+    finish = accumulator.finish()
+    if meter is not None:
+        meter.finish(finish.message)
+
+    if key is not None:
+        cache.put(key, finish.message)
+    yield finish
+
+
+class _EventPrinter:
+    def __init__(self, sink: Optional[events.EventSink],
+                 on_event: Optional[Callable[[StreamEvent], None]], **fields):
+        self.sink = sink if sink is not None and sink.enabled else None
+        self.on_event = on_event
+        self.fields = fields
+        self.printed = False
+
+    def __call__(self, event: StreamEvent):
+        if self.on_event is not None:
+            self.on_event(event)
+        if self.sink is None:
+            return
+        if event.type == TEXT:
+            self.sink.emit(events.TEXT, text=event.text, **self.fields)
+            self.printed = True
+        elif event.type == FINISH and self.printed:
+            self.sink.emit(events.TEXT_END, **self.fields)
+
+
+def stream_event_handler(sink: Optional[events.EventSink],
+                         on_event: Optional[Callable[[StreamEvent], None]] = None,
+                         **fields) -> Optional[Callable[[StreamEvent], None]]:
+    """
+    Get a StreamEvent handler that emits the streamed text to a sink and forwards every event to `on_event`.
+    Returns None if there is nothing to do, so streaming costs nothing extra.
+
+    Args:
+        sink (EventSink, optional): Where the text goes, None or a disabled sink for no output.
+        on_event (callable, optional): Called with every event. Defaults to None.
+        fields: Added to the emitted events, e.g. agent.
+    """
+    if (sink is None or not sink.enabled) and on_event is None:
+        return None
+    return _EventPrinter(sink, on_event, **fields)
+
+
+def stream_chat_completion(engine: str, messages: List[dict], print_output: bool = True,
+                           cache: Optional[ResponseCache] = None,
+                           backend: Optional[CompletionBackend] = None,
+                           on_event: Optional[Callable[[StreamEvent], None]] = None,
+                           sink: Optional[events.EventSink] = None,
+                           metrics: Union[Metrics, BoundMetrics, None] = None, **kwargs):
+    """
+    Stream a chat completion and get the complete message.
+
+    Args:
+        engine (str): The GPT engine to use.
+        messages (list): The messages of the request.
+        print_output (bool, optional): Whether to emit the text to the sink as it arrives. Defaults to True.
+        cache (ResponseCache, optional): A cache of responses to identical requests. Defaults to None.
+        backend (CompletionBackend, optional): Where the completion comes from. Defaults to the default backend.
+        on_event (callable, optional): Called with every StreamEvent as it arrives. Defaults to None.
+        sink (EventSink, optional): Where the text goes. Defaults to the default sink.
+        metrics (Metrics, optional): Where the latency and size of the completion are recorded. Defaults to the default metrics.
+        kwargs: The other arguments of the request, e.g. functions and engine args.
+    """
+    if sink is None:
+        sink = events.get_default_sink()
+    handle = stream_event_handler(sink if print_output else None, on_event)
+    for event in iter_chat_completion(engine, messages, cache=cache, backend=backend, metrics=metrics, **kwargs):
+        if handle is not None:
+            handle(event)
+    return event.message
+
+
+async def astream_chat_completion(engine: str, messages: List[dict], print_output: bool = True,
+                                  cache: Optional[ResponseCache] = None,
+                                  backend: Optional[CompletionBackend] = None,
+                                  on_event: Optional[Callable[[StreamEvent], None]] = None,
+                                  sink: Optional[events.EventSink] = None,
+                                  metrics: Union[Metrics, BoundMetrics, None] = None, **kwargs):
+    """ Async counterpart of `stream_chat_completion`. """
+    if sink is None:
+        sink = events.get_default_sink()
+    handle = stream_event_handler(sink if print_output else None, on_event)
+    async for event in aiter_chat_completion(engine, messages, cache=cache, backend=backend,
+                                             metrics=metrics, **kwargs):
+        if handle is not None:
+            handle(event)
+    return event.message
@@ -1,3 +1,7 @@
+import asyncio
+import threading
+
+
 def colorize_text_in_terminal(text: str, color: str):
     """Colorize text in terminal.
 
@@ -46,4 +50,47 @@ def print_in_color(text: str, color: str, end='\n'):
     print(colorize_text_in_terminal(text, color), end=end)
 
 
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+
+def _get_background_loop():
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever, name='botplayers-event-loop', daemon=True)
+            thread.start()
+            _background_loop = loop
+    return _background_loop
+
+
+def run_sync(coroutine):
+    """Run a coroutine to completion from synchronous code.
 
+    The coroutine runs on a shared background event loop, so objects bound to
+    a loop (e.g. async clients) stay valid across calls, and this also works
+    when the calling thread already runs its own loop (e.g. Jupyter).
+
+    Args:
+        coroutine: The coroutine to run.
+
+    Returns:
+        result: The result of the coroutine.
+    """
+    loop = _get_background_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        coroutine.close()
+        raise RuntimeError(
+            'Cannot block on the botplayers event loop from inside it, await the coroutine instead.')
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
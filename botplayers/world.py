@@ -0,0 +1,182 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional
+import asyncio
+import time
+
+from .agent import Agent
+from .context import get_message_token_counter
+from .util import run_sync
+
+FAIR = 'fair'
+PRIORITY = 'priority'
+
+
+class RoundStats(NamedTuple):
+    """ What happened in one round of a World.
+
+    Attributes:
+        round (int): The number of the round, starting from 1.
+        eligible (int): The number of agents that had pending input.
+        ran (int): The number of agents that thought and acted.
+        deferred (int): The number of eligible agents left for a later round by the budgets.
+        errors (int): The number of agents that raised an exception.
+        prompt_tokens (int): The number of prompt tokens sent in the round.
+        duration (float): The wall-clock seconds of the round.
+        agents_per_second (float): The throughput of the round.
+    """
+    round: int
+    eligible: int
+    ran: int
+    deferred: int
+    errors: int
+    prompt_tokens: int
+    duration: float
+    agents_per_second: float
+
+
+def estimate_prompt_tokens(agent: Agent) -> int:
+    """ Estimate the prompt tokens of an agent's next turn: its last prompt, or its memory if it never thought. """
+    if agent.last_prompt_tokens:
+        return agent.last_prompt_tokens
+    return sum(agent.memory.full_token_counts(get_message_token_counter(agent.engine)))
+
+
+class World:
+    """ Runs the agents that have pending input, concurrently.
+
+    An agent is eligible when it received messages or has unread messages in
+    its inbox since it last thought. Eligible agents are started in the order
+    of the scheduling policy, at most `max_concurrency` at a time. Once a
+    round's token or time budget is used up no more agents are started; the
+    remaining ones stay eligible and go first in the next round.
+
+    An agent reserves its estimated prompt tokens (see `estimate_prompt_tokens`)
+    from the token budget when it starts, and the reservation is replaced by
+    the tokens it actually sent when it finishes. The budget can therefore be
+    exceeded by the estimation error of the agents running at the same time,
+    e.g. when function calls make an agent send several prompts in a turn.
+    Exceptions raised by agents are counted and kept in `last_errors`.
+
+    Args:
+        agents (list, optional): The agents of the world. Defaults to [].
+        max_concurrency (int, optional): The maximum number of agents thinking at the same time. Defaults to 8.
+        policy (str, optional): 'fair' starts the agents that ran the least first, 'priority' starts
+            the agents with the highest `Agent.priority` first. Defaults to 'fair'.
+        round_token_budget (int, optional): Stop starting agents once a round sent this many prompt tokens. Defaults to None.
+        round_time_budget (float, optional): Stop starting agents once a round ran for this many seconds. Defaults to None.
+    """
+
+    def __init__(self, agents: Iterable[Agent] = (), max_concurrency: int = 8,
+                 policy: str = FAIR,
+                 round_token_budget: Optional[int] = None,
+                 round_time_budget: Optional[float] = None):
+        assert policy in {FAIR, PRIORITY}, f'Unknown scheduling policy {policy}.'
+        self.agents: Dict[str, Agent] = dict()
+        self.max_concurrency = max_concurrency
+        self.policy = policy
+        self.round_token_budget = round_token_budget
+        self.round_time_budget = round_time_budget
+
+        self.rounds = 0
+        self.history: List[RoundStats] = []
+        self.last_errors: List[BaseException] = []
+        self._runs: Dict[str, int] = dict()
+        self._last_run: Dict[str, int] = dict()
+        for agent in agents:
+            self.add_agent(agent)
+
+    def add_agent(self, agent: Agent):
+        """ Add an agent to the world. """
+        assert agent.name not in self.agents, f'Agent {agent.name} already exists.'
+        self.agents[agent.name] = agent
+        self._runs.setdefault(agent.name, 0)
+        self._last_run.setdefault(agent.name, 0)
+        return self
+
+    def remove_agent(self, agent_name: str):
+        """ Remove an agent from the world. """
+        self.agents.pop(agent_name)
+        return self
+
+    def eligible_agents(self) -> List[Agent]:
+        """ Get the agents with pending input, in the order they would be started. """
+        eligible = [agent for agent in self.agents.values() if agent.has_pending_input()]
+
+        def fairness(agent: Agent):
+            return self._runs[agent.name], self._last_run[agent.name]
+        if self.policy == PRIORITY:
+            eligible.sort(key=lambda agent: (-agent.priority, fairness(agent)))
+        else:
+            eligible.sort(key=fairness)
+        return eligible
+
+    async def run_round(self) -> RoundStats:
+        """ Let every eligible agent think and act once, within the round's budgets. """
+        self.rounds += 1
+        round_number = self.rounds
+        eligible = self.eligible_agents()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        start = time.perf_counter()
+        counters = {'ran': 0, 'deferred': 0, 'errors': 0, 'prompt_tokens': 0, 'reserved_tokens': 0}
+
+        def budget_exhausted():
+            if self.round_token_budget is not None and \
+                    counters['prompt_tokens'] + counters['reserved_tokens'] >= self.round_token_budget:
+                return True
+            if self.round_time_budget is not None and \
+                    time.perf_counter() - start >= self.round_time_budget:
+                return True
+            return False
+
+        async def run(agent: Agent):
+            async with semaphore:
+                if budget_exhausted():
+                    counters['deferred'] += 1
+                    return
+                counters['ran'] += 1
+                self._runs[agent.name] += 1
+                self._last_run[agent.name] = round_number
+                reserved = estimate_prompt_tokens(agent) if self.round_token_budget is not None else 0
+                counters['reserved_tokens'] += reserved
+                prompt_tokens = agent.total_prompt_tokens
+                try:
+                    await agent.athink_and_act()
+                except Exception:
+                    counters['errors'] += 1
+                    raise
+                finally:
+                    counters['reserved_tokens'] -= reserved
+                    counters['prompt_tokens'] += agent.total_prompt_tokens - prompt_tokens
+
+        results = await asyncio.gather(*(run(agent) for agent in eligible), return_exceptions=True)
+        duration = time.perf_counter() - start
+        stats = RoundStats(
+            round=round_number,
+            eligible=len(eligible),
+            ran=counters['ran'],
+            deferred=counters['deferred'],
+            errors=counters['errors'],
+            prompt_tokens=counters['prompt_tokens'],
+            duration=duration,
+            agents_per_second=counters['ran'] / duration if duration > 0 else 0.0,
+        )
+        self.history.append(stats)
+        self.last_errors = [result for result in results if isinstance(result, BaseException)]
+        return stats
+
+    def run_round_sync(self) -> RoundStats:
+        """ Synchronous counterpart of `run_round`. """
+        return run_sync(self.run_round())
+
+    async def run(self, max_rounds: Optional[int] = None) -> List[RoundStats]:
+        """
+        Run rounds until no agent has pending input.
+
+        Args:
+            max_rounds (int, optional): The maximum number of rounds. Defaults to None, i.e. no limit.
+        """
+        stats = []
+        while max_rounds is None or len(stats) < max_rounds:
+            if not any(agent.has_pending_input() for agent in self.agents.values()):
+                break
+            stats.append(await self.run_round())
+        return stats
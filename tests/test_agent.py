@@ -0,0 +1,237 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from botplayers import Agent, InteractiveSpace, MockBackend, NullSink, agent_callable
+
+
+class Calculator(InteractiveSpace):
+    def __init__(self):
+        self.calls = []
+
+    @agent_callable
+    def add(self, a: int, b: int):
+        """Add two numbers.
+
+        Args:
+            a: the first number.
+            b: the second number.
+        """
+        self.calls.append(('add', a, b))
+        return a + b
+
+    @agent_callable
+    async def wait(self, seconds: float, label: str):
+        """Wait and return the label.
+
+        Args:
+            seconds: how long to wait.
+            label: what to return.
+        """
+        await asyncio.sleep(seconds)
+        return label
+
+    @agent_callable
+    def sleep(self, seconds: float):
+        """Sleep.
+
+        Args:
+            seconds: how long to sleep.
+        """
+        time.sleep(seconds)
+        return 'woke up'
+
+
+class ThreadBoundCalculator(Calculator):
+    thread_bound = True
+
+    def __init__(self):
+        super().__init__()
+        self.agent = None
+
+    @agent_callable
+    def thread(self):
+        """Get the thread of the call."""
+        return threading.get_ident()
+
+    @agent_callable
+    def consult(self):
+        """Ask an avatar, which calls this space too."""
+        avatar = self.agent.derive_avatar()
+        avatar.receive_message({'role': 'user', 'content': 'Add 1 and 2.'}, print_output=False)
+        avatar.think_and_act()
+        return avatar.full_memory()[-1]['content']
+
+
+def make_agent(responses, space=None, **kwargs):
+    backend = MockBackend(responses)
+    space = space if space is not None else Calculator()
+    agent = Agent('tester', 'You are a tester.', interactive_objects=[space],
+                  backend=backend, event_sink=NullSink(), ignore_none_function_messages=False, **kwargs)
+    return agent, backend
+
+
+def test_function_call_round_trip():
+    agent, backend = make_agent([
+        {'function_call': {'name': 'add', 'arguments': {'a': 2, 'b': 3}}},
+        'The sum is 5.',
+    ])
+    agent.receive_message({'role': 'user', 'content': 'What is 2 + 3?'}, print_output=False)
+    agent.think_and_act()
+
+    roles = [message['role'] for message in agent.full_memory()]
+    assert roles == ['system', 'user', 'assistant', 'function', 'assistant']
+    assert agent.full_memory()[2]['function_call']['name'] == 'add'
+    assert agent.full_memory()[3] == {'role': 'function', 'name': 'add', 'content': '5'}
+    assert agent.last_message()['content'] == 'The sum is 5.'
+    # The second request sent the function result back to the model.
+    assert backend.num_requests == 2
+    assert backend.requests[1]['messages'][-1]['content'] == '5'
+    assert 'functions' in backend.requests[0]['kwargs']
+
+
+def test_parallel_tool_calls_keep_request_order():
+    agent, backend = make_agent([
+        {'tool_calls': [
+            {'id': 'slow', 'name': 'wait', 'arguments': {'seconds': 0.2, 'label': 'first'}},
+            {'id': 'fast', 'name': 'wait', 'arguments': {'seconds': 0.0, 'label': 'second'}},
+            {'id': 'add', 'name': 'add', 'arguments': {'a': 1, 'b': 1}},
+        ]},
+        'done',
+    ], parallel_function_calls=True)
+    agent.receive_message({'role': 'user', 'content': 'go'}, print_output=False)
+    start = time.perf_counter()
+    asyncio.run(agent.athink_and_act())
+    elapsed = time.perf_counter() - start
+
+    results = [message for message in agent.full_memory() if message['role'] == 'tool']
+    assert [message['tool_call_id'] for message in results] == ['slow', 'fast', 'add']
+    assert [json.loads(message['content']) for message in results] == ['first', 'second', 2]
+    assert elapsed < 0.4  # The calls ran concurrently.
+    assert 'tools' in backend.requests[0]['kwargs']
+
+
+def test_function_call_timeout_is_reported_as_an_error():
+    agent, _ = make_agent([
+        {'function_call': {'name': 'sleep', 'arguments': {'seconds': 1.0}}},
+        'ok',
+    ], function_call_timeout=0.1)
+    agent.receive_message({'role': 'user', 'content': 'sleep'}, print_output=False)
+    agent.think_and_act()
+
+    result = json.loads(agent.full_memory()[3]['content'])
+    assert 'timed out' in result['error']
+
+
+def test_unknown_function_is_reported_as_an_error():
+    agent, _ = make_agent([{'function_call': {'name': 'nope', 'arguments': {}}}, 'ok'])
+    agent.think_and_act()
+    assert 'error' in json.loads(agent.full_memory()[2]['content'])
+
+
+def test_avatar_inherits_memory_without_writing_back():
+    agent, backend = make_agent(['parent reply', 'avatar reply'])
+    agent.receive_message({'role': 'user', 'content': 'hello'}, print_output=False)
+    agent.think_and_act()
+    parent_memory = list(agent.full_memory())
+
+    avatar = agent.derive_avatar()
+    assert avatar.full_memory() == parent_memory
+    avatar.receive_message({'role': 'user', 'content': 'side question'}, print_output=False)
+    avatar.think_and_act()
+
+    assert agent.full_memory() == parent_memory
+    assert avatar.full_memory()[:len(parent_memory)] == parent_memory
+    assert [m['content'] for m in avatar.full_memory()[len(parent_memory):]] == \
+        ['side question', 'avatar reply']
+    # The avatar's request carried the inherited memory.
+    assert backend.requests[1]['messages'][:len(parent_memory)] == parent_memory
+    # Messages the parent receives later are visible to the avatar, before its own.
+    agent.receive_message({'role': 'user', 'content': 'later'}, print_output=False)
+    assert avatar.full_memory()[len(parent_memory)]['content'] == 'later'
+
+
+def test_retrieved_messages_fit_into_the_budget():
+    from botplayers import HashingEmbedder, RetrievalMemory
+    retrieval_memory = RetrievalMemory(HashingEmbedder(), max_tokens=100, recent_tokens=10000)
+    agent, backend = make_agent(['ok'] * 20, max_context_tokens=1400, reply_token_reserve=1000,
+                                retrieval_memory=retrieval_memory)
+    for i in range(20):
+        agent.receive_message({'role': 'user', 'content': f'fact {i}: apples are red and pears are green'},
+                              print_output=False)
+        agent.think_and_act()
+    assert backend.requests[-1]['messages'][1]['content'].startswith('Relevant memories')
+    assert agent.last_prompt_tokens <= 1400 - 1000
+
+
+def test_parallel_sync_calls_to_one_space_run_concurrently():
+    agent, _ = make_agent([
+        {'tool_calls': [{'id': str(idx), 'name': 'sleep', 'arguments': {'seconds': 0.3}} for idx in range(4)]},
+        'done',
+    ], parallel_function_calls=True)
+    agent.receive_message({'role': 'user', 'content': 'go'}, print_output=False)
+    start = time.perf_counter()
+    agent.think_and_act()
+    assert time.perf_counter() - start < 0.9
+    assert [message['content'] for message in agent.full_memory() if message['role'] == 'tool'] == \
+        ['"woke up"'] * 4
+
+
+def run_with_deadline(function, seconds=10):
+    thread = threading.Thread(target=function, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), 'The call hangs.'
+
+
+@pytest.mark.parametrize('thread_bound', [False, True])
+def test_avatar_calls_the_space_from_inside_a_call(thread_bound):
+    space = ThreadBoundCalculator()
+    space.thread_bound = thread_bound
+    agent, _ = make_agent([
+        {'function_call': {'name': 'consult', 'arguments': {}}},
+        {'function_call': {'name': 'add', 'arguments': {'a': 1, 'b': 2}}},
+        'The sum is 3.',
+        'done',
+    ], space=space)
+    space.agent = agent
+    agent.receive_message({'role': 'user', 'content': 'Consult an avatar.'}, print_output=False)
+    run_with_deadline(agent.think_and_act)
+
+    assert agent.full_memory()[3] == {'role': 'function', 'name': 'consult', 'content': '"The sum is 3."'}
+    assert space.calls == [('add', 1, 2)]
+
+
+@pytest.mark.parametrize('thread_bound', [False, True])
+def test_space_takes_calls_after_a_timeout(thread_bound):
+    space = ThreadBoundCalculator()
+    space.thread_bound = thread_bound
+    agent, _ = make_agent([
+        {'function_call': {'name': 'sleep', 'arguments': {'seconds': 1.0}}},
+        {'function_call': {'name': 'add', 'arguments': {'a': 1, 'b': 1}}},
+        'done',
+    ], space=space, function_call_repeats=3, function_call_timeout=0.2)
+    agent.receive_message({'role': 'user', 'content': 'go'}, print_output=False)
+    start = time.perf_counter()
+    run_with_deadline(agent.think_and_act)
+
+    results = [message['content'] for message in agent.full_memory() if message['role'] == 'function']
+    assert 'timed out' in results[0]
+    assert results[1] == '2'
+    assert time.perf_counter() - start < 0.8
+
+
+def test_thread_bound_space_runs_sync_calls_on_its_thread():
+    agent, _ = make_agent([
+        {'function_call': {'name': 'thread', 'arguments': {}}},
+        {'function_call': {'name': 'thread', 'arguments': {}}},
+        'done',
+    ], space=ThreadBoundCalculator(), function_call_repeats=2)
+    agent.receive_message({'role': 'user', 'content': 'go'}, print_output=False)
+    agent.think_and_act()
+
+    results = [message['content'] for message in agent.full_memory() if message['role'] == 'function']
+    assert results[0] == results[1] != str(threading.get_ident())
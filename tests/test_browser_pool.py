@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('playwright.async_api')
+
+from app.browser_pool import BrowserPool  # noqa: E402
+from benchmarks.cases import fixture_server  # noqa: E402
+from botplayers.util import run_sync  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    with fixture_server() as url:
+        yield url
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**kwargs):
+        pools.append(BrowserPool(**kwargs))
+        return pools[-1]
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_each_key_keeps_its_page(make_pool, base_url):
+    pool = make_pool(max_pages=4, max_concurrency=2)
+
+    async def main():
+        for key in ('a', 'b'):
+            async with pool.page(key) as page:
+                await page.goto(f'{base_url}/page/{key}1')
+                await page.goto(f'{base_url}/page/{key}2')
+                await page.evaluate(f"() => {{ document.cookie = 'owner={key}'; }}")
+        for key in ('a', 'b'):
+            async with pool.page(key) as page:
+                assert page.url.endswith(f'/page/{key}2')
+                assert await page.evaluate('() => document.cookie') == f'owner={key}'
+                await page.go_back()
+                assert page.url.endswith(f'/page/{key}1')
+    run_sync(main())
+    assert pool.num_pages == 2 and pool.num_pages_opened == 2
+
+
+def test_at_most_max_concurrency_pages_are_used(make_pool, base_url):
+    pool = make_pool(max_pages=4, max_concurrency=2)
+    active = {'now': 0, 'max': 0}
+
+    async def use(key):
+        async with pool.page(key) as page:
+            active['now'] += 1
+            active['max'] = max(active['max'], active['now'])
+            await page.goto(f'{base_url}/page/{key}')
+            await asyncio.sleep(0.05)
+            active['now'] -= 1
+
+    async def main():
+        await asyncio.gather(*(use(idx % 4) for idx in range(8)))
+    run_sync(main())
+    assert active['max'] == 2
+
+
+def test_idle_and_least_recently_used_pages_are_evicted(make_pool):
+    pool = make_pool(max_pages=2, max_concurrency=1, idle_timeout=0.1)
+
+    async def use(key):
+        async with pool.page(key):
+            pass
+
+    async def main():
+        await use('a')
+        await use('b')
+        await use('a')
+        # The least recently used page makes room for a new one.
+        await use('c')
+        assert pool.has_page('a') and not pool.has_page('b') and pool.has_page('c')
+        await asyncio.sleep(0.2)
+        # Idle pages are only closed lazily, e.g. by evict_idle.
+        assert pool.num_pages == 2
+        await pool.evict_idle()
+        assert pool.num_pages == 0
+        # Or when a key opens a new page.
+        await use('a')
+        await asyncio.sleep(0.2)
+        await use('b')
+        assert not pool.has_page('a') and pool.has_page('b')
+    run_sync(main())
+
+
+def test_explorers_share_one_browser(make_pool, base_url):
+    pytest.importorskip('tiktoken')
+    from app.explorer import Explorer
+    pool = make_pool(max_pages=4, max_concurrency=2)
+    explorers = [Explorer(pool) for _ in range(3)]
+
+    async def main():
+        await asyncio.gather(*(explorer.browse_webpage(f'{base_url}/page/{idx}')
+                               for idx, explorer in enumerate(explorers)))
+    run_sync(main())
+    assert pool.num_launches == 1
+    assert pool.num_pages == 3
@@ -0,0 +1,53 @@
+from botplayers import MessageBus
+
+
+def test_topic_messages_reach_subscribers_but_not_the_sender():
+    bus = MessageBus()
+    bus.subscribe('alice', 'room').subscribe('bob', 'room')
+    bus.publish('room', 'alice', 'hi from alice')
+    bus.publish('room', None, 'hi from the host')
+
+    assert not bus.has_pending('nobody')
+    assert bus.drain('bob') == ['hi from alice', 'hi from the host']
+    assert bus.drain('alice') == ['hi from the host']
+    assert not bus.has_pending('alice') and not bus.has_pending('bob')
+
+
+def test_own_messages_are_not_pending():
+    bus = MessageBus()
+    bus.subscribe('alice', 'room').subscribe('bob', 'room')
+    bus.publish('room', 'bob', 'from bob')
+    bus.publish('room', 'alice', 'from alice')
+    assert bus.drain('alice') == ['from bob']
+    # Alice was behind when she published, her own message is still not pending.
+    bus.publish('room', 'bob', 'again')
+    bus.drain('alice')
+    bus.publish('room', 'bob', 'more')
+    bus.publish('room', 'alice', 'mine')
+    bus.drain('alice')
+    bus.publish('room', 'alice', 'only mine')
+    assert not bus.has_pending('alice')
+    assert bus.drain('alice') == []
+
+
+def test_dropped_count_skips_own_messages():
+    bus = MessageBus(max_inbox=3)
+    bus.subscribe('alice', 'room').subscribe('bob', 'room')
+    bus.publish('room', 'bob', 'b0')
+    for idx in range(20):
+        bus.publish('room', 'alice', f'a{idx}')
+    for idx in range(1, 3):
+        bus.publish('room', 'bob', f'b{idx}')
+
+    # Alice is behind (b0 unread), so her own messages pile up unread and get trimmed.
+    contents = bus.drain('alice')
+    assert contents == ['[1 earlier messages were dropped]', 'b1', 'b2']
+
+
+def test_direct_messages_are_bounded():
+    bus = MessageBus(max_inbox=2)
+    for idx in range(5):
+        bus.send('bob', 'alice', f'm{idx}')
+    assert bus.has_pending('bob')
+    assert bus.drain('bob') == ['[3 earlier messages were dropped]', 'm3', 'm4']
+    assert not bus.has_pending('bob')
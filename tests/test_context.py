@@ -0,0 +1,124 @@
+import random
+
+from botplayers import Agent, MockBackend, NullSink
+from botplayers.context import DropFunctionResultsPolicy, SlidingWindowPolicy, get_message_token_counter
+
+
+def count_tokens(message):
+    return 4 + len(message.get('content') or '') // 4
+
+
+def make_messages(num_turns, seed=0):
+    rng = random.Random(seed)
+    messages = [{'role': 'system', 'content': 'You are a test.'}]
+    for turn in range(num_turns):
+        messages.append({'role': 'user', 'content': f'question {turn} ' + 'x' * rng.randint(0, 80)})
+        if rng.random() < 0.5:
+            messages.append({'role': 'assistant', 'content': None,
+                             'function_call': {'name': 'f', 'arguments': '{}'}})
+            messages.append({'role': 'function', 'name': 'f', 'content': 'y' * rng.randint(0, 200)})
+        messages.append({'role': 'assistant', 'content': 'answer ' + 'z' * rng.randint(0, 80)})
+    return messages
+
+
+def select(policy, messages, budget):
+    return policy.select(messages, [count_tokens(m) for m in messages], budget, count_tokens)
+
+
+def assert_calls_kept(selected):
+    for idx, message in enumerate(selected):
+        if message['role'] in {'function', 'tool'}:
+            assert idx > 0
+            previous = selected[idx - 1]
+            assert previous['role'] in {'function', 'tool'} or \
+                previous.get('function_call') or previous.get('tool_calls')
+
+
+def test_budget_respected_and_system_prompt_pinned():
+    for policy in (SlidingWindowPolicy(), DropFunctionResultsPolicy()):
+        messages = make_messages(40)
+        selected, num_tokens = select(policy, messages, 300)
+        assert num_tokens <= 300
+        assert num_tokens == sum(count_tokens(m) for m in selected)
+        assert selected[0] is messages[0]
+        assert selected[-1] is messages[-1]
+        assert_calls_kept(selected)
+
+
+def test_function_call_kept_with_its_result():
+    messages = [
+        {'role': 'system', 'content': 'prompt'},
+        {'role': 'user', 'content': 'u' * 400},
+        {'role': 'assistant', 'content': None, 'tool_calls': [
+            {'id': 'a', 'type': 'function', 'function': {'name': 'f', 'arguments': '{}'}},
+            {'id': 'b', 'type': 'function', 'function': {'name': 'f', 'arguments': '{}'}}]},
+        {'role': 'tool', 'tool_call_id': 'a', 'content': 'r' * 400},
+        {'role': 'tool', 'tool_call_id': 'b', 'content': 'r' * 400},
+    ]
+    # Even when the newest results alone exceed the budget.
+    selected, _ = select(SlidingWindowPolicy(), messages, 50)
+    assert [m['role'] for m in selected] == ['system', 'assistant', 'tool', 'tool']
+    assert_calls_kept(selected)
+
+
+def test_incremental_selection_matches_a_fresh_policy():
+    policy = SlidingWindowPolicy()
+    full = make_messages(60, seed=1)
+    for end in range(1, len(full) + 1):
+        selected, num_tokens = select(policy, full[:end], 400)
+        assert (selected, num_tokens) == select(SlidingWindowPolicy(), full[:end], 400)
+        assert_calls_kept(selected)
+
+
+def test_incremental_drop_function_results_bookkeeping():
+    policy = DropFunctionResultsPolicy()
+    full = make_messages(60, seed=1)
+    messages = []
+    for message in full:
+        messages.append(message)
+        selected, num_tokens = select(policy, messages, 400)
+        assert num_tokens == sum(count_tokens(m) for m in selected)
+        assert num_tokens <= 400
+        assert selected[0] is full[0]
+        # A suffix of the memory, some of whose function results are replaced by the placeholder.
+        suffix = messages[len(messages) - len(selected) + 1:]
+        for sent, original in zip(selected[1:], suffix):
+            assert sent is original or (
+                original['role'] == 'function' and sent == dict(original, content=policy.placeholder))
+        assert selected[-1] is messages[-1] or messages[-1]['role'] == 'function'
+        assert_calls_kept(selected)
+
+
+def context_of(agent):
+    count_tokens = get_message_token_counter(agent.engine)
+    return agent.full_memory(), agent.memory.full_token_counts(count_tokens), count_tokens
+
+
+def test_incremental_state_after_deriving_an_avatar():
+    agent = Agent('a', 'prompt', backend=MockBackend(), event_sink=NullSink(),
+                  context_policy=DropFunctionResultsPolicy(), max_context_tokens=1600,
+                  reply_token_reserve=1000)
+    full = make_messages(30, seed=2)
+    for message in full[1:20]:
+        agent.memory.append(message)
+    agent._context_messages()
+    budget = agent.context_policy._budget
+    parent_replay = DropFunctionResultsPolicy()
+    parent_replay.select(*context_of(agent)[:2], budget, context_of(agent)[2])
+
+    avatar = agent.derive_avatar()
+    assert avatar.context_policy is not agent.context_policy
+    for message in full[20:40]:
+        avatar.memory.append(message)
+    for message in full[40:]:
+        agent.memory.append(message)
+
+    for who, replay in ((avatar, DropFunctionResultsPolicy()), (agent, parent_replay)):
+        selected = who._context_messages()
+        messages, token_counts, count_tokens = context_of(who)
+        expected, _ = replay.select(messages, token_counts, budget, count_tokens)
+        assert selected == expected
+        assert selected[0] == {'role': 'system', 'content': 'prompt'}
+        assert_calls_kept(selected)
+    assert avatar.full_memory()[:20] == agent.full_memory()[:20]
+    assert agent.full_memory()[20:] == full[40:]
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip('playwright.async_api')
+pytest.importorskip('tiktoken')
+
+from app.browser_pool import BrowserPool  # noqa: E402
+from app.explorer import CACHED_SNAPSHOT_NOTE, Explorer  # noqa: E402
+from benchmarks.cases import fixture_server  # noqa: E402
+from botplayers.util import run_sync  # noqa: E402
+
+DIFF_HEADERS = ('[Changes since the last snapshot', '[The webpage did not change')
+
+
+def is_diff(response):
+    return any(header in response['a11y_snapshot'] for header in DIFF_HEADERS)
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    with fixture_server() as url:
+        yield url
+
+
+@pytest.fixture
+def explorer():
+    pool = BrowserPool(max_pages=2, max_concurrency=1)
+    yield Explorer(pool, diff_snapshots=True)
+    pool.close()
+
+
+def test_navigation_shows_full_snapshots(explorer, base_url):
+    assert not is_diff(run_sync(explorer.browse_webpage(f'{base_url}/page/1')))
+    assert not is_diff(run_sync(explorer.browse_webpage(f'{base_url}/page/2')))
+    # The snapshot of the first page is cached, but the agent has not seen it since.
+    response = run_sync(explorer.browse_webpage(f'{base_url}/page/1'))
+    assert not is_diff(response)
+    assert '/page/1' in explorer.last_result
+
+
+def test_refresh_shows_a_diff(explorer, base_url):
+    run_sync(explorer.browse_webpage(f'{base_url}/page/1'))
+    assert is_diff(run_sync(explorer.refresh_snapshot()))
+    assert is_diff(run_sync(explorer.refresh_snapshot()))
+
+
+def test_going_back_labels_the_cached_snapshot(explorer, base_url):
+    run_sync(explorer.browse_webpage(f'{base_url}/page/1'))
+    run_sync(explorer.browse_webpage(f'{base_url}/page/2'))
+    run_sync(explorer.backward_webpage())
+    assert explorer.last_result.startswith(CACHED_SNAPSHOT_NOTE)
+    assert '/page/1' in explorer.last_result
+    # Refreshing compares the current page to the cached snapshot that was shown.
+    assert is_diff(run_sync(explorer.refresh_snapshot()))
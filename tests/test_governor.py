@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from botplayers import Agent, ArtifactStore, MockBackend, NullSink, ResultGovernor
+from botplayers import governor as governor_module
+
+
+class DenseEncoding:
+    """ One token per character, like CJK text or base64. """
+
+    def encode(self, text, **kwargs):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens):
+        return ''.join(chr(token) for token in tokens)
+
+
+@pytest.fixture
+def dense_tokens(monkeypatch):
+    monkeypatch.setattr(governor_module, '_get_encoding', lambda engine: DenseEncoding())
+
+
+def test_dense_results_are_paged_on_token_boundaries(dense_tokens):
+    governor = ResultGovernor(max_tokens=100, page_tokens=40)
+    result = '漢字' * 150
+    spilled = json.loads(governor.content(result))
+
+    text = json.dumps(result, ensure_ascii=False)
+    assert spilled['tokens'] == len(text)
+    assert spilled['pages'] == -(-len(text) // 40)
+    assert spilled['preview'] == text[:40]
+
+    pages = [governor.read_artifact(spilled['artifact'], page)
+             for page in range(1, spilled['pages'] + 1)]
+    assert all(len(page['content']) <= 40 for page in pages)
+    assert ''.join(page['content'] for page in pages) == text
+    assert 'error' in governor.read_artifact(spilled['artifact'], spilled['pages'] + 1)
+
+
+def test_read_artifact_results_are_not_spilled(dense_tokens):
+    governor = ResultGovernor(max_tokens=60, page_tokens=50)
+
+    def read(page):
+        return lambda engine, messages, kwargs: {'function_call': {'name': 'read_artifact', 'arguments': {
+            'artifact': json.loads(messages[-1]['content']).get('artifact'), 'page': page}}}
+    backend = MockBackend([read(1), read(2), 'Done.'])
+    agent = Agent('tester', 'You are a tester.', backend=backend, event_sink=NullSink(),
+                  result_governor=governor, ignore_none_function_messages=False)
+    handle = json.loads(governor.content('x' * 300))['artifact']
+    agent.receive_message({'role': 'user', 'content': json.dumps({'artifact': handle})}, print_output=False)
+    agent.think_and_act()
+
+    pages = [json.loads(message['content']) for message in agent.full_memory()
+             if message['role'] == 'function']
+    assert [page['page'] for page in pages] == [1, 2]
+    assert pages[0]['content'] + pages[1]['content'] == json.dumps('x' * 300)[:100]
+    assert governor.num_spilled == 1
+
+
+def test_artifact_store_counts_utf8_bytes():
+    store = ArtifactStore(max_bytes=10)
+    first = store.put('\u00e9' * 4)
+    assert store.num_bytes == 8
+    second = store.put('\u4e2d')
+    # The first text goes, although the two texts have 5 characters.
+    assert first not in store and second in store
+    assert store.num_bytes == 3
@@ -0,0 +1,105 @@
+import os
+import shutil
+
+from botplayers import Agent, AgentJournal, JournalStore, MockBackend, NullSink
+from botplayers.journal import _OFFSET_SIZE
+
+
+def message(idx):
+    return {'role': 'user', 'content': f'message {idx}'}
+
+
+def check_index(journal: AgentJournal):
+    """ Every offset of the index ends a line of the snapshot, and the last one ends the snapshot. """
+    offsets = journal._load_offsets()
+    with open(journal.snapshot_path, 'rb') as f:
+        snapshot = f.read()
+    assert offsets[-1] == len(snapshot)
+    assert all(snapshot[end - 1:end] == b'\n' for end in offsets)
+    assert [journal[idx] for idx in range(len(journal))] == journal.load()
+
+
+def test_resume_from_snapshot_and_journal(tmp_path):
+    store = JournalStore(str(tmp_path), snapshot_every=4)
+    for idx in range(10):
+        store.journal('bot').append(message(idx))
+    store.close()
+
+    journal = JournalStore(str(tmp_path), snapshot_every=4).journal('bot')
+    assert journal.snapshot_length() == 8
+    assert journal.load() == [message(idx) for idx in range(10)]
+    assert journal.load(7) == [message(idx) for idx in range(7, 10)]
+    check_index(journal)
+
+
+def test_journal_truncated_mid_line(tmp_path):
+    journal = AgentJournal(str(tmp_path / 'bot'))
+    for idx in range(3):
+        journal.append(message(idx))
+    with open(journal.journal_path, 'rb') as f:
+        data = f.read()
+    with open(journal.journal_path, 'wb') as f:
+        f.write(data[:-10])
+
+    resumed = AgentJournal(str(tmp_path / 'bot'))
+    assert resumed.load() == [message(0), message(1)]
+    # The torn line is dropped, so the next message is appended on a line of its own.
+    resumed.append(message(3))
+    assert AgentJournal(str(tmp_path / 'bot')).load() == [message(0), message(1), message(3)]
+
+
+def test_kill_between_snapshot_and_journal_truncation(tmp_path):
+    journal = AgentJournal(str(tmp_path / 'bot'), snapshot_every=None)
+    for idx in range(5):
+        journal.append(message(idx))
+    shutil.copy(journal.journal_path, str(tmp_path / 'journal.bak'))
+    journal.compact()
+    journal.close()
+    # The journal was not truncated yet when the process was killed.
+    shutil.copy(str(tmp_path / 'journal.bak'), journal.journal_path)
+
+    resumed = AgentJournal(str(tmp_path / 'bot'), snapshot_every=None)
+    assert len(resumed) == 5
+    assert resumed.load() == [message(idx) for idx in range(5)]
+    resumed.append(message(5))
+    resumed.compact()
+    assert AgentJournal(str(tmp_path / 'bot')).load() == [message(idx) for idx in range(6)]
+    check_index(resumed)
+
+
+def test_kill_before_the_index_is_written(tmp_path):
+    journal = AgentJournal(str(tmp_path / 'bot'), snapshot_every=None)
+    for idx in range(3):
+        journal.append(message(idx))
+    journal.compact()
+    for idx in range(3, 6):
+        journal.append(message(idx))
+    journal.close()
+    # A crashed compaction wrote the snapshot lines and part of an offset, but did not commit them.
+    with open(journal.snapshot_path, 'ab') as f:
+        f.write(b'{"role":"user","content":"message 3"}\n{"role":')
+    with open(journal.index_path, 'ab') as f:
+        f.write(b'\x00' * (_OFFSET_SIZE // 2))
+
+    resumed = AgentJournal(str(tmp_path / 'bot'), snapshot_every=None)
+    assert resumed.snapshot_length() == 3
+    assert resumed.load() == [message(idx) for idx in range(6)]
+    resumed.compact()
+    check_index(resumed)
+    assert AgentJournal(str(tmp_path / 'bot')).load() == [message(idx) for idx in range(6)]
+
+
+def test_resumed_agent_does_not_add_its_prompt_again(tmp_path):
+    def make_agent():
+        return Agent('bot', 'You are a bot.', backend=MockBackend(['Hello.']), event_sink=NullSink(),
+                     memory_store=JournalStore(str(tmp_path), snapshot_every=2),
+                     ignore_none_function_messages=False)
+    agent = make_agent()
+    agent.receive_message({'role': 'user', 'content': 'Hi'}, print_output=False)
+    agent.think_and_act()
+    expected = list(agent.full_memory())
+    assert os.path.exists(os.path.join(str(tmp_path), 'bot.journal.jsonl'))
+
+    resumed = make_agent()
+    assert resumed.full_memory() == expected
+    assert sum(message['role'] == 'system' for message in resumed.full_memory()) == 1
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from app.kernels import KernelPool
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    return str(tmp_path / 'workspace')
+
+
+def test_sessions_keep_their_variables_and_workspace(workspace):
+    pool = KernelPool(workspace=workspace, warm_kernels=0)
+    try:
+        assert pool.run('a', 'x = 1\nx + 1') == {'result': 2}
+        assert pool.run('a', 'import os\nx, os.getcwd()') == {'result': (1, pool.workspace_for('a'))}
+        assert 'NameError' in pool.run('b', 'x')['error']
+    finally:
+        pool.close()
+
+
+def test_preload_errors_are_reported(workspace):
+    pool = KernelPool(workspace=workspace, warm_kernels=0, preload=['no_such_module_for_kernels'])
+    try:
+        error = pool.run('a', '1')['error']
+        assert 'preloaded modules' in error and 'no_such_module_for_kernels' in error
+    finally:
+        pool.close()
+
+
+def test_code_does_not_run_outside_of_the_workspace(tmp_path):
+    # The workspace cannot be created under a file.
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    pool = KernelPool(workspace=str(blocker), warm_kernels=0)
+    try:
+        response = pool.run('a', 'open("created", "w").close()')
+        assert 'error' in response
+        assert not os.path.exists('created')
+    finally:
+        pool.close()
@@ -0,0 +1,77 @@
+import pytest
+
+from botplayers import Agent, Metrics, MockBackend, NullSink
+from botplayers import metrics as m
+from botplayers.metrics import Histogram
+
+
+def test_histogram_buckets_are_upper_bounds():
+    histogram = Histogram((1, 2, 5))
+    for value in (0.5, 1, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    assert histogram.sum == 16
+    assert histogram.max == 10
+
+
+def test_histogram_quantiles_interpolate_inside_buckets():
+    histogram = Histogram((1, 2, 5))
+    for value in (0.5, 1, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.quantile(0.2) == pytest.approx(0.5)
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    # The overflow bucket ends at the maximum.
+    assert histogram.quantile(1.0) == pytest.approx(10)
+    assert Histogram((1,)).quantile(0.5) == 0.0
+
+    single = Histogram((1, 2, 5))
+    single.observe(3)
+    assert single.quantile(0.99) == 3
+
+
+def test_prometheus_export():
+    metrics = Metrics()
+    metrics.inc('things_total', agent='a"b\\c\nd')
+    metrics.observe(m.TURN_SECONDS, 0.2, agent='x')
+    metrics.observe(m.TURN_SECONDS, 3, agent='x')
+    lines = metrics.to_prometheus().splitlines()
+
+    assert 'botplayers_things_total{agent="a\\"b\\\\c\\nd"} 1' in lines
+    assert '# TYPE botplayers_turn_seconds histogram' in lines
+    assert 'botplayers_turn_seconds_bucket{agent="x",le="0.1"} 0' in lines
+    assert 'botplayers_turn_seconds_bucket{agent="x",le="0.25"} 1' in lines
+    assert 'botplayers_turn_seconds_bucket{agent="x",le="5"} 2' in lines
+    assert 'botplayers_turn_seconds_bucket{agent="x",le="+Inf"} 2' in lines
+    assert 'botplayers_turn_seconds_sum{agent="x"} 3.2' in lines
+    assert 'botplayers_turn_seconds_count{agent="x"} 2' in lines
+
+
+def test_prometheus_export_types_custom_metrics_by_how_they_are_recorded():
+    metrics = Metrics()
+    metrics.set('queue_depth', 3)
+    metrics.inc('retries')
+    metrics.observe('batch_seconds_total', 0.2)
+    lines = metrics.to_prometheus().splitlines()
+
+    assert '# TYPE botplayers_queue_depth gauge' in lines
+    assert 'botplayers_queue_depth 3' in lines
+    assert '# TYPE botplayers_retries counter' in lines
+    assert '# TYPE botplayers_batch_seconds_total histogram' in lines
+
+
+def test_failed_turns_are_observed():
+    def fail(engine, messages, kwargs):
+        raise ConnectionError('down')
+
+    metrics = Metrics()
+    agent = Agent('tester', 'You are a tester.', backend=MockBackend(['ok', fail]),
+                  event_sink=NullSink(), metrics=metrics)
+    agent.receive_message({'role': 'user', 'content': 'Hi'}, print_output=False)
+    agent.think_and_act()
+    agent.receive_message({'role': 'user', 'content': 'Hi again'}, print_output=False)
+    with pytest.raises(ConnectionError):
+        agent.think_and_act()
+
+    assert metrics.get(m.TURN_SECONDS, agent='tester').count == 1
+    assert metrics.get(m.TURN_SECONDS, agent='tester', error='ConnectionError').count == 1
@@ -0,0 +1,181 @@
+import asyncio
+import time
+
+import pytest
+
+from botplayers import OpenAIBackend, RateLimitedBackend, RateLimiter
+from botplayers.backends import CompletionBackend
+from botplayers.util import _get_background_loop, run_sync
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f'HTTP {status}')
+        self.http_status = status
+
+
+class ScriptedBackend(CompletionBackend):
+    """ Fails with the scripted errors, then streams chunks; an error after chunks fails mid-stream. """
+
+    def __init__(self, errors=(), chunks=3, error_after_chunks=None):
+        self.errors = list(errors)
+        self.chunks = chunks
+        self.error_after_chunks = error_after_chunks
+        self.num_requests = 0
+
+    def _script(self):
+        self.num_requests += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        for idx in range(self.chunks):
+            yield {'choices': [{'delta': {'content': str(idx)}, 'finish_reason': None}]}
+        if self.error_after_chunks is not None:
+            raise self.error_after_chunks
+
+    def stream(self, engine, messages, **kwargs):
+        yield from self._script()
+
+    async def astream(self, engine, messages, **kwargs):
+        for chunk in self._script():
+            await asyncio.sleep(0)
+            yield chunk
+
+
+def rate_limited(backend, **kwargs):
+    return RateLimitedBackend(backend, initial_delay=0.01, max_delay=0.02, **kwargs)
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    limiter = RateLimiter(max_concurrency=1)
+    order = []
+
+    async def request(name, priority):
+        await limiter.aacquire(priority=priority)
+        order.append(name)
+        await asyncio.sleep(0)
+        limiter.release()
+
+    async def main():
+        await limiter.aacquire()
+        tasks = [asyncio.ensure_future(request(name, priority))
+                 for name, priority in [('a', 0), ('b', 1), ('c', 0), ('d', 1), ('e', 2)]]
+        await asyncio.sleep(0.01)
+        assert limiter.num_waiting == 5
+        limiter.release()
+        await asyncio.gather(*tasks)
+    asyncio.run(main())
+    assert order == ['e', 'b', 'd', 'a', 'c']
+
+
+def test_max_concurrency_is_respected():
+    limiter = RateLimiter(max_concurrency=3)
+    active = {'now': 0, 'max': 0}
+
+    async def request():
+        await limiter.aacquire()
+        active['now'] += 1
+        active['max'] = max(active['max'], active['now'])
+        await asyncio.sleep(0.01)
+        active['now'] -= 1
+        limiter.release()
+
+    async def main():
+        await asyncio.gather(*(request() for _ in range(10)))
+    asyncio.run(main())
+    assert active['max'] == 3
+    assert limiter.num_admitted == 10 and limiter.num_active == 0
+
+
+def test_token_rate_makes_requests_wait():
+    # 6000 tokens a minute, i.e. 100 a second.
+    limiter = RateLimiter(tokens_per_minute=6000)
+    limiter.acquire(tokens=6000)
+    limiter.release()
+    start = time.monotonic()
+    limiter.acquire(tokens=20)
+    limiter.release()
+    assert 0.15 <= time.monotonic() - start < 1.0
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_retries_rate_limits_and_server_errors(use_async):
+    inner = ScriptedBackend(errors=[HTTPError(429), HTTPError(503)])
+    backend = rate_limited(inner)
+    pauses = []
+    pause = backend.limiter.pause
+    backend.limiter.pause = lambda seconds: (pauses.append(seconds), pause(seconds))
+
+    if use_async:
+        async def collect():
+            return [chunk async for chunk in backend.astream('gpt-4', [])]
+        chunks = asyncio.run(collect())
+    else:
+        chunks = list(backend.stream('gpt-4', []))
+    assert len(chunks) == 3
+    assert inner.num_requests == 3
+    assert backend.num_retries == 2
+    # Only the rate limit error pauses the other requests.
+    assert len(pauses) == 1
+    assert backend.limiter.num_active == 0
+
+
+def test_other_errors_are_not_retried():
+    backend = rate_limited(ScriptedBackend(errors=[HTTPError(400)]))
+    with pytest.raises(HTTPError):
+        list(backend.stream('gpt-4', []))
+    assert backend.num_retries == 0 and backend.num_failures == 1
+
+
+def test_no_retry_after_a_chunk_was_streamed():
+    inner = ScriptedBackend(error_after_chunks=HTTPError(503))
+    backend = rate_limited(inner)
+    chunks = []
+    with pytest.raises(HTTPError):
+        for chunk in backend.stream('gpt-4', []):
+            chunks.append(chunk)
+    assert len(chunks) == 3
+    assert inner.num_requests == 1 and backend.num_retries == 0
+    assert backend.limiter.num_active == 0
+
+
+def test_slot_is_released_when_the_stream_is_abandoned():
+    backend = rate_limited(ScriptedBackend(), max_concurrency=1)
+    stream = backend.stream('gpt-4', [])
+    next(stream)
+    assert backend.limiter.num_active == 1
+    stream.close()
+    assert backend.limiter.num_active == 0
+
+    async def abandon():
+        stream = backend.astream('gpt-4', [])
+        await stream.__anext__()
+        assert backend.limiter.num_active == 1
+        await stream.aclose()
+    asyncio.run(abandon())
+    assert backend.limiter.num_active == 0
+
+
+class FakeSession:
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def test_openai_backend_closes_the_sessions_of_every_loop():
+    backend = OpenAIBackend()
+    running_loop, idle_loop = _get_background_loop(), asyncio.new_event_loop()
+    sessions = [FakeSession(), FakeSession()]
+    backend._sessions[running_loop], backend._sessions[idle_loop] = sessions
+    try:
+        backend.close()
+    finally:
+        idle_loop.close()
+    assert all(session.closed for session in sessions)
+    assert len(backend._sessions) == 0
+
+    async def aclose():
+        backend._sessions[asyncio.get_running_loop()] = session = FakeSession()
+        await backend.aclose()
+        return session
+    assert run_sync(aclose()).closed
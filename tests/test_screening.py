@@ -0,0 +1,36 @@
+from botplayers import Agent, InteractiveSpace, MockBackend, NullSink, agent_callable, ascreen
+
+
+class Database(InteractiveSpace):
+    info_list = ['Alice is born in 1990.', 'Bob is in New York.', 'Alice likes David.']
+
+    @agent_callable
+    async def review_info(self, agent: Agent):
+        """View the information from the database."""
+        result = await ascreen(agent, self.info_list)
+        return [self.info_list[idx] for idx in result.matches]
+
+
+def test_screening_inside_a_function_call_answers_the_pending_call():
+    for parallel_function_calls, call in [
+            (True, {'tool_calls': [{'id': 'call_1', 'name': 'review_info', 'arguments': {}}]}),
+            (False, {'function_call': {'name': 'review_info', 'arguments': {}}})]:
+        backend = MockBackend([call, '1, 3', 'Alice was born in 1990.'], record_requests=True)
+        agent = Agent('tester', 'You are a tester.', interactive_objects=[Database()], backend=backend,
+                      event_sink=NullSink(), ignore_none_function_messages=False,
+                      parallel_function_calls=parallel_function_calls)
+        agent.receive_message({'role': 'user', 'content': 'When was Alice born?'}, print_output=False)
+        agent.think_and_act()
+
+        screening_messages = backend.requests[1]['messages']
+        calling, pending = screening_messages[2], screening_messages[3]
+        if parallel_function_calls:
+            assert calling['tool_calls'][0]['id'] == 'call_1'
+            assert pending['role'] == 'tool' and pending['tool_call_id'] == 'call_1'
+        else:
+            assert calling['function_call']['name'] == 'review_info'
+            assert pending['role'] == 'function' and pending['name'] == 'review_info'
+        assert screening_messages[4]['role'] == 'user'
+
+        assert '["Alice is born in 1990.","Alice likes David."]' in agent.full_memory()[-2]['content'].replace(', ', ',')
+        assert agent.last_message()['content'] == 'Alice was born in 1990.'
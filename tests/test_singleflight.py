@@ -0,0 +1,161 @@
+import asyncio
+import threading
+
+import pytest
+
+from botplayers import SingleFlightBackend
+from botplayers.backends import CompletionBackend
+from botplayers.singleflight import AbandonedRequestError
+
+MESSAGES = [{'role': 'user', 'content': 'Hi'}]
+
+
+def chunk(text):
+    return {'choices': [{'delta': {'content': text}, 'finish_reason': None}]}
+
+
+class GatedBackend(CompletionBackend):
+    """ Streams 'a', then waits for the gate to stream 'b' or raise `error`. """
+
+    def __init__(self, error=None, first_chunk=True):
+        self.error = error
+        self.first_chunk = first_chunk
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.num_requests = 0
+
+    def stream(self, engine, messages, **kwargs):
+        self.num_requests += 1
+        self.started.set()
+        if self.first_chunk:
+            yield chunk('a')
+        self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        yield chunk('b')
+
+    async def astream(self, engine, messages, **kwargs):
+        self.num_requests += 1
+        self.started.set()
+        if self.first_chunk:
+            yield chunk('a')
+        await asyncio.get_running_loop().run_in_executor(None, self.gate.wait)
+        if self.error is not None:
+            raise self.error
+        yield chunk('b')
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def contents(chunks):
+    return ''.join(chunk['choices'][0]['delta']['content'] for chunk in chunks)
+
+
+def in_thread(function):
+    result = {}
+
+    def run():
+        try:
+            result['value'] = function()
+        except BaseException as e:
+            result['error'] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def wait_for_followers(backend: SingleFlightBackend, num_followers: int):
+    flight = next(iter(backend._flights.values()))
+    while len(flight._wakes) < num_followers:
+        threading.Event().wait(0.001)
+
+
+def test_sync_and_async_callers_share_a_flight():
+    inner = GatedBackend()
+    backend = SingleFlightBackend(inner)
+    leader, leader_result = in_thread(lambda: list(backend.stream('gpt-4', MESSAGES, temperature=0)))
+    inner.started.wait()
+
+    async def follow():
+        threading.Timer(0.05, inner.gate.set).start()
+        return [chunk async for chunk in backend.astream('gpt-4', MESSAGES, temperature=0)]
+    follower_chunks = asyncio.run(follow())
+    leader.join()
+
+    assert contents(leader_result['value']) == contents(follower_chunks) == 'ab'
+    assert inner.num_requests == 1
+    assert backend.num_sent == 1 and backend.num_coalesced == 1
+    assert backend.num_in_flight == 0
+
+
+def test_errors_reach_every_caller():
+    inner = GatedBackend(error=ValueError('boom'))
+    backend = SingleFlightBackend(inner)
+    leader, leader_result = in_thread(lambda: list(backend.stream('gpt-4', MESSAGES, temperature=0)))
+    inner.started.wait()
+    follower, follower_result = in_thread(lambda: list(backend.stream('gpt-4', MESSAGES, temperature=0)))
+    wait_for_followers(backend, 1)
+    inner.gate.set()
+    leader.join()
+    follower.join()
+
+    assert isinstance(leader_result['error'], ValueError)
+    assert follower_result['error'] is leader_result['error']
+    assert inner.num_requests == 1
+
+
+def test_sampled_requests_are_not_coalesced():
+    inner = GatedBackend()
+    inner.gate.set()
+    backend = SingleFlightBackend(inner)
+    list(backend.stream('gpt-4', MESSAGES))
+    list(backend.stream('gpt-4', MESSAGES))
+    assert inner.num_requests == 2 and backend.num_bypassed == 2
+
+
+def test_followers_without_chunks_send_an_abandoned_request():
+    inner = GatedBackend(first_chunk=False)
+    backend = SingleFlightBackend(inner)
+
+    async def main():
+        leader = asyncio.ensure_future(backend.astream('gpt-4', MESSAGES, temperature=0).__anext__())
+        while not inner.started.is_set():
+            await asyncio.sleep(0.001)
+        follower = asyncio.ensure_future(_collect(backend.astream('gpt-4', MESSAGES, temperature=0)))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        inner.gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+    assert contents(asyncio.run(main())) == 'b'
+    assert inner.num_requests == 2
+
+
+def test_followers_with_chunks_raise_when_the_request_is_abandoned():
+    inner = GatedBackend()
+    backend = SingleFlightBackend(inner)
+
+    async def main():
+        leader_stream = backend.astream('gpt-4', MESSAGES, temperature=0)
+        await leader_stream.__anext__()
+        replayed = []
+
+        async def follow():
+            async for chunk in backend.astream('gpt-4', MESSAGES, temperature=0):
+                replayed.append(chunk)
+        follower = asyncio.ensure_future(follow())
+        while not replayed:
+            await asyncio.sleep(0.001)
+        # The leader stops reading, e.g. because it was cancelled.
+        await leader_stream.aclose()
+        with pytest.raises(AbandonedRequestError):
+            await follower
+        inner.gate.set()
+        return replayed
+    assert contents(asyncio.run(main())) == 'a'
+    assert inner.num_requests == 1
+    assert backend.num_in_flight == 0
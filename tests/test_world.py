@@ -0,0 +1,56 @@
+import asyncio
+
+from botplayers import Agent, MockBackend, NullSink, World
+from botplayers.world import PRIORITY, estimate_prompt_tokens
+
+
+def make_agents(num_agents, latency=0.05, **kwargs):
+    backend = MockBackend(default_response='ok', latency=latency)
+    agents = [Agent(f'agent{idx}', 'You are an agent. ' * 20, backend=backend,
+                    event_sink=NullSink(), **kwargs) for idx in range(num_agents)]
+    for agent in agents:
+        agent.receive_message({'role': 'user', 'content': 'hello'}, print_output=False)
+    return agents, backend
+
+
+def test_round_runs_every_eligible_agent_concurrently():
+    agents, backend = make_agents(20)
+    world = World(agents, max_concurrency=20)
+    stats = world.run_round_sync()
+    assert (stats.eligible, stats.ran, stats.deferred, stats.errors) == (20, 20, 0, 0)
+    assert stats.duration < 0.5
+    assert backend.num_requests == 20
+    assert world.eligible_agents() == []
+
+
+def test_token_budget_is_reserved_before_agents_start():
+    agents, backend = make_agents(10)
+    per_turn = estimate_prompt_tokens(agents[0])
+    assert per_turn > 0
+    # All agents could start at once, but the budget only covers three turns.
+    world = World(agents, max_concurrency=10, round_token_budget=3 * per_turn)
+    stats = world.run_round_sync()
+    assert stats.ran == 3
+    assert stats.deferred == 7
+    assert backend.num_requests == 3
+    # The deferred agents go first in the next round.
+    ran_first = {agent.name for agent in agents if world._runs[agent.name]}
+    world.run_round_sync()
+    assert not ran_first & {agent.name for agent in agents if world._runs[agent.name] == 2}
+
+
+def test_priority_policy_and_errors():
+    agents, _ = make_agents(3, priority=0)
+    agents[2].priority = 5
+
+    class Broken(MockBackend):
+        async def astream(self, engine, messages, **kwargs):
+            raise RuntimeError('backend down')
+            yield
+
+    agents[1].backend = Broken()
+    world = World(agents, max_concurrency=1, policy=PRIORITY)
+    assert world.eligible_agents()[0] is agents[2]
+    stats = asyncio.run(world.run_round())
+    assert stats.errors == 1
+    assert isinstance(world.last_errors[0], RuntimeError)